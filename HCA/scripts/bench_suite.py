@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+"""Benchmarks of the tokenizer and word cloud scripts, with a baseline.
+
+Times, on deterministic synthetic inputs:
+
+  tokenizer.import     importing tokenizer.py, in a fresh interpreter
+  tokenizer.first      the first encode(), loading the letter table
+  tokenizer.encode     encode() of each line of multilingual text
+  tokenizer.decode     decode() of the tokens of each line
+  cloud.generate       WordCloud.generate_from_frequencies()
+  cloud.to_image       WordCloud.to_image() of the generated layout
+  occupancy.update     IntegralOccupancyMap.update() per placed word
+  occupancy.update_box IntegralOccupancyMap.update_box(), for comparison
+
+The text mixes Latin, Greek, Cyrillic, Arabic, Devanagari, Han and
+Hangul lines, with digits, punctuation and characters beyond the Basic
+Multilingual Plane, in sizes given by --text.  Clouds are drawn from
+Zipfian (word, frequency, rank) triples for each of --words on each
+canvas of --sizes, with no mask and with an ellipse mask.  Everything is
+generated from --seed, so runs on the same versions do the same work.
+
+Each case is run --warmup times to fill the font, extent and mask
+caches, then timed at least --repeat times and for --min-time seconds,
+so quick cases get enough runs for steady percentiles, but no more once
+--max-time seconds have gone.  Reported are the latency mean and
+percentiles, the throughput, the peak of memory traced by tracemalloc
+during one more run, and the peak resident size of the process over the
+timed runs where Linux lets it be reset.  -o writes all of it, with the
+Python, NumPy and Pillow versions, as JSON.
+
+A JSON file of an earlier run given as --baseline is compared case by
+case: a median latency more than --threshold, or a traced peak more
+than --memory-threshold and 1MB, above the baseline's is a regression,
+and the exit status is 1.  So, before and after upgrading Pillow or NumPy:
+    bench_suite.py -o base.json
+    bench_suite.py --baseline base.json --threshold 0.2
+
+Needs the modified "wordcloud.py" installed in the wordcloud package,
+see README.txt, and a font, from FONT_PATH or --fontfile.
+
+Usage:
+    bench_suite.py [--filter REGEX] [--quick] [-o OUT.json]
+                   [--baseline OLD.json] [--threshold 0.2]
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from random import Random
+
+import numpy as np
+
+# the wordcloud.py beside this script belongs inside the installed package
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path = [p for p in sys.path if os.path.abspath(p or ".") != _here]
+
+import PIL
+from wordcloud import WordCloud
+from wordcloud.wordcloud import IntegralOccupancyMap
+
+# with the package loaded, the scripts beside this one can be imported
+sys.path.append(_here)
+import tokenizer
+from bench_wordcloud import parse_sizes, random_boxes
+
+# letters of the scripts of the synthetic text, as (first, last) code
+# points, and the weight of each among lines; "han" and "hangul" words
+# are not separated by spaces
+SCRIPTS = (
+    ("latin", [(0x61, 0x7A), (0xE0, 0xFC)], 30),
+    ("greek", [(0x3B1, 0x3C9)], 8),
+    ("cyrillic", [(0x430, 0x44F)], 12),
+    ("arabic", [(0x627, 0x64A)], 8),
+    ("devanagari", [(0x915, 0x939), (0x93E, 0x94C)], 8),
+    ("han", [(0x4E00, 0x9FFF)], 14),
+    ("hangul", [(0xAC00, 0xD7A3)], 10),
+    # mathematical letters and emoji, beyond the Basic Multilingual Plane
+    ("astral", [(0x1D400, 0x1D433), (0x1F600, 0x1F64F)], 2),
+)
+
+PUNCTUATION = u",.;:!?-()\"'"
+
+TEXT_SIZES = "1024,65536,1048576"
+WORDS = "50,200,2000"
+SIZES = "400x200,1280x720,3840x2160"
+QUICK = {"text": "1024,65536", "words": "50,200",
+         "sizes": "400x200,800x400"}
+
+# placed words timed per occupancy map case
+UPDATE_WORDS = 200
+
+# growth of the traced peak, in bytes, never taken as a regression
+MEMORY_SLACK = 1 << 20
+
+
+def _word(random_state, ranges, length):
+    chars = []
+    for _ in range(length):
+        lo, hi = ranges[random_state.randrange(len(ranges))]
+        chars.append(chr(random_state.randint(lo, hi)))
+    return u"".join(chars)
+
+
+def synthetic_text(size, seed=0):
+    """Lines of multilingual text, of at least size bytes of UTF-8.
+
+    Returns
+    -------
+    lines : list of unicode strings
+    """
+    random_state = Random(seed)
+    weights = [weight for _, _, weight in SCRIPTS]
+    lines = []
+    total = 0
+    while total < size:
+        name, ranges, _ = random_state.choices(SCRIPTS, weights)[0]
+        joiner = u"" if name in ("han", "hangul") else u" "
+        words = []
+        for _ in range(random_state.randint(4, 20)):
+            if random_state.random() < 0.05:
+                words.append(u"%d" % random_state.randint(0, 10000))
+            else:
+                # short words are the most common, as in running text
+                length = min(12, 1 + int(random_state.expovariate(0.3)))
+                words.append(_word(random_state, ranges, length))
+            if random_state.random() < 0.1:
+                words[-1] += random_state.choice(PUNCTUATION) + u" "
+        line = joiner.join(words).strip()
+        lines.append(line)
+        total += len(line.encode("utf-8")) + 1
+    return lines
+
+
+def zipf_triples(n_words, seed=0, exponent=1.1):
+    """Zipfian (word, frequency, rank) triples, most frequent first.
+
+    Words are distinct Latin strings; rank falls from 1 to 0, as the
+    lightness of random_color_func() expects.
+    """
+    random_state = Random(seed)
+    words = set()
+    triples = []
+    while len(triples) < n_words:
+        length = 3 + min(9, int(random_state.expovariate(0.4)))
+        word = _word(random_state, SCRIPTS[0][1], length)
+        if word in words:
+            continue
+        words.add(word)
+        i = len(triples)
+        triples.append((word, 1.0 / (i + 1) ** exponent,
+                        1.0 - float(i) / n_words))
+    return triples
+
+
+def ellipse_mask(width, height):
+    """A (height, width) uint8 mask, white (masked out) outside an ellipse."""
+    y, x = np.ogrid[:height, :width]
+    inside = (((x - width / 2.0) / (width / 2.0)) ** 2 +
+              ((y - height / 2.0) / (height / 2.0)) ** 2) <= 1
+    return np.where(inside, 0, 255).astype(np.uint8)
+
+
+class Case(object):
+    """A benchmark: untimed setup, timed run, and the work of one run.
+
+    Parameters
+    ----------
+    name : string
+        Unique, "group/param/...".
+
+    setup : callable
+        Returns the state given to run.
+
+    run : callable
+        run(state) is timed.
+
+    work : float
+        Units of work per run, for the throughput.
+
+    unit : string
+        Name of the units, e.g. "bytes".
+
+    params : dict
+        Recorded in the results.
+
+    self_timed : bool (default=False)
+        run returns its own time in seconds, e.g. of another process.
+    """
+
+    def __init__(self, name, setup, run, work, unit, params,
+                 self_timed=False):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.work = work
+        self.unit = unit
+        self.params = params
+        self.self_timed = self_timed
+
+
+def _import_time():
+    """Seconds to import tokenizer and for its first encode(), measured
+    in a fresh interpreter."""
+    code = ("import sys, time\n"
+            "sys.path.insert(0, %r)\n"
+            "start = time.perf_counter()\n"
+            "import tokenizer\n"
+            "imported = time.perf_counter()\n"
+            "tokenizer.encode(u'Dude - that is so cool.')\n"
+            "print(imported - start, time.perf_counter() - imported)\n"
+            % _here)
+    out = subprocess.check_output([sys.executable, "-c", code])
+    return [float(v) for v in out.split()]
+
+
+def tokenizer_cases(sizes, seed=0):
+    """Cases of the tokenizer, on text of each of sizes bytes."""
+    cases = [
+        Case("tokenizer.import", lambda: None,
+             lambda state: _import_time()[0], 1, "imports", {}, True),
+        Case("tokenizer.first", lambda: None,
+             lambda state: _import_time()[1], 1, "loads", {}, True),
+    ]
+    for size in sizes:
+        lines = synthetic_text(size, seed)
+        nbytes = sum(len(line.encode("utf-8")) + 1 for line in lines)
+        tokens = [tokenizer.encode(line) for line in lines]
+        if [tokenizer.decode(t) for t in tokens] != lines:
+            raise AssertionError("tokenizer does not invert the text of "
+                                 "%d bytes" % size)
+        params = {"bytes": nbytes, "lines": len(lines)}
+        cases.append(Case(
+            "tokenizer.encode/%d" % size, lambda lines=lines: lines,
+            lambda lines: [tokenizer.encode(line) for line in lines],
+            nbytes, "bytes", params))
+        cases.append(Case(
+            "tokenizer.decode/%d" % size, lambda tokens=tokens: tokens,
+            lambda tokens: [tokenizer.decode(t) for t in tokens],
+            nbytes, "bytes", params))
+    return cases
+
+
+def cloud_cases(words, sizes, seed=0, **options):
+    """Cases of layout and drawing, for each of words on each canvas,
+    with and without a mask; options are passed on to WordCloud."""
+    cases = []
+    for width, height in sizes:
+        for masked in (False, True):
+            mask = ellipse_mask(width, height) if masked else None
+            for n_words in words:
+                triples = zipf_triples(n_words, seed)
+                params = {"words": n_words, "width": width, "height": height,
+                          "mask": "ellipse" if masked else None}
+                suffix = "/%dx%d/%d%s" % (width, height, n_words,
+                                          "/ellipse" if masked else "")
+
+                def generate(triples=triples, mask=mask, width=width,
+                             height=height):
+                    # a fresh random state, so every run lays out the same
+                    wc = WordCloud(width=width, height=height, mask=mask,
+                                   max_words=len(triples),
+                                   random_state=Random(seed), **options)
+                    return wc.generate_from_frequencies(triples)
+
+                cases.append(Case("cloud.generate" + suffix, lambda: None,
+                                  lambda state, generate=generate: generate(),
+                                  n_words, "words", params))
+                cases.append(Case("cloud.to_image" + suffix, generate,
+                                  lambda wc: wc.to_image(),
+                                  width * height, "pixels", params))
+    return cases
+
+
+def _update(state):
+    height, width, boxes = state
+    img = np.zeros((height, width), dtype=np.uint8)
+    occupancy = IntegralOccupancyMap(height, width, None)
+    for x, y, h, w in boxes:
+        img[x:x + h, y:y + w] = 255
+        occupancy.update(img, x, y)
+
+
+def _update_box(state):
+    height, width, boxes = state
+    occupancy = IntegralOccupancyMap(height, width, None)
+    for x, y, h, w in boxes:
+        occupancy.update_box(np.full((h, w), 255, dtype=np.uint32), x, y)
+
+
+def occupancy_cases(sizes, seed=0):
+    """Cases of the occupancy map updates on each canvas."""
+    cases = []
+    for width, height in sizes:
+        state = (height, width, random_boxes(height, width, UPDATE_WORDS,
+                                             seed))
+        params = {"words": UPDATE_WORDS, "width": width, "height": height}
+        for name, run in (("update", _update), ("update_box", _update_box)):
+            cases.append(Case("occupancy.%s/%dx%d" % (name, width, height),
+                              lambda state=state: state, run, UPDATE_WORDS,
+                              "updates", params))
+    return cases
+
+
+def _reset_peak_rss():
+    """Reset the peak resident size of the process, if Linux lets us."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _peak_rss():
+    """Peak resident size of the process in bytes, or None."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def summarise(times):
+    """Mean, percentiles, minimum and maximum of latencies in seconds."""
+    times = np.asarray(times, dtype=np.float64)
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {"mean": float(times.mean()), "p50": float(p50),
+            "p90": float(p90), "p99": float(p99),
+            "min": float(times.min()), "max": float(times.max())}
+
+
+def run_case(case, repeat=5, warmup=1, min_time=1.0, max_time=10.0):
+    """Time a case, at least repeat times and for min_time seconds, but
+    no more runs once max_time seconds have gone.
+
+    Returns
+    -------
+    result : dict
+        Latencies, throughput in units per second, peak traced memory
+        and peak resident size in bytes, with the case parameters.
+    """
+    state = case.setup()
+    for _ in range(warmup):
+        case.run(state)
+    rss = _reset_peak_rss()
+    times = []
+    started = time.perf_counter()
+    while True:
+        start = time.perf_counter()
+        out = case.run(state)
+        times.append(out if case.self_timed else
+                     time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+        if elapsed > max_time or (len(times) >= repeat and
+                                  elapsed >= min_time):
+            break
+    peak_rss = _peak_rss() if rss else None
+    tracemalloc.start()
+    try:
+        case.run(state)
+        peak_traced = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    latency = summarise(times)
+    return {"params": case.params, "repeat": len(times), "latency": latency,
+            "throughput": case.work / latency["p50"]
+            if latency["p50"] > 0 else None,
+            "unit": case.unit + "/s", "peak_traced": peak_traced,
+            "peak_rss": peak_rss}
+
+
+def environment(args):
+    """Versions and settings recorded with the results."""
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "numpy": np.__version__, "pillow": PIL.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "seed": args.seed, "repeat": args.repeat, "warmup": args.warmup,
+            "min_time": args.min_time, "max_time": args.max_time,
+            "font": args.fontfile or os.environ.get("FONT_PATH")}
+
+
+def compare(results, baseline, threshold=0.2, memory_threshold=0.2):
+    """Compare results with a baseline, case by case.
+
+    Returns
+    -------
+    rows : list of (name, old p50, new p50, time change, memory change,
+        status) tuples, status being "ok", "faster", "REGRESSION", "new"
+        or "gone"; changes are fractions, None where not comparable.
+    """
+    rows = []
+    for name in sorted(set(results) | set(baseline)):
+        if name not in baseline:
+            rows.append((name, None, results[name]["latency"]["p50"],
+                         None, None, "new"))
+            continue
+        if name not in results:
+            rows.append((name, baseline[name]["latency"]["p50"], None,
+                         None, None, "gone"))
+            continue
+        old, new = baseline[name], results[name]
+        change = new["latency"]["p50"] / old["latency"]["p50"] - 1 \
+            if old["latency"]["p50"] > 0 else None
+        memory = new["peak_traced"] / float(old["peak_traced"]) - 1 \
+            if old.get("peak_traced") else None
+        # small peaks, e.g. of drawing in Pillow's own memory, are noise
+        grown = new["peak_traced"] > (old["peak_traced"] *
+                                      (1 + memory_threshold) + MEMORY_SLACK)
+        status = "ok"
+        if (change is not None and change > threshold) or grown:
+            status = "REGRESSION"
+        elif change is not None and change < -threshold:
+            status = "faster"
+        rows.append((name, old["latency"]["p50"], new["latency"]["p50"],
+                     change, memory, status))
+    return rows
+
+
+def _ms(seconds):
+    return "-" if seconds is None else "%.3f" % (1000 * seconds)
+
+
+def _percent(change):
+    return "-" if change is None else "%+.1f%%" % (100 * change)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tokenizer and word clouds on synthetic "
+        "data, optionally against a baseline.")
+    parser.add_argument("--text", default=TEXT_SIZES,
+                        help="text sizes in bytes, comma separated")
+    parser.add_argument("--words", default=WORDS,
+                        help="words per cloud, comma separated")
+    parser.add_argument("--sizes", default=SIZES,
+                        help="canvas sizes WxH, comma separated")
+    parser.add_argument("--quick", action="store_true",
+                        help="small sizes only: --text %s --words %s "
+                        "--sizes %s" % (QUICK["text"], QUICK["words"],
+                                        QUICK["sizes"]))
+    parser.add_argument("--filter", metavar="REGEX",
+                        help="only cases whose name matches")
+    parser.add_argument("--list", action="store_true",
+                        help="list the cases and exit")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timed runs per case")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="untimed runs per case first")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="seconds a case is repeated for at least")
+    parser.add_argument("--max-time", type=float, default=10.0,
+                        help="seconds after which a case stops repeating")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic data")
+    parser.add_argument("--fontfile", help="font file to use")
+    parser.add_argument("-o", "--output", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON file of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="median latency increase that is a regression")
+    parser.add_argument("--memory-threshold", type=float, default=0.2,
+                        help="traced peak increase that is a regression")
+    args = parser.parse_args()
+    if args.quick:
+        for key, value in QUICK.items():
+            if getattr(args, key) == parser.get_default(key):
+                setattr(args, key, value)
+    options = {"font_path": args.fontfile} if args.fontfile else {}
+    cases = (tokenizer_cases([int(v) for v in args.text.split(",")],
+                             args.seed) +
+             cloud_cases([int(v) for v in args.words.split(",")],
+                         parse_sizes(args.sizes), args.seed, **options) +
+             occupancy_cases(parse_sizes(args.sizes), args.seed))
+    if args.filter:
+        cases = [case for case in cases if re.search(args.filter, case.name)]
+    if args.list:
+        for case in cases:
+            print(case.name)
+        sys.exit(0)
+    results = {}
+    print("%-42s %6s %10s %10s %10s %18s %9s %9s" % (
+        "case", "runs", "p50 ms", "p90 ms", "p99 ms", "throughput",
+        "peak MB", "rss MB"))
+    for case in cases:
+        result = run_case(case, args.repeat, args.warmup, args.min_time,
+                          args.max_time)
+        results[case.name] = result
+        latency = result["latency"]
+        print("%-42s %6d %10s %10s %10s %18s %9.1f %9s" % (
+            case.name, result["repeat"], _ms(latency["p50"]),
+            _ms(latency["p90"]), _ms(latency["p99"]),
+            "%.4g %s" % (result["throughput"], result["unit"])
+            if result["throughput"] else "-",
+            result["peak_traced"] / 1e6,
+            "-" if result["peak_rss"] is None else
+            "%.1f" % (result["peak_rss"] / 1e6)))
+        sys.stdout.flush()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(args), "cases": results},
+                      f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if args.filter:
+            baseline["cases"] = dict(
+                (name, value) for name, value in baseline["cases"].items()
+                if re.search(args.filter, name))
+        rows = compare(results, baseline["cases"], args.threshold,
+                       args.memory_threshold)
+        print("\n%-42s %10s %10s %8s %8s  %s" % (
+            "case", "base ms", "now ms", "time", "memory", "status"))
+        for name, old, new, change, memory, status in rows:
+            print("%-42s %10s %10s %8s %8s  %s" % (
+                name, _ms(old), _ms(new), _percent(change),
+                _percent(memory), status))
+        if any(row[-1] == "REGRESSION" for row in rows):
+            sys.exit(1)
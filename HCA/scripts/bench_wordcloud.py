@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Time the word cloud layout primitives against canvas size.
+
+Reports the cost per placed word of the occupancy map update: the old
+IntegralOccupancyMap.update(), which redoes the cumulative sums over the
+whole region below and right of the word from a copy of the canvas, and
+update_box(), which only sums the word's own box.
+
+Then the cost of one position query on a canvas half full of words, for
+the compiled query_integral_image extension, if it is built, the NumPy
+query_integral_image_numpy(), and the coarse to fine search of
+PyramidOccupancyMap.  All are given the same random state and must
+return the same positions.
+
+Words are simulated as random filled boxes, so no fonts are needed.
+
+Usage:
+    bench_wordcloud.py [--words 200] [--sizes 400x200,800x400,1600x800]
+"""
+
+import argparse
+import os
+import sys
+import time
+from random import Random
+
+import numpy as np
+
+# the wordcloud.py beside this script belongs inside the installed package
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path = [p for p in sys.path if os.path.abspath(p or ".") != _here]
+
+from wordcloud.wordcloud import (IntegralOccupancyMap, PyramidOccupancyMap,
+                                 query_integral_image_numpy)
+try:
+    from wordcloud.query_integral_image import query_integral_image
+except ImportError:
+    query_integral_image = None
+
+
+def random_boxes(height, width, n_words, seed=0):
+    """List of n_words (x, y, h, w) boxes, biggest first, inside the canvas."""
+    random_state = Random(seed)
+    boxes = []
+    for i in range(n_words):
+        h = max(2, int(height / 4.0 / (1 + 0.1 * i)))
+        w = max(2, min(width - 1, 4 * h))
+        boxes.append((random_state.randint(0, height - h),
+                      random_state.randint(0, width - w), h, w))
+    return boxes
+
+
+def bench_update(height, width, boxes):
+    """Seconds per word for update() and for update_box().
+
+    Both maps are checked to end up with the same integral image.
+    """
+    img = np.zeros((height, width), dtype=np.uint8)
+    old = IntegralOccupancyMap(height, width, None)
+    start = time.time()
+    for x, y, h, w in boxes:
+        img[x:x + h, y:y + w] = 255
+        # as generate_from_frequencies did, take a fresh copy of the canvas
+        old.update(np.array(img), x, y)
+    old_time = time.time() - start
+
+    img[:] = 0
+    new = IntegralOccupancyMap(height, width, None)
+    start = time.time()
+    for x, y, h, w in boxes:
+        before = img[x:x + h, y:y + w].astype(np.int32)
+        img[x:x + h, y:y + w] = 255
+        delta = img[x:x + h, y:y + w].astype(np.int32) - before
+        new.update_box(delta.astype(np.uint32), x, y)
+    new_time = time.time() - start
+    if not np.array_equal(old.integral, new.integral):
+        raise AssertionError("update() and update_box() differ at %dx%d"
+                             % (width, height))
+    return old_time / len(boxes), new_time / len(boxes)
+
+
+def bench_query(height, width, boxes, n_queries=20, seed=0):
+    """Seconds per query for the compiled, NumPy and pyramid engines.
+
+    The first half of boxes is drawn on the canvas, then boxes from the
+    second half are queried.  The compiled time is None if not built.
+    """
+    occupancy = PyramidOccupancyMap(height, width, None)
+    half = len(boxes) // 2
+    for x, y, h, w in boxes[:half]:
+        occupancy.update_box(np.full((h, w), 255, dtype=np.uint32), x, y)
+    sizes = [(h, w) for x, y, h, w in boxes[half:]][:n_queries]
+    pyramid = lambda integral, h, w, random_state: \
+        occupancy.sample_position(h, w, random_state)
+    times = []
+    results = []
+    for engine in (query_integral_image, query_integral_image_numpy, pyramid):
+        if engine is None:
+            times.append(None)
+            continue
+        random_state = Random(seed)
+        start = time.time()
+        results.append([engine(occupancy.integral, h, w, random_state)
+                        for h, w in sizes])
+        times.append((time.time() - start) / len(sizes))
+    if any(result != results[0] for result in results):
+        raise AssertionError("query engines differ at %dx%d" % (width, height))
+    return times
+
+
+def parse_sizes(text):
+    """Parse "WxH,WxH" into a list of (width, height)."""
+    return [tuple(int(v) for v in size.split("x")) for size in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time word cloud layout primitives against canvas size.")
+    parser.add_argument("--words", type=int, default=200,
+                        help="words placed per canvas")
+    parser.add_argument("--sizes",
+                        default="400x200,800x400,1600x800,3840x2160",
+                        help="canvas sizes WxH, comma separated")
+    args = parser.parse_args()
+    sizes = parse_sizes(args.sizes)
+    print("%-10s %12s %12s %8s" % ("canvas", "update ms", "box ms", "speedup"))
+    for width, height in sizes:
+        boxes = random_boxes(height, width, args.words)
+        old, new = bench_update(height, width, boxes)
+        print("%-10s %12.3f %12.3f %8.1f" % ("%dx%d" % (width, height),
+                                             1000 * old, 1000 * new,
+                                             old / new))
+    print("\n%-10s %12s %12s %12s" % ("canvas", "compiled ms", "numpy ms",
+                                      "pyramid ms"))
+    for width, height in sizes:
+        boxes = random_boxes(height, width, args.words)
+        compiled, numpy_time, pyramid = bench_query(height, width, boxes)
+        print("%-10s %12s %12.3f %12.3f" % (
+            "%dx%d" % (width, height),
+            "not built" if compiled is None else "%.3f" % (1000 * compiled),
+            1000 * numpy_time, 1000 * pyramid))
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+"""Topic coherence from word co-occurrence in a reference corpus.
+
+Replaces the chain of linkCoco, cooc2pmi.pl and mkmat.pl followed by
+"hca -p", which passes text files between single threaded stages.  The
+reference corpus is read through hcacorpus.py and co-occurrences are
+counted straight into sparse arrays, a batch of documents at a time, in
+parallel with n_jobs, for only the words that matter: the top n words of
+every topic.  Two kinds of co-occurrence are counted:
+
+  document  (default) the number of documents holding both words, with
+            p(a, b) = n_ab / D and p(a) = df_a / D;
+  window    with a window of w, the number of pairs of tokens less than
+            w apart, with p(a, b) = n_ab / 2P over the P such pairs of all
+            tokens, and p(a) = n_a / N over all N tokens.  A pair is
+            counted whichever word comes first, so out of 2P ordered
+            pairs, and independent words score 0.  This needs the word
+            order, so lst or witdit data.
+
+From these PMI = log p(a, b) / p(a) p(b), natural logarithms as in
+cooc2pmi.pl, or NPMI = PMI / -log p(a, b).  Pairs never seen together
+are given 0, as hca does for pairs missing from its STEM.pmi file, or -1
+for NPMI.  The coherence of a topic is as report_pmi() in util/pmi.c
+computes it, the sum of the values of its pairs of words over n^2, and
+is found for all topics at once by a lookup of every pair in the sorted
+pair keys.
+
+Topics are the top n words of the rows of MODEL.phi or MODEL.nwt, or
+read from a MODEL.toplst file.  If the reference corpus has another
+vocabulary, give the model's with --tokens; words are matched to the
+corpus's STEM.tokens by string, as mkmat.pl does.
+
+The summary line "= X" is the mean coherence weighted by topic
+proportion, as report_pmi() weights it for hca's "PMI =" line.  The
+proportions are read from the "probs =" line of MODEL.log, or else
+estimated by each topic's share of the word counts of MODEL.nwt; with
+neither the mean is unweighted, and marked so.
+
+With --pmi, the values are also written as a "N M PMI" file in model
+word indices, as mkmat.pl writes for "hca -p".
+
+Usage:
+    coherence.py [-n 10] [--window 10] [--npmi] [--pmi OUT] MODEL STEM
+    coherence.py --check [--window 10]
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+import hcacorpus
+import hcamat
+import topwords
+
+# pending pair keys merged once there are this many
+MERGE_SIZE = 1 << 22
+
+Cooccurrence = collections.namedtuple(
+    "Cooccurrence", "words counts keys pair_counts total pair_total")
+Cooccurrence.__doc__ = """Sparse co-occurrence counts of a set of words.
+
+words : array of shape (V,)
+    Corpus word id of each local word id.
+counts : array of shape (V,)
+    Documents, or tokens, holding each word.
+keys, pair_counts : arrays of shape (pairs,)
+    Sorted keys a * V + b, a < b, of local word pairs seen together, and
+    their counts.
+total, pair_total : int
+    What counts and pair_counts are out of: D and D, or N and 2P.
+"""
+
+
+def read_toplst(path):
+    """Read a .toplst file, lines "k: w w w ...", into a dict k -> words."""
+    topics = {}
+    with open(path) as f:
+        for line in f:
+            head, sep, rest = line.partition(":")
+            # hca ends the file with a "-1:" line that is not a topic
+            if sep and not line.startswith("#") and int(head) >= 0:
+                topics[int(head)] = [int(w) for w in rest.split()]
+    return topics
+
+
+def topic_words(model, n=10):
+    """Top words of every topic, as a (T, n) array padded with -1.
+
+    model is a .phi or .nwt file, ranked by topwords.top_k(), or a
+    .toplst file.
+    """
+    if model.endswith(".toplst"):
+        topics = read_toplst(model)
+        T = max(topics) + 1 if topics else 0
+        words = np.full((T, n), -1, dtype=np.int64)
+        for k, row in topics.items():
+            row = row[:n]
+            words[k, :len(row)] = row
+        return words
+    index, weight = topwords.top_k(topwords._load_model(model), n)
+    return index.astype(np.int64)
+
+
+def topic_proportions(model):
+    """Topic proportions of a model, as report_pmi() weights topics by.
+
+    Taken from the last "probs =" line hca writes to the MODEL.log file
+    of the same stem, which gives them exactly, else estimated by each
+    topic's share of the word counts of the .nwt file of the same stem.
+    Returns None if there is neither.
+    """
+    stem = os.path.splitext(model)[0]
+    tp = None
+    if os.path.exists(stem + ".log"):
+        with open(stem + ".log") as f:
+            for line in f:
+                if line.startswith("probs ="):
+                    tp = line.split("=", 1)[1].split()
+    if tp:
+        return np.array([0 if p == "-" else float(p) for p in tp])
+    if os.path.exists(stem + ".nwt"):
+        tp = hcamat.load_nwt(stem + ".nwt").sum(axis=1, dtype=np.float64)
+        return tp / tp.sum()
+    return None
+
+
+def map_vocab(model_tokens, corpus_tokens):
+    """Corpus word id of each model word id, -1 where not in the corpus."""
+    where = {}
+    for w, token in enumerate(corpus_tokens):
+        where.setdefault(token, w)
+    return np.array([where.get(token, -1) for token in model_tokens],
+                    dtype=np.int64)
+
+
+def _reduce(keys, counts):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+def _local_words(batch, local):
+    """Local ids of the words of a batch, -1 for words not counted."""
+    inside = batch.indices < len(local)
+    return np.where(inside, local[np.minimum(batch.indices, len(local) - 1)],
+                    -1)
+
+
+def _count_documents(batch, local, V):
+    """Document frequencies and co-occurring pairs of a batch."""
+    lengths = np.diff(batch.indptr)
+    docs = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    words = _local_words(batch, local)
+    keep = words >= 0
+    # each word once per document, sorted within the document
+    key = np.unique(docs[keep] * V + words[keep])
+    docs, words = key // V, key % V
+    counts = np.bincount(words, minlength=V)
+    # pair each entry with the later entries of its document
+    later = np.searchsorted(docs, docs, side="right") - \
+        np.arange(len(docs)) - 1
+    first = np.repeat(np.arange(len(docs)), later)
+    second = first + 1 + np.arange(len(first)) - \
+        np.repeat(np.cumsum(later) - later, later)
+    keys, pair_counts = _reduce(words[first] * V + words[second],
+                                np.ones(len(first)))
+    return counts, keys, pair_counts, len(lengths), len(lengths)
+
+
+def _count_window(batch, local, V, window):
+    """Token counts and pairs less than window apart of a batch."""
+    lengths = np.diff(batch.indptr)
+    docs = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    words = _local_words(batch, local)
+    counts = np.bincount(words[words >= 0], minlength=V)
+    keys = [np.zeros(0, dtype=np.int64)]
+    for gap in range(1, window):
+        a, b = words[:-gap], words[gap:]
+        keep = (docs[:-gap] == docs[gap:]) & (a >= 0) & (b >= 0) & (a != b)
+        a, b = a[keep], b[keep]
+        keys.append(np.minimum(a, b) * V + np.maximum(a, b))
+    keys = np.concatenate(keys)
+    keys, pair_counts = _reduce(keys, np.ones(len(keys)))
+    # pairs of all tokens less than window apart, each either way round,
+    # as keys are unordered: independent a, b give n_ab = 2 P p(a) p(b)
+    gaps = np.arange(1, window)
+    n_pairs = int(np.maximum(lengths[:, None] - gaps[None, :], 0).sum())
+    return counts, keys, pair_counts, int(lengths.sum()), 2 * n_pairs
+
+
+def count_batch(batch, local, V, window=None):
+    """Counts of one batch, as (counts, keys, pair_counts, total,
+    pair_total)."""
+    if window:
+        return _count_window(batch, local, V, window)
+    return _count_documents(batch, local, V)
+
+
+# local word map and window, set in each worker
+_state = {}
+
+
+def _init_worker(local, V, window):
+    _state.update(local=local, V=V, window=window)
+
+
+def _count_job(batch):
+    return count_batch(batch, _state["local"], _state["V"], _state["window"])
+
+
+def count_cooccurrence(stem, words, fmt="ldac", window=None,
+                       batch_size=10000, n_jobs=1):
+    """Count co-occurrences of a set of words in a corpus.
+
+    Parameters
+    ----------
+    stem : string
+        Data stem of the reference corpus.
+
+    words : array of int
+        Corpus word ids to count; repeats and negative ids are dropped.
+
+    fmt : string (default="ldac")
+        Data format.  Document counts read the corpus through
+        hcacorpus.load_corpus(), window counts with read_sequences().
+
+    window : int or None
+        Window size, or None to count by documents.
+
+    batch_size : int (default=10000)
+        Documents per batch.
+
+    n_jobs : int (default=1)
+        Number of processes; 0 for one per CPU.
+
+    Returns
+    -------
+    cooc : Cooccurrence
+    """
+    words = np.unique(np.asarray(words, dtype=np.int64))
+    words = words[words >= 0]
+    V = len(words)
+    if window:
+        batches = hcacorpus.read_sequences(stem, fmt, batch_size)
+    else:
+        batches = hcacorpus.load_corpus(stem, fmt).batches(batch_size)
+    local = np.full(int(words.max()) + 1 if V else 1, -1, dtype=np.int64)
+    local[words] = np.arange(V)
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    counts = np.zeros(V, dtype=np.int64)
+    keys = [np.zeros(0, dtype=np.int64)]
+    pair_counts = [np.zeros(0, dtype=np.int64)]
+    total = pair_total = pending = 0
+    pool = None
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, _init_worker, (local, V, window))
+        results = pool.imap(_count_job, batches)
+    else:
+        results = (count_batch(batch, local, V, window) for batch in batches)
+    try:
+        for c, k, n, t, p in results:
+            counts += c
+            keys.append(k)
+            pair_counts.append(n)
+            total += t
+            pair_total += p
+            pending += len(k)
+            if pending > MERGE_SIZE:
+                k, n = _reduce(np.concatenate(keys),
+                               np.concatenate(pair_counts))
+                keys, pair_counts = [k], [n]
+                pending = 0
+    except:
+        if pool:
+            pool.terminate()
+        raise
+    if pool:
+        pool.close()
+        pool.join()
+    keys, pair_counts = _reduce(np.concatenate(keys),
+                                np.concatenate(pair_counts))
+    return Cooccurrence(words, counts, keys, pair_counts, total, pair_total)
+
+
+def pmi(cooc, normalise=False):
+    """PMI, or NPMI, of every pair of cooc.keys, natural logarithms."""
+    V = len(cooc.words)
+    a, b = cooc.keys // V, cooc.keys % V
+    p_ab = cooc.pair_counts / float(max(cooc.pair_total, 1))
+    p_a = cooc.counts / float(max(cooc.total, 1))
+    value = np.log(p_ab) - np.log(p_a[a]) - np.log(p_a[b])
+    if normalise:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = np.where(p_ab < 1, value / -np.log(p_ab), 1.0)
+    return value
+
+
+def coherence(cooc, topics, normalise=False):
+    """Coherence of topics, as report_pmi() of util/pmi.c.
+
+    Parameters
+    ----------
+    cooc : Cooccurrence
+
+    topics : array of shape (T, n)
+        Corpus word ids of the top words of each topic, -1 for none.
+
+    normalise : bool (default=False)
+        Use NPMI rather than PMI.
+
+    Returns
+    -------
+    score : array of shape (T,)
+        Sum over pairs of words of PMI, over the number of words squared.
+    """
+    V = len(cooc.words)
+    value = pmi(cooc, normalise)
+    T, n = topics.shape
+    # local ids, -1 for words not counted
+    local = np.full(topics.shape, -1, dtype=np.int64)
+    if V:
+        position = np.minimum(np.searchsorted(cooc.words, topics), V - 1)
+        local = np.where((topics >= 0) & (cooc.words[position] == topics),
+                         position, -1)
+    i, j = np.triu_indices(n, 1)
+    a, b = local[:, i], local[:, j]
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    # pairs of counted words, never the same word twice
+    known = (lo >= 0) & (lo != hi)
+    key = lo * V + hi
+    pair_value = np.where(known, -1.0 if normalise else 0.0, 0.0)
+    if len(cooc.keys):
+        found = np.minimum(np.searchsorted(cooc.keys, key),
+                           len(cooc.keys) - 1)
+        seen = known & (cooc.keys[found] == key)
+        pair_value[seen] = value[found[seen]]
+    size = (topics >= 0).sum(axis=1)
+    return pair_value.sum(axis=1) / np.maximum(size, 1) ** 2
+
+
+def check_independent(window=None, V=50, D=2000, length=100, seed=0):
+    """Mean PMI of the pairs of a random corpus of independent words.
+
+    Documents of length tokens are drawn uniformly from V words, so the
+    result should be about 0, in document and in window counts.
+    """
+    random_state = np.random.RandomState(seed)
+    indices = random_state.randint(0, V, D * length)
+    batch = hcacorpus.CSRBatch(0, np.arange(D + 1) * length, indices,
+                               np.ones(len(indices), dtype=np.uint32))
+    counts, keys, pair_counts, total, pair_total = count_batch(
+        batch, np.arange(V), V, window)
+    cooc = Cooccurrence(np.arange(V), counts, keys, pair_counts, total,
+                        pair_total)
+    return float(pmi(cooc).mean())
+
+
+def write_pmi(out, cooc, value, to_model=None):
+    """Write "N M PMI" lines for every pair seen, N < M.
+
+    to_model maps corpus word ids to model ones, if they differ.
+    """
+    V = len(cooc.words)
+    a, b = cooc.words[cooc.keys // V], cooc.words[cooc.keys % V]
+    if to_model is not None:
+        a, b = to_model[a], to_model[b]
+    for i, j, v in zip(np.minimum(a, b), np.maximum(a, b), value):
+        out.write("%d %d %.4f\n" % (i, j, v))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Topic coherence by PMI in a reference corpus.")
+    parser.add_argument("model", nargs="?",
+                        help="MODEL.phi, MODEL.nwt or MODEL.toplst")
+    parser.add_argument("stem", nargs="?",
+                        help="data stem of the reference corpus")
+    parser.add_argument("-f", "--format", default="ldac",
+                        choices=hcacorpus.FORMATS,
+                        help="data format as for hca -f (default ldac)")
+    parser.add_argument("-n", type=int, default=10,
+                        help="top words per topic")
+    parser.add_argument("--window", type=int,
+                        help="count pairs less than this apart rather than "
+                        "by document, needs lst or witdit")
+    parser.add_argument("--npmi", action="store_true",
+                        help="normalised PMI")
+    parser.add_argument("--tokens",
+                        help="model vocabulary, if not the corpus's")
+    parser.add_argument("--pmi", metavar="FILE",
+                        help="also write the PMI values to FILE")
+    parser.add_argument("-b", "--batch", type=int, default=10000,
+                        help="documents per batch")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes, 0 for one per CPU")
+    parser.add_argument("--check", action="store_true",
+                        help="check that random independent words score "
+                        "about 0, by documents and with --window")
+    args = parser.parse_args()
+    if args.check:
+        failed = False
+        for window in (None, args.window or 10):
+            value = check_independent(window)
+            failed |= abs(value) > 0.05
+            sys.stdout.write("%s: mean PMI %.4f\n"
+                             % ("window %d" % window if window
+                                else "documents", value))
+        sys.exit(1 if failed else 0)
+    if args.model is None or args.stem is None:
+        parser.error("need MODEL and STEM")
+    topics = topic_words(args.model, args.n)
+    to_model = None
+    if args.tokens:
+        if args.window:
+            corpus_tokens = topwords.read_tokens(args.stem + ".tokens")
+        else:
+            corpus_tokens = hcacorpus.load_corpus(args.stem, args.format).vocab
+        model_tokens = topwords.read_tokens(args.tokens)
+        to_corpus = map_vocab(model_tokens, corpus_tokens)
+        topics = np.where(topics >= 0, to_corpus[np.maximum(topics, 0)], -1)
+        to_model = np.full(len(corpus_tokens), -1, dtype=np.int64)
+        mapped = to_corpus >= 0
+        to_model[to_corpus[mapped][::-1]] = np.flatnonzero(mapped)[::-1]
+    cooc = count_cooccurrence(args.stem, topics.ravel(), args.format,
+                              args.window, args.batch, args.jobs)
+    if args.pmi:
+        with open(args.pmi, "w") as f:
+            write_pmi(f, cooc, pmi(cooc, args.npmi), to_model)
+    score = coherence(cooc, topics, args.npmi)
+    out = sys.stdout
+    for k, value in enumerate(score):
+        out.write("%d: %.4f\n" % (k, value))
+    tp = topic_proportions(args.model)
+    if tp is not None and len(tp) == len(score):
+        out.write("= %.4f\n" % np.dot(tp, score))
+    else:
+        out.write("= %.4f unweighted\n" % score.mean())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""Estimate topic proportions of new documents from a saved phi.
+
+Given the (T, W) topic by word matrix of a trained model, STEM.phi, the
+topic proportions theta of each new document are "folded in" with phi
+held fixed, as "hca -r phi" does on a test split, but for a whole batch
+of documents at a time and without the sampler start up.
+
+Two estimators are offered:
+
+  em     fixed point (EM) iterations of
+             theta_dk  propto  alpha + sum_w n_dw q_dwk,
+             q_dwk = theta_dk phi_kw / sum_j theta_dj phi_jw,
+         over all the documents of a batch at once, each until no
+         proportion changes by more than tol.
+  gibbs  collapsed Gibbs sampling of the topic of every word, with theta
+         averaged over the sweeps after burn in, as "-l testprob" does.
+         Documents are independent given phi, so the i-th word of every
+         document of a batch is sampled at the same time.
+
+The corpus is read through hcacorpus.py, so any hca data format can be
+used, and processed in batches sized to bound the working memory, in
+parallel with n_jobs.  Only the columns of phi used by a batch are read.
+
+The output is in the format of STEM.testprob, written by tprob_report()
+in hca/tprob.c, so hcamat.load_theta() and the other tools read it:
+    n: k:p k:p ... = total
+with entries not above epsilon left out.
+
+Usage:
+    foldin.py [-f ldac] [--alpha A] [--gibbs 100,50] MODEL.phi STEM \\
+        > STEM.testprob
+"""
+
+import argparse
+import multiprocessing
+import sys
+
+import numpy as np
+
+import hcacorpus
+import hcamat
+
+# bound on the (entries, T) working arrays of a batch, in elements
+WORK_SIZE = 1 << 20
+
+
+def default_alpha(corpus, T):
+    """The alpha hca uses by default, 0.05 * (N / D) / T."""
+    return 0.05 * corpus.N / max(corpus.D, 1) / T
+
+
+def _phi_columns(phi, indices):
+    """The (entries, T) rows of phi transposed for each word of a batch."""
+    words, inverse = np.unique(indices, return_inverse=True)
+    columns = np.asarray(phi[:, words], dtype=np.float64).T
+    # a word no topic gives weight to would make q undefined
+    columns += 1e-30
+    return columns[inverse]
+
+
+def foldin_em(phi, batch, alpha, n_iter=100, tol=1e-4):
+    """Fixed point estimate of theta for a batch of documents.
+
+    Parameters
+    ----------
+    phi : array of shape (T, W)
+        Topic by word probabilities, e.g. from hcamat.load_phi().
+
+    batch : hcacorpus.CSRBatch
+        The documents.
+
+    alpha : float
+        Dirichlet prior of each topic.
+
+    n_iter : int (default=100)
+        Largest number of iterations.
+
+    tol : float (default=1e-4)
+        Stop iterating a document when none of its proportions changes
+        by more than this.
+
+    Returns
+    -------
+    theta : array of shape (D, T), float64
+        Rows sum to one.
+    """
+    T = phi.shape[0]
+    lengths = np.diff(batch.indptr)
+    D = len(lengths)
+    theta = np.full((D, T), 1.0 / T)
+    if len(batch.indices) == 0:
+        return theta
+    # topic major, which numpy sums over entries much faster
+    columns = np.ascontiguousarray(_phi_columns(phi, batch.indices).T)
+    counts = np.asarray(batch.data, dtype=np.float64)
+    # the documents still iterating, and the lengths and entries of each
+    live = np.flatnonzero(lengths)
+    lengths = lengths[live]
+    for _ in range(n_iter):
+        current = theta[live]
+        weighted = np.repeat(current.T, lengths, axis=1)
+        weighted *= columns
+        weighted *= counts / weighted.sum(axis=0)
+        starts = np.cumsum(lengths) - lengths
+        new = np.add.reduceat(weighted, starts, axis=1).T
+        new += alpha
+        new /= new.sum(axis=1)[:, None]
+        theta[live] = new
+        # each document stops on its own, so batching does not matter
+        going = np.abs(new - current).max(axis=1) >= tol
+        if not going.any():
+            break
+        if not going.all():
+            keep = np.repeat(going, lengths)
+            columns, counts = columns[:, keep], counts[keep]
+            live, lengths = live[going], lengths[going]
+    return theta
+
+
+def foldin_gibbs(phi, batch, alpha, n_iter=100, burn=50, random_state=None):
+    """Gibbs sampling estimate of theta for a batch of documents.
+
+    Parameters
+    ----------
+    phi, batch, alpha
+        As for foldin_em().
+
+    n_iter : int (default=100)
+        Sweeps over all the words.
+
+    burn : int (default=50)
+        Sweeps before theta is averaged.
+
+    random_state : numpy.random.RandomState or None
+
+    Returns
+    -------
+    theta : array of shape (D, T), float64
+        Mean over the sweeps after burn in of (n_dk + alpha) / (n_d + T alpha).
+    """
+    if random_state is None:
+        random_state = np.random.RandomState()
+    T = phi.shape[0]
+    lengths = np.diff(batch.indptr)
+    D = len(lengths)
+    counts = np.asarray(batch.data, dtype=np.int64)
+    # one entry per word token, documents longest first so the documents
+    # still having an i-th token are a prefix
+    total = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=total[1:])
+    n_tokens = total[batch.indptr[1:]] - total[batch.indptr[:-1]]
+    if n_tokens.sum() == 0:
+        return np.full((D, T), 1.0 / T)
+    order = np.argsort(-n_tokens, kind="stable")
+    token_doc = np.repeat(np.repeat(np.arange(D), lengths), counts)
+    token_word = np.repeat(np.arange(len(counts)), counts)
+    by_doc = np.argsort(np.argsort(order)[token_doc], kind="stable")
+    token_doc, token_word = token_doc[by_doc], token_word[by_doc]
+    sorted_tokens = n_tokens[order]
+    first = np.zeros(D + 1, dtype=np.int64)
+    np.cumsum(sorted_tokens, out=first[1:])
+    active = np.searchsorted(-sorted_tokens, -np.arange(sorted_tokens[0]))
+
+    columns = _phi_columns(phi, batch.indices)
+    z = (random_state.random_sample(len(token_doc))[:, None] *
+         columns[token_word].sum(axis=1)[:, None] >
+         np.cumsum(columns[token_word], axis=1)).sum(axis=1)
+    z = np.minimum(z, T - 1)
+    ndk = np.zeros((D, T), dtype=np.int64)
+    np.add.at(ndk, (token_doc, z), 1)
+    theta = np.zeros((D, T))
+    kept = 0
+    for sweep in range(n_iter):
+        for i, m in enumerate(active):
+            tokens = first[:m] + i
+            d = token_doc[tokens]
+            ndk[d, z[tokens]] -= 1
+            p = np.cumsum((ndk[d] + alpha) * columns[token_word[tokens]],
+                          axis=1)
+            u = random_state.random_sample(m) * p[:, -1]
+            new = np.minimum((p < u[:, None]).sum(axis=1), T - 1)
+            ndk[d, new] += 1
+            z[tokens] = new
+        if sweep >= burn:
+            theta += (ndk + alpha) / (n_tokens + T * alpha)[:, None]
+            kept += 1
+    return theta / max(kept, 1)
+
+
+def auto_batch_size(corpus, T, work_size=WORK_SIZE):
+    """Documents per batch keeping the (entries, T) arrays near work_size."""
+    per_doc = max(1.0, float(corpus.NNZ) / max(len(corpus), 1))
+    return max(1, int(work_size / (per_doc * T)))
+
+
+# model, corpus and options, set in each worker
+_state = {}
+
+
+def _init_worker(phi_path, stem, fmt, options):
+    _state["phi"] = hcamat.load_phi(phi_path)
+    _state["corpus"] = hcacorpus.Corpus(hcacorpus.cache_dir(stem, fmt))
+    _state["options"] = options
+
+
+def _foldin_range(job):
+    start, stop = job
+    corpus = _state["corpus"]
+    batch = next(corpus.batches(stop - start, start, stop))
+    return start, foldin_batch(_state["phi"], batch, **_state["options"])
+
+
+def foldin_batch(phi, batch, alpha, method="em", n_iter=100, burn=50,
+                 tol=1e-4, seed=None):
+    """Fold in one batch with foldin_em() or foldin_gibbs()."""
+    if method == "em":
+        return foldin_em(phi, batch, alpha, n_iter, tol)
+    if method == "gibbs":
+        # seeded by batch, so results do not depend on n_jobs
+        random_state = np.random.RandomState(
+            None if seed is None else (seed, batch.start))
+        return foldin_gibbs(phi, batch, alpha, n_iter, burn, random_state)
+    raise ValueError("Unknown method '%s', need 'em' or 'gibbs'" % method)
+
+
+def foldin(phi_path, stem, fmt="ldac", alpha=None, batch_size=None, n_jobs=1,
+           **options):
+    """Fold in every document of a corpus.
+
+    Parameters
+    ----------
+    phi_path : string
+        The .phi file of the model.
+
+    stem, fmt : string
+        The corpus, read with hcacorpus.load_corpus().
+
+    alpha : float or None
+        Dirichlet prior of each topic, default_alpha() if None.
+
+    batch_size : int or None
+        Documents per batch, auto_batch_size() if None.
+
+    n_jobs : int (default=1)
+        Number of processes; 0 for one per CPU.
+
+    options : keyword arguments
+        method, n_iter, burn, tol and seed, as for foldin_batch().
+
+    Yields
+    ------
+    start : int
+        Index of the first document of the batch.
+
+    theta : array of shape (batch documents, T)
+    """
+    phi = hcamat.load_phi(phi_path)
+    corpus = hcacorpus.load_corpus(stem, fmt)
+    T, W = phi.shape
+    if corpus.W > W:
+        raise ValueError("Corpus '%s' has W=%d, more words than the W=%d "
+                         "of '%s'" % (stem, corpus.W, W, phi_path))
+    options["alpha"] = default_alpha(corpus, T) if alpha is None else alpha
+    if batch_size is None:
+        batch_size = auto_batch_size(corpus, T)
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    jobs = [(lo, min(lo + batch_size, len(corpus)))
+            for lo in range(0, len(corpus), batch_size)]
+    if n_jobs == 1 or len(jobs) <= 1:
+        for batch in corpus.batches(batch_size):
+            yield batch.start, foldin_batch(phi, batch, **options)
+        return
+    pool = multiprocessing.Pool(min(n_jobs, len(jobs)), _init_worker,
+                                (phi_path, stem, fmt, options))
+    try:
+        for result in pool.imap(_foldin_range, jobs):
+            yield result
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+
+def write_prob(out, theta, first=0, epsilon=None):
+    """Write theta rows in the .testprob format of tprob_report().
+
+    Parameters
+    ----------
+    out : file
+        Text file to write to.
+
+    theta : array of shape (D, T)
+
+    first : int (default=0)
+        Number of the first row.
+
+    epsilon : float or None
+        Entries not above this are left out; 0.001 / T, as in hca, if None.
+    """
+    T = theta.shape[1]
+    if epsilon is None:
+        epsilon = 0.001 / T
+    for n, row in enumerate(theta, first):
+        out.write("%d:%s = %f\n" % (
+            n, "".join(" %d:%f" % (k, row[k])
+                       for k in np.flatnonzero(row > epsilon)),
+            row.sum()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fold in topic proportions of documents from a .phi file.")
+    parser.add_argument("phi", help="MODEL.phi file")
+    parser.add_argument("stem", help="data stem of the new documents")
+    parser.add_argument("-f", "--format", default="ldac",
+                        choices=hcacorpus.FORMATS,
+                        help="data format as for hca -f (default ldac)")
+    parser.add_argument("-A", "--alpha", type=float,
+                        help="Dirichlet prior per topic "
+                        "(default 0.05*(N/D)/T, as hca)")
+    parser.add_argument("--gibbs", metavar="ITER,BURN",
+                        help="Gibbs sample, e.g. 100,50, instead of EM")
+    parser.add_argument("--iter", type=int, default=100,
+                        help="largest number of EM iterations")
+    parser.add_argument("--tol", type=float, default=1e-4,
+                        help="EM convergence tolerance")
+    parser.add_argument("--seed", type=int, help="random seed for --gibbs")
+    parser.add_argument("-b", "--batch", type=int,
+                        help="documents per batch (default by memory)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes, 0 for one per CPU")
+    parser.add_argument("--first", type=int, default=0,
+                        help="number of the first document in the output")
+    parser.add_argument("-e", "--epsilon", type=float,
+                        help="smallest proportion written (default 0.001/T)")
+    args = parser.parse_args()
+    options = dict(n_iter=args.iter, tol=args.tol, seed=args.seed)
+    if args.gibbs:
+        n_iter, burn = [int(v) for v in args.gibbs.split(",")]
+        options.update(method="gibbs", n_iter=n_iter, burn=burn)
+    for start, theta in foldin(args.phi, args.stem, args.format, args.alpha,
+                               args.batch, args.jobs, **options):
+        write_prob(sys.stdout, theta, args.first + start, args.epsilon)
@@ -0,0 +1,578 @@
+#!/usr/bin/env python
+"""Read hca corpora in Python, streamed or through a binary CSR cache.
+
+The data formats are those of the "-f" option of hca, read by data_read()
+in util/dread.c:
+
+  bag      STEM.txtbag, header "D" and "W", then "n w c w c ..."
+  lst      STEM.txtbag, header as above, then "n w w w ..."
+  ldac     STEM.ldac, "n w:c w:c ..."
+  docword  STEM.docword, header "D", "W" and "NNZ", then "d w c", 1-offset
+  witdit   STEM.wit and STEM.dit, one word or document per line, 1-offset
+
+As in dread.c, documents are read as a stream of numbers, not lines, so
+a document may run over several lines.  Word ids are turned to 0-offset
+throughout.  docword and witdit files must be ordered by document.
+
+read_batches() streams a corpus as CSRBatch tuples of up to batch_size
+documents, with memory bounded by the batch.  load_corpus() converts it
+once into the directory STEM.FMT.csr, holding indptr.npy, indices.npy and
+data.npy, a meta.json recording the sizes and modification times of the
+source files, and vocab.txt, a copy of STEM.tokens if there is one.  Later
+loads memory map the arrays, so only what is used is read; the cache is
+rebuilt when a source file has changed.
+
+Counts of lst and witdit data are summed per word, so each row holds
+each word once, sorted.  bag, ldac and docword rows are kept in file
+order.
+
+Usage:
+    hcacorpus.py [-f ldac] STEM ...     # build or check caches, print dims
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+FORMATS = ("bag", "lst", "ldac", "docword", "witdit")
+
+# a batch of documents: start is the index of the first one, indptr starts
+# at 0 and the rows are indices[indptr[i]:indptr[i + 1]]
+CSRBatch = collections.namedtuple("CSRBatch", "start indptr indices data")
+
+_CHUNK = 1 << 22
+
+
+def data_files(stem, fmt):
+    """Source files of a corpus, as read by hca -f FMT."""
+    if fmt in ("bag", "lst"):
+        return [stem + ".txtbag"]
+    if fmt == "witdit":
+        return [stem + ".wit", stem + ".dit"]
+    if fmt in FORMATS:
+        return ["%s.%s" % (stem, fmt)]
+    raise ValueError("Unknown format '%s', need one of %s"
+                     % (fmt, ", ".join(FORMATS)))
+
+
+def _numbers(path, colon=False):
+    """Yield the integers of a text file as arrays, a chunk at a time."""
+    with open(path, "rb") as f:
+        tail = b""
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                break
+            chunk = tail + chunk
+            # a number may be cut at the end of the chunk
+            cut = max(chunk.rfind(b" "), chunk.rfind(b"\n"))
+            if cut < 0:
+                tail = chunk
+                continue
+            tail = chunk[cut:]
+            chunk = chunk[:cut]
+            if colon:
+                chunk = chunk.replace(b":", b" ")
+            yield np.array(chunk.split(), dtype=np.int64)
+        if colon:
+            tail = tail.replace(b":", b" ")
+        if tail.split():
+            yield np.array(tail.split(), dtype=np.int64)
+
+
+def _rows(rows, width):
+    """Row lengths, word and count arrays of documents n w [c] w [c] ..."""
+    lengths = np.array([n for n, _ in rows], dtype=np.int64)
+    flat = np.concatenate([v for _, v in rows]) if rows else \
+        np.zeros(0, dtype=np.int64)
+    if width == 2:
+        return lengths, flat[0::2], flat[1::2]
+    return lengths, flat, np.ones(len(flat), dtype=np.int64)
+
+
+def _sum_duplicates(lengths, words, counts):
+    """Sum the counts of repeated words in each row, sorting the words."""
+    docs = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    key = (docs << 32) | words
+    key, inverse = np.unique(key, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts).astype(np.int64)
+    docs, words = key >> 32, key & 0xFFFFFFFF
+    lengths = np.bincount(docs, minlength=len(lengths))
+    return lengths, words, counts
+
+
+def _batch(start, lengths, words, counts):
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    return CSRBatch(start, indptr, words.astype(np.uint32),
+                    counts.astype(np.uint32))
+
+
+def _read_counted(path, fmt, batch_size, ordered=False):
+    """Batches of bag, lst and ldac files, each document led by its length."""
+    width = 1 if fmt == "lst" else 2
+    header = 2 if fmt in ("bag", "lst") else 0
+    D = None
+    buf = np.zeros(0, dtype=np.int64)
+    rows = []
+    start = 0
+    for numbers in _numbers(path, colon=(fmt == "ldac")):
+        buf = np.concatenate((buf, numbers)) if len(buf) else numbers
+        pos = 0
+        if header:
+            if len(buf) < header:
+                continue
+            D = int(buf[0])
+            pos = header
+            header = 0
+        while pos < len(buf) and (D is None or start + len(rows) < D):
+            n = int(buf[pos])
+            end = pos + 1 + width * n
+            if end > len(buf):
+                break
+            rows.append((n, buf[pos + 1:end]))
+            pos = end
+            if len(rows) == batch_size:
+                lengths, words, counts = _rows(rows, width)
+                if fmt == "lst" and not ordered:
+                    lengths, words, counts = _sum_duplicates(lengths, words,
+                                                             counts)
+                yield _batch(start, lengths, words, counts)
+                start += len(rows)
+                rows = []
+        buf = buf[pos:].copy()
+    if len(buf) and (D is None or start + len(rows) < D):
+        raise ValueError("File '%s' ends within document %d"
+                         % (path, start + len(rows)))
+    if D is not None and start + len(rows) < D:
+        raise ValueError("File '%s' has %d documents, header says %d"
+                         % (path, start + len(rows), D))
+    if rows:
+        lengths, words, counts = _rows(rows, width)
+        if fmt == "lst" and not ordered:
+            lengths, words, counts = _sum_duplicates(lengths, words, counts)
+        yield _batch(start, lengths, words, counts)
+
+
+def read_triples(stem, fmt):
+    """Yield the entries of docword or witdit files, a chunk at a time.
+
+    Yields
+    ------
+    docs, words, counts : int64 arrays
+        0-offset document and word ids and the counts, in file order.
+    """
+    if fmt == "docword":
+        path = stem + ".docword"
+        header = 3
+        buf = np.zeros(0, dtype=np.int64)
+        for numbers in _numbers(path):
+            buf = np.concatenate((buf, numbers)) if len(buf) else numbers
+            if header:
+                if len(buf) < header:
+                    continue
+                buf = buf[header:]
+                header = 0
+            n = len(buf) // 3 * 3
+            triples = buf[:n].reshape(-1, 3)
+            buf = buf[n:].copy()
+            yield triples[:, 0] - 1, triples[:, 1] - 1, triples[:, 2]
+        if len(buf):
+            raise ValueError("File '%s' ends within an entry" % path)
+    elif fmt == "witdit":
+        words = _numbers(stem + ".wit")
+        wbuf = np.zeros(0, dtype=np.int64)
+        for docs in _numbers(stem + ".dit"):
+            while len(wbuf) < len(docs):
+                more = next(words, None)
+                if more is None:
+                    raise ValueError("File '%s.wit' is shorter than '%s.dit'"
+                                     % (stem, stem))
+                wbuf = np.concatenate((wbuf, more))
+            yield docs - 1, wbuf[:len(docs)] - 1, np.ones(len(docs),
+                                                         dtype=np.int64)
+            wbuf = wbuf[len(docs):]
+    else:
+        raise ValueError("Format '%s' is not of entries, need docword or "
+                         "witdit" % fmt)
+
+
+def header_size(stem, fmt):
+    """(D, W) of the header of bag, lst and docword files, else None."""
+    if fmt not in ("bag", "lst", "docword"):
+        return None
+    with open(data_files(stem, fmt)[0], "rb") as f:
+        head = f.read(256).split()
+    return int(head[0]), int(head[1])
+
+
+def batch_triples(chunks, fmt="docword", batch_size=10000, ordered=False,
+                  D=None):
+    """Batches of documents from chunks of entries ordered by document.
+
+    Parameters
+    ----------
+    chunks : iterable of (docs, words, counts) int64 arrays
+        As from read_triples().
+
+    fmt : string (default="docword")
+        "docword" or "witdit"; witdit counts are summed per word unless
+        ordered.
+
+    D : int or None
+        Number of documents, if more than the entries show.
+
+    Raises
+    ------
+    ValueError
+        If the entries are not ordered by document.
+    """
+    start = 0
+    last = -1
+    docs = words = counts = np.zeros(0, dtype=np.int64)
+    for more in chunks:
+        if len(more[0]) == 0:
+            continue
+        if more[0][0] < last or np.any(np.diff(more[0]) < 0):
+            raise ValueError("Entries are not ordered by document, sort "
+                             "them with sptools.py --sort")
+        last = more[0][-1]
+        docs, words, counts = [np.concatenate(pair) for pair in
+                               zip((docs, words, counts), more)]
+        # documents before the batch holding the last one are complete
+        while docs[-1] >= start + batch_size:
+            cut = np.searchsorted(docs, start + batch_size)
+            yield _triple_batch(start, batch_size, docs[:cut], words[:cut],
+                                counts[:cut], fmt, ordered)
+            docs, words, counts = docs[cut:], words[cut:], counts[cut:]
+            start += batch_size
+    stop = last + 1 if D is None else max(D, last + 1)
+    while start < stop:
+        n_docs = min(batch_size, stop - start)
+        cut = np.searchsorted(docs, start + n_docs)
+        yield _triple_batch(start, n_docs, docs[:cut], words[:cut],
+                            counts[:cut], fmt, ordered)
+        docs, words, counts = docs[cut:], words[cut:], counts[cut:]
+        start += n_docs
+
+
+def _read_triples(stem, fmt, batch_size, ordered=False):
+    """Batches of docword and witdit files, by document number."""
+    size = header_size(stem, fmt)
+    return batch_triples(read_triples(stem, fmt), fmt, batch_size, ordered,
+                         size[0] if size else None)
+
+
+def _triple_batch(start, n_docs, docs, words, counts, fmt, ordered):
+    lengths = np.bincount(docs - start, minlength=n_docs)
+    if fmt == "witdit" and not ordered:
+        lengths, words, counts = _sum_duplicates(lengths, words, counts)
+    return _batch(start, lengths, words, counts)
+
+
+def read_batches(stem, fmt="ldac", batch_size=10000):
+    """Stream a corpus as batches of documents.
+
+    Parameters
+    ----------
+    stem : string
+        Data stem, as given to hca.
+
+    fmt : string (default="ldac")
+        One of FORMATS, as for hca -f.
+
+    batch_size : int (default=10000)
+        Documents per batch.
+
+    Yields
+    ------
+    batch : CSRBatch
+        The documents from batch.start on, as CSR arrays: int64 indptr,
+        uint32 word indices and uint32 counts.
+    """
+    if fmt in ("docword", "witdit"):
+        return _read_triples(stem, fmt, batch_size)
+    return _read_counted(data_files(stem, fmt)[0], fmt, batch_size)
+
+
+def read_sequences(stem, fmt="lst", batch_size=10000):
+    """Stream the word sequences of a corpus as batches of documents.
+
+    Only lst and witdit data keep the order of words in a document.
+    Batches are as for read_batches(), but each row holds the words of a
+    document in order, repeats included, with counts of 1.
+    """
+    if fmt == "witdit":
+        return _read_triples(stem, fmt, batch_size, True)
+    if fmt == "lst":
+        return _read_counted(data_files(stem, fmt)[0], fmt, batch_size, True)
+    raise ValueError("Format '%s' does not keep word order, need lst or "
+                     "witdit" % fmt)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _sources(stem, fmt):
+    files = data_files(stem, fmt)
+    if os.path.exists(stem + ".tokens"):
+        files.append(stem + ".tokens")
+    return [_stamp(path) for path in files]
+
+
+def cache_dir(stem, fmt):
+    """Directory of the binary cache of a corpus."""
+    return "%s.%s.csr" % (stem, fmt)
+
+
+def _append(f, array, dtype):
+    np.asarray(array, dtype=dtype).tofile(f)
+
+
+def _to_npy(raw, npy, dtype):
+    """Turn a raw binary file into a .npy file, a chunk at a time."""
+    data = np.memmap(raw, dtype=dtype, mode="r") if os.path.getsize(raw) \
+        else np.zeros(0, dtype=dtype)
+    out = np.lib.format.open_memmap(npy, mode="w+", dtype=dtype,
+                                    shape=data.shape)
+    for i in range(0, len(data), _CHUNK):
+        out[i:i + _CHUNK] = data[i:i + _CHUNK]
+    out.flush()
+    del out, data
+    os.remove(raw)
+
+
+class CacheWriter(object):
+    """Write a binary CSR cache a batch at a time.
+
+    The cache is built in a temporary directory beside path and renamed
+    into place by close(), so readers never see a partial one.
+
+    Parameters
+    ----------
+    path : string
+        The cache directory, replaced if it exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".csr")
+        self.files = [open(os.path.join(self.tmp, name + ".raw"), "wb")
+                      for name in ("indptr", "indices", "data")]
+        _append(self.files[0], [0], np.int64)
+        self.D, self.W, self.NNZ, self.N = 0, 0, 0, 0
+
+    def write(self, batch):
+        """Append the documents of a CSRBatch."""
+        _append(self.files[0], batch.indptr[1:] + self.NNZ, np.int64)
+        _append(self.files[1], batch.indices, np.uint32)
+        _append(self.files[2], batch.data, np.uint32)
+        self.D += len(batch.indptr) - 1
+        self.NNZ += len(batch.indices)
+        self.N += int(batch.data.sum(dtype=np.int64))
+        if len(batch.indices):
+            self.W = max(self.W, int(batch.indices.max()) + 1)
+
+    def close(self, fmt, W=0, sources=(), tokens=None):
+        """Finish the cache.
+
+        Parameters
+        ----------
+        fmt : string
+            Format recorded in meta.json.
+
+        W : int (default=0)
+            Vocabulary size, if more than the word ids show.
+
+        sources : list
+            Stamps of the source files, for is_stale().
+
+        tokens : string or None
+            File copied to vocab.txt.
+        """
+        try:
+            for f in self.files:
+                f.close()
+            for name, dtype in (("indptr", np.int64), ("indices", np.uint32),
+                                ("data", np.uint32)):
+                _to_npy(os.path.join(self.tmp, name + ".raw"),
+                        os.path.join(self.tmp, name + ".npy"), dtype)
+            if tokens:
+                shutil.copyfile(tokens, os.path.join(self.tmp, "vocab.txt"))
+            with open(os.path.join(self.tmp, "meta.json"), "w") as f:
+                json.dump({"format": fmt, "D": self.D,
+                           "W": max(self.W, W), "NNZ": self.NNZ,
+                           "N": self.N, "sources": list(sources)}, f)
+            parent = os.path.dirname(os.path.abspath(self.path))
+            if os.path.isdir(self.path):
+                old = tempfile.mkdtemp(dir=parent, suffix=".old")
+                os.rename(self.path, os.path.join(old, "csr"))
+                os.rename(self.tmp, self.path)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.rename(self.tmp, self.path)
+        except:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Drop the partial cache."""
+        for f in self.files:
+            f.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def build_cache(stem, fmt="ldac", batch_size=10000):
+    """Convert a corpus to the binary CSR cache, streaming it.
+
+    Returns
+    -------
+    path : string
+        The cache directory.
+    """
+    path = cache_dir(stem, fmt)
+    sources = _sources(stem, fmt)
+    writer = CacheWriter(path)
+    try:
+        for batch in read_batches(stem, fmt, batch_size):
+            writer.write(batch)
+    except:
+        writer.abort()
+        raise
+    # as in dread.c, W is taken from the header where there is one
+    size = header_size(stem, fmt)
+    tokens = stem + ".tokens"
+    writer.close(fmt, size[1] if size else 0, sources,
+                 tokens if os.path.exists(tokens) else None)
+    return path
+
+
+def is_stale(stem, fmt="ldac"):
+    """Whether the cache of a corpus is missing or older than its sources."""
+    try:
+        with open(os.path.join(cache_dir(stem, fmt), "meta.json")) as f:
+            meta = json.load(f)
+        return meta["sources"] != _sources(stem, fmt)
+    except (IOError, OSError, ValueError, KeyError):
+        return True
+
+
+class Corpus(object):
+    """A corpus memory mapped from its binary CSR cache.
+
+    Attributes
+    ----------
+    ``indptr`` : array of shape (D + 1,), int64
+
+    ``indices``, ``data`` : arrays of shape (NNZ,), uint32
+        Word ids and counts; document d is indices[indptr[d]:indptr[d + 1]].
+
+    ``D``, ``W``, ``NNZ``, ``N`` : int
+        Documents, vocabulary size, entries and total word count.
+
+    ``format`` : string
+        Format of the source files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.format = meta["format"]
+        self.D, self.W, self.NNZ, self.N = [meta[k] for k in
+                                            ("D", "W", "NNZ", "N")]
+        for name in ("indptr", "indices", "data"):
+            setattr(self, name, np.load(os.path.join(path, name + ".npy"),
+                                        mmap_mode="r"))
+        self._vocab = None
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def doc(self, d):
+        """Word ids and counts of document d."""
+        lo, hi = self.indptr[d], self.indptr[d + 1]
+        return self.indices[lo:hi], self.data[lo:hi]
+
+    def doc_lengths(self):
+        """Total word count of every document, as an int64 array."""
+        cum = np.zeros(len(self.data) + 1, dtype=np.int64)
+        np.cumsum(self.data, out=cum[1:])
+        return cum[self.indptr[1:]] - cum[self.indptr[:-1]]
+
+    def batches(self, batch_size=10000, start=0, stop=None):
+        """Yield CSRBatch slices of the documents from start to stop."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for lo in range(start, stop, batch_size):
+            hi = min(lo + batch_size, stop)
+            a, b = self.indptr[lo], self.indptr[hi]
+            yield CSRBatch(lo, np.asarray(self.indptr[lo:hi + 1]) - a,
+                           self.indices[a:b], self.data[a:b])
+
+    @property
+    def vocab(self):
+        """List of words, from the copy of STEM.tokens, or None."""
+        if self._vocab is None:
+            name = os.path.join(self.path, "vocab.txt")
+            if os.path.exists(name):
+                with open(name, "rb") as f:
+                    self._vocab = [(line.decode("utf-8").split() or [""])[-1]
+                                   for line in f]
+        return self._vocab
+
+    def to_scipy(self):
+        """The corpus as a scipy.sparse.csr_matrix of shape (D, W)."""
+        try:
+            from scipy import sparse
+        except ImportError:
+            raise ImportError("Corpus.to_scipy() needs scipy")
+        return sparse.csr_matrix((self.data, self.indices, self.indptr),
+                                 shape=(len(self), self.W))
+
+
+def load_corpus(stem, fmt="ldac", cache=True, batch_size=10000):
+    """Load a corpus, building or rebuilding its binary cache as needed.
+
+    Parameters
+    ----------
+    stem : string
+        Data stem, as given to hca.
+
+    fmt : string (default="ldac")
+        One of FORMATS.
+
+    cache : bool (default=True)
+        If False, always rebuild the cache.
+
+    Returns
+    -------
+    corpus : Corpus
+    """
+    if not cache or is_stale(stem, fmt):
+        build_cache(stem, fmt, batch_size)
+    return Corpus(cache_dir(stem, fmt))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build binary CSR caches of hca corpora.")
+    parser.add_argument("stems", nargs="+", help="data stems")
+    parser.add_argument("-f", "--format", default="ldac", choices=FORMATS,
+                        help="data format as for hca -f (default ldac)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="rebuild the cache even if up to date")
+    args = parser.parse_args()
+    for stem in args.stems:
+        corpus = load_corpus(stem, args.format, cache=not args.rebuild)
+        sys.stdout.write("%s: D=%d W=%d NNZ=%d N=%d\n"
+                         % (corpus.path, corpus.D, corpus.W, corpus.NNZ,
+                            corpus.N))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""Read hca model matrices as NumPy arrays without loading them into RAM.
+
+STEM.phi is binary, written by phi_save() in hca/phi.c: three 32 bit
+integers W (dictionary size), T (topics) and the sample count, then the
+(T, W) matrix of native floats, with W as the minor index.  When beta is
+estimated a further row of W floats follows.  It is opened here with
+numpy.memmap, so slicing one topic only reads that topic's row.
+
+STEM.nwt is the topic by word count matrix Nwt, written as text in the
+standard sparse format of write_u32sparse() in util/util.c: lines W, T and
+the number of entries, then "w t count" lines.
+
+STEM.theta and STEM.testprob are text, written by prob_report() and
+tprob_report() in hca/tprob.c, one line per document:
+    n: [class] k:p k:p ... = total
+with entries below epsilon left out.  These are parsed once into a dense
+(D, T) float32 matrix that is saved next to the source as STEM.theta.npy
+and memory mapped from then on.  The cache is rebuilt when the source is
+newer.
+
+Usage:
+    hcamat.py STEM.phi|STEM.nwt|STEM.theta ...   # print dims, build caches
+"""
+
+import collections
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+PhiHeader = collections.namedtuple("PhiHeader", "W T count beta")
+
+_PHI_HEADER = np.dtype([("W", "=u4"), ("T", "=u4"), ("count", "=u4")])
+
+
+def read_phi_header(path):
+    """Read and check the header of a .phi file.
+
+    Parameters
+    ----------
+    path : string
+        The .phi file.
+
+    Returns
+    -------
+    header : PhiHeader
+        W, T and the sample count, and beta, true if a beta row follows
+        the matrix.
+    """
+    with open(path, "rb") as f:
+        head = np.fromfile(f, dtype=_PHI_HEADER, count=1)
+    if head.size != 1:
+        raise ValueError("File '%s' too short for a phi header" % path)
+    W, T, count = [int(head[0][k]) for k in ("W", "T", "count")]
+    size = os.path.getsize(path) - _PHI_HEADER.itemsize
+    if W == 0 or T == 0 or size not in (4 * W * T, 4 * W * (T + 1)):
+        raise ValueError("File '%s' has %d bytes of data, not matching "
+                         "phi dimensions W=%d, T=%d" % (path, size, W, T))
+    return PhiHeader(W, T, count, size == 4 * W * (T + 1))
+
+
+def load_phi(path, mode="r"):
+    """Memory map the phi matrix of a .phi file.
+
+    Parameters
+    ----------
+    path : string
+        The .phi file.
+
+    mode : string (default="r")
+        As for numpy.memmap; "r+" to modify the file in place.
+
+    Returns
+    -------
+    phi : numpy.memmap of shape (T, W), float32
+        Topic by word probabilities.
+    """
+    head = read_phi_header(path)
+    return np.memmap(path, dtype="=f4", mode=mode,
+                     offset=_PHI_HEADER.itemsize, shape=(head.T, head.W))
+
+
+def load_phi_beta(path):
+    """Memory map the estimated beta vector of a .phi file.
+
+    Returns
+    -------
+    beta : numpy.memmap of shape (W,), float32, or None if not saved.
+    """
+    head = read_phi_header(path)
+    if not head.beta:
+        return None
+    return np.memmap(path, dtype="=f4", mode="r",
+                     offset=_PHI_HEADER.itemsize + 4 * head.W * head.T,
+                     shape=(head.W,))
+
+
+def save_phi(path, phi, count=1, beta=None):
+    """Write a (T, W) matrix as a .phi file hca can load with "-r phi".
+
+    Parameters
+    ----------
+    path : string
+        The .phi file to write.
+
+    phi : array of shape (T, W)
+        Topic by word probabilities.
+
+    count : int (default=1)
+        Sample count to record in the header.
+
+    beta : array of shape (W,) or None
+        Optional beta vector to append.
+    """
+    phi = np.asarray(phi, dtype="=f4")
+    T, W = phi.shape
+    head = np.array([(W, T, count)], dtype=_PHI_HEADER)
+    with open(path, "wb") as f:
+        head.tofile(f)
+        phi.tofile(f)
+        if beta is not None:
+            np.asarray(beta, dtype="=f4").reshape(W).tofile(f)
+
+
+def load_sparse(path, dtype=np.float32):
+    """Read a matrix in the standard sparse text format of hca.
+
+    Parameters
+    ----------
+    path : string
+        File with lines "rows", "cols", "entries", then "i j value".
+
+    Returns
+    -------
+    mat : array of shape (rows, cols)
+    """
+    with open(path, "r") as f:
+        nr, nc, nnz = [int(f.readline()) for _ in range(3)]
+        ijv = np.loadtxt(f, ndmin=2) if nnz else np.zeros((0, 3))
+    if ijv.shape[0] != nnz:
+        raise ValueError("File '%s' has %d entries, header says %d"
+                         % (path, ijv.shape[0], nnz))
+    mat = np.zeros((nr, nc), dtype=dtype)
+    mat[ijv[:, 0].astype(np.int64), ijv[:, 1].astype(np.int64)] = ijv[:, 2]
+    return mat
+
+
+def load_nwt(path):
+    """Load a .nwt file as a (T, W) matrix of counts, the layout of phi."""
+    return load_sparse(path, np.float32).T
+
+
+def parse_prob(path, T=None):
+    """Parse a .theta or .testprob text file into a dense matrix.
+
+    Parameters
+    ----------
+    path : string
+        The text file.
+
+    T : int or None
+        Number of topics.  If None, one more than the largest topic seen.
+
+    Returns
+    -------
+    theta : array of shape (D, T), float32
+        One row per line of the file, in file order.
+    """
+    rows, cols, vals = [], [], []
+    D = 0
+    with open(path, "r") as f:
+        for D, line in enumerate(f, 1):
+            for entry in line.split()[1:]:
+                k, sep, p = entry.partition(":")
+                if sep:
+                    rows.append(D - 1)
+                    cols.append(int(k))
+                    vals.append(float(p))
+    cols = np.array(cols, dtype=np.int64)
+    if T is None:
+        T = int(cols.max()) + 1 if cols.size else 0
+    elif cols.size and cols.max() >= T:
+        raise ValueError("File '%s' has topic %d, beyond T=%d"
+                         % (path, cols.max(), T))
+    theta = np.zeros((D, T), dtype=np.float32)
+    theta[rows, cols] = vals
+    return theta
+
+
+def load_theta(path, T=None, cache=True):
+    """Load a .theta or .testprob file, memory mapped through a .npy cache.
+
+    Parameters
+    ----------
+    path : string
+        The text file.
+
+    T : int or None
+        Number of topics, as for parse_prob().
+
+    cache : bool (default=True)
+        Use, and if stale rebuild, the cache file path + ".npy".
+
+    Returns
+    -------
+    theta : array of shape (D, T), float32
+        Read-only memory map when cached.
+    """
+    if not cache:
+        return parse_prob(path, T)
+    npy = path + ".npy"
+    if os.path.exists(npy) and \
+       os.path.getmtime(npy) >= os.path.getmtime(path):
+        theta = np.load(npy, mmap_mode="r")
+        if T is None or theta.shape[1] == T:
+            return theta
+    theta = parse_prob(path, T)
+    # written atomically, another process may be reading the cache
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(npy) or ".",
+                                   suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, theta)
+        os.rename(tmp, npy)
+    except (IOError, OSError):
+        return theta
+    return np.load(npy, mmap_mode="r")
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        if path.endswith(".phi"):
+            head = read_phi_header(path)
+            print("%s: W=%d T=%d count=%d%s" % (path, head.W, head.T,
+                                                head.count,
+                                                " +beta" if head.beta else ""))
+        elif path.endswith(".nwt"):
+            nwt = load_nwt(path)
+            print("%s: W=%d T=%d N=%d" % (path, nwt.shape[1], nwt.shape[0],
+                                          nwt.sum()))
+        else:
+            theta = load_theta(path)
+            print("%s: D=%d T=%d" % (path, theta.shape[0], theta.shape[1]))
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""Build hca input data directly from raw text.
+
+Reads documents, one per line, tokenizes them with tokenizer.encode() and
+writes STEM.tokens plus the data file for one of the formats read by the
+"-f" option of hca (see data_read() in util/dread.c):
+
+  bag      STEM.txtbag, header "D" and "W" lines, then "n w c w c ..."
+  lst      STEM.txtbag, header as above, then "n w w w ..." in text order
+  ldac     STEM.ldac, lines "n w:c w:c ..."
+  docword  STEM.docword, header "D", "W" and "NNZ" lines, then "d w c"
+  witdit   STEM.wit and STEM.dit, one index per line
+
+Word ids are handed out incrementally, in order of first occurrence, and
+are never changed afterwards.  So documents can be appended to an existing
+corpus: new words only go on the end of STEM.tokens, and the documents
+already written are not read again.
+
+Only alphanumeric tokens are kept, and stopwords are dropped as they are
+read.  Frequency thresholds need counts over the whole input, so the
+documents are spooled as raw word ids to STEM.spool and the data files are
+written from the spool at the end.  On an append, thresholds apply to the
+cumulative counts: a word kept before stays kept, and a word that only
+passes now gets a new id, used from the new documents on.
+
+The counts and ids of every word seen are kept in STEM.vocab for appending.
+
+Usage:
+    mkcorpus.py [--format ldac] [--stopfile stops.txt] [--mindf 5] STEM FILE..
+    mkcorpus.py --append STEM MOREFILE..
+"""
+
+import argparse
+import array
+import collections
+import os
+import sys
+
+import tokenizer
+
+FORMATS = ("bag", "lst", "ldac", "docword", "witdit")
+
+# headers are space padded to a fixed width so they can be updated in place
+_HEADER_WIDTH = 10
+
+
+def _data_files(stem, fmt):
+    if fmt in ("bag", "lst"):
+        return [stem + ".txtbag"]
+    if fmt == "witdit":
+        return [stem + ".wit", stem + ".dit"]
+    return ["%s.%s" % (stem, fmt)]
+
+
+def _header(values):
+    return "".join("%*d\n" % (_HEADER_WIDTH, v) for v in values).encode()
+
+
+class CorpusBuilder(object):
+    """Streaming builder of an hca corpus with an incremental vocabulary.
+
+    Parameters
+    ----------
+    stem : string
+        Output file stem.
+
+    fmt : string (default="ldac")
+        One of FORMATS.  Ignored when appending, the corpus keeps its format.
+
+    stopwords : set of strings or None
+        Words never to put in the vocabulary.
+
+    lower : bool (default=False)
+        Lower case tokens before anything else.
+
+    mindf, mintf : int (default=1)
+        Minimum document and total frequency for a word to be kept.
+
+    maxdf : float (default=1.0)
+        Maximum proportion of documents a word may occur in to be kept.
+
+    append : bool (default=False)
+        Add to the corpus in STEM.vocab rather than starting a new one.
+    """
+
+    def __init__(self, stem, fmt="ldac", stopwords=None, lower=False,
+                 mindf=1, mintf=1, maxdf=1.0, append=False):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format '%s', need one of %s"
+                             % (fmt, ", ".join(FORMATS)))
+        self.stem = stem
+        self.fmt = fmt
+        self.stopwords = stopwords or set()
+        self.lower = lower
+        self.mindf = mindf
+        self.mintf = mintf
+        self.maxdf = maxdf
+        # all words seen, by raw id
+        self.words = []
+        self.ids = {}
+        self.tf = []
+        self.df = []
+        # output id of each raw id, -1 if not kept (yet)
+        self.outid = []
+        self.W = 0
+        self.D = 0
+        self.NNZ = 0
+        self.old_D = 0
+        self.old_W = 0
+        self.appending = append and os.path.exists(stem + ".vocab")
+        if self.appending:
+            self._load_state()
+        self._spool = open(stem + ".spool", "wb")
+        self._new_docs = 0
+
+    def _load_state(self):
+        with open(self.stem + ".vocab", "rb") as f:
+            head = f.readline().decode("utf-8").split()
+            if len(head) != 5 or head[0] != "#mkcorpus":
+                raise ValueError("Bad header in '%s.vocab'" % self.stem)
+            self.fmt = head[1]
+            self.D, self.W, self.NNZ = [int(v) for v in head[2:]]
+            for line in f:
+                word, tf, df, oid = line.decode("utf-8").split()
+                self.ids[word] = len(self.words)
+                self.words.append(word)
+                self.tf.append(int(tf))
+                self.df.append(int(df))
+                self.outid.append(int(oid))
+        self.old_D = self.D
+        self.old_W = self.W
+
+    def _save_state(self):
+        with open(self.stem + ".vocab", "wb") as f:
+            f.write(("#mkcorpus %s %d %d %d\n"
+                     % (self.fmt, self.D, self.W, self.NNZ)).encode())
+            for i, word in enumerate(self.words):
+                f.write(("%s %d %d %d\n" % (word, self.tf[i], self.df[i],
+                                            self.outid[i])).encode("utf-8"))
+
+    def add(self, text):
+        """Tokenize one document and spool its words as raw ids."""
+        ids = self.ids
+        seen = set()
+        doc = array.array("I", [0])
+        for token in tokenizer.words(text):
+            if self.lower:
+                token = token.lower()
+            if token in self.stopwords:
+                continue
+            i = ids.get(token)
+            if i is None:
+                i = ids[token] = len(self.words)
+                self.words.append(token)
+                self.tf.append(0)
+                self.df.append(0)
+                self.outid.append(-1)
+            self.tf[i] += 1
+            if i not in seen:
+                seen.add(i)
+                self.df[i] += 1
+            doc.append(i)
+        doc[0] = len(doc) - 1
+        doc.tofile(self._spool)
+        self._new_docs += 1
+
+    def add_lines(self, lines):
+        """Add each line as a document."""
+        for line in lines:
+            self.add(line.strip())
+
+    def _assign_ids(self):
+        """Give output ids to raw ids passing the thresholds, in raw order."""
+        maxdf = self.maxdf * (self.D + self._new_docs)
+        for i, oid in enumerate(self.outid):
+            if oid < 0 and self.df[i] >= self.mindf and \
+               self.tf[i] >= self.mintf and self.df[i] <= maxdf:
+                self.outid[i] = self.W
+                self.W += 1
+
+    def _spooled_docs(self):
+        """Yield each spooled document as a list of output ids."""
+        outid = self.outid
+        with open(self.stem + ".spool", "rb") as f:
+            for _ in range(self._new_docs):
+                n = array.array("I")
+                n.fromfile(f, 1)
+                doc = array.array("I")
+                doc.fromfile(f, n[0])
+                yield [outid[i] for i in doc if outid[i] >= 0]
+
+    def _open_data(self, name, header_lines):
+        """Open a data file for appending documents, skipping its header."""
+        if self.appending:
+            f = open(name, "r+b")
+            f.seek(0, os.SEEK_END)
+        else:
+            f = open(name, "wb")
+            f.write(_header([0] * header_lines))
+        return f
+
+    def _write_docs(self):
+        fmt = self.fmt
+        header_lines = {"bag": 2, "lst": 2, "docword": 3}.get(fmt, 0)
+        names = _data_files(self.stem, fmt)
+        files = [self._open_data(name, header_lines) for name in names]
+        out = files[0]
+        d = self.D
+        for doc in self._spooled_docs():
+            if fmt == "lst":
+                self.NNZ += len(doc)
+                out.write(("%d %s\n" % (len(doc), " ".join(map(str, doc))))
+                          .encode())
+            elif fmt == "witdit":
+                self.NNZ += len(doc)
+                out.write("".join("%d\n" % (w + 1) for w in doc).encode())
+                files[1].write(("%d\n" % (d + 1)).encode() * len(doc))
+            else:
+                counts = sorted(collections.Counter(doc).items())
+                self.NNZ += len(counts)
+                if fmt == "docword":
+                    out.write("".join("%d %d %d\n" % (d + 1, w + 1, c)
+                                      for w, c in counts).encode())
+                elif fmt == "ldac":
+                    out.write(("%d %s\n" % (len(counts), " ".join(
+                        "%d:%d" % wc for wc in counts))).encode())
+                else:
+                    out.write(("%d %s\n" % (len(counts), " ".join(
+                        "%d %d" % wc for wc in counts))).encode())
+            d += 1
+        self.D = d
+        if header_lines:
+            out.seek(0)
+            out.write(_header([self.D, self.W, self.NNZ][:header_lines]))
+        for f in files:
+            f.close()
+
+    def _write_tokens(self):
+        """Append the newly kept words to STEM.tokens in output id order."""
+        new = sorted((oid, word) for word, oid in zip(self.words, self.outid)
+                     if oid >= self.old_W)
+        mode = "ab" if self.appending else "wb"
+        with open(self.stem + ".tokens", mode) as f:
+            for _, word in new:
+                f.write((word + "\n").encode("utf-8"))
+
+    def close(self):
+        """Apply the thresholds and write out the spooled documents."""
+        self._spool.close()
+        self._assign_ids()
+        self._write_docs()
+        self._write_tokens()
+        self._save_state()
+        os.remove(self.stem + ".spool")
+
+
+def read_stopwords(path):
+    """Read a stopword file with one or more words per line."""
+    with open(path, "rb") as f:
+        return set(f.read().decode("utf-8").split())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build hca input files from text, one document per line.")
+    parser.add_argument("stem", help="stem for the output files")
+    parser.add_argument("files", nargs="*", default=["-"],
+                        help="input text files (default stdin), "
+                        "gzip or bzip2 allowed")
+    parser.add_argument("-f", "--format", default="ldac", choices=FORMATS,
+                        help="data format as for hca -f (default ldac)")
+    parser.add_argument("-a", "--append", action="store_true",
+                        help="append documents to an existing corpus")
+    parser.add_argument("-s", "--stopfile",
+                        help="file of stopwords to drop")
+    parser.add_argument("-l", "--lower", action="store_true",
+                        help="lower case all tokens")
+    parser.add_argument("--mindf", type=int, default=1,
+                        help="minimum document frequency of kept words")
+    parser.add_argument("--mintf", type=int, default=1,
+                        help="minimum total frequency of kept words")
+    parser.add_argument("--maxdf", type=float, default=1.0,
+                        help="maximum proportion of documents for kept words")
+    args = parser.parse_args()
+    stopwords = read_stopwords(args.stopfile) if args.stopfile else None
+    builder = CorpusBuilder(args.stem, args.format, stopwords=stopwords,
+                            lower=args.lower, mindf=args.mindf,
+                            mintf=args.mintf, maxdf=args.maxdf,
+                            append=args.append)
+    for path in args.files:
+        f = tokenizer.open_input(path)
+        builder.add_lines(line.decode("utf-8") for line in f)
+    builder.close()
+    sys.stderr.write("Wrote %d documents, %d words to '%s'\n"
+                     % (builder.D, builder.W, args.stem))
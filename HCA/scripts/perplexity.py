@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""Held-out perplexity of several saved models in one pass over the data.
+
+Each model is a phi matrix, MODEL.phi, with the theta of the held-out
+documents, either a .testprob or .theta file in document order, or, if
+none is given, folded in from phi by foldin.foldin_em().  The corpus is
+read through hcacorpus.py a batch of documents at a time, and for every
+model the log likelihood of each document is
+    sum_w n_dw log2 sum_k theta_dk phi_kw,
+found with one gather of the phi columns the batch uses and a product
+over topics, without forming the (D, W) matrix.  Batches are spread over
+processes with --jobs; every model is scored on a batch while it is in
+memory, so the data is read once however many models there are.
+
+Rows of theta files are renormalised, as entries below epsilon are left
+out of them.  Perplexity is reported as hca reports "logperp", the log2
+perplexity -sum_d ll_d / N, followed by the perplexity itself.
+
+Usage:
+    perplexity.py [-f ldac] [--docs SCORES] STEM MODEL.phi[:THETA] ...
+"""
+
+import argparse
+import multiprocessing
+import sys
+
+import numpy as np
+
+import foldin
+import hcacorpus
+import hcamat
+
+
+class Model(object):
+    """A model to score, opened from "PHI" or "PHI:THETA".
+
+    Attributes
+    ----------
+    ``phi`` : numpy.memmap of shape (T, W)
+
+    ``theta`` : array of shape (D, T) or None
+        Memory mapped from the cache of hcamat.load_theta(), or None to
+        fold theta in.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        phi_path, sep, theta_path = spec.partition(":")
+        self.phi = hcamat.load_phi(phi_path)
+        self.theta = hcamat.load_theta(theta_path, self.phi.shape[0]) \
+            if sep else None
+
+    def check(self, corpus):
+        T, W = self.phi.shape
+        if corpus.W > W:
+            raise ValueError("Corpus has W=%d, more words than the W=%d of "
+                             "'%s'" % (corpus.W, W, self.spec))
+        if self.theta is not None and len(self.theta) != len(corpus):
+            raise ValueError("Theta of '%s' has %d documents, corpus has %d"
+                             % (self.spec, len(self.theta), len(corpus)))
+
+    def batch_theta(self, batch, alpha=None):
+        """(documents, T) theta of a batch, rows summing to one."""
+        D = len(batch.indptr) - 1
+        if self.theta is None:
+            return foldin.foldin_em(self.phi, batch, alpha)
+        theta = np.asarray(self.theta[batch.start:batch.start + D],
+                           dtype=np.float64)
+        total = theta.sum(axis=1)
+        total[total == 0] = 1
+        return theta / total[:, None]
+
+
+def log_likelihood(phi, theta, batch):
+    """Log2 likelihood of each document of a batch.
+
+    Parameters
+    ----------
+    phi : array of shape (T, W)
+
+    theta : array of shape (documents, T)
+
+    batch : hcacorpus.CSRBatch
+
+    Returns
+    -------
+    ll : array of shape (documents,), float64
+    """
+    lengths = np.diff(batch.indptr)
+    if len(batch.indices) == 0:
+        return np.zeros(len(lengths))
+    words, inverse = np.unique(batch.indices, return_inverse=True)
+    # topic major, as in foldin.py
+    columns = np.asarray(phi[:, words], dtype=np.float64)[:, inverse]
+    columns *= np.repeat(theta.T, lengths, axis=1)
+    with np.errstate(divide="ignore"):
+        entry = np.log2(columns.sum(axis=0))
+    entry *= batch.data
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    return np.bincount(rows, weights=entry, minlength=len(lengths))
+
+
+def score_batch(models, batch, alphas):
+    """(documents, models) log2 likelihoods of a batch.
+
+    alphas gives the fold in prior of each model.
+    """
+    return np.column_stack([
+        log_likelihood(model.phi, model.batch_theta(batch, alpha), batch)
+        for model, alpha in zip(models, alphas)])
+
+
+# models, corpus and fold in priors, set in each worker
+_state = {}
+
+
+def _init_worker(specs, stem, fmt, alphas):
+    _state["models"] = [Model(spec) for spec in specs]
+    _state["corpus"] = hcacorpus.Corpus(hcacorpus.cache_dir(stem, fmt))
+    _state["alphas"] = alphas
+
+
+def _score_range(job):
+    start, stop = job
+    batch = next(_state["corpus"].batches(stop - start, start, stop))
+    return start, score_batch(_state["models"], batch, _state["alphas"])
+
+
+def evaluate(specs, stem, fmt="ldac", alpha=None, batch_size=None, n_jobs=1):
+    """Score models on a held-out corpus, a batch of documents at a time.
+
+    Parameters
+    ----------
+    specs : list of strings
+        Models, "PHI" or "PHI:THETA", as for Model.
+
+    stem, fmt : string
+        The corpus, read with hcacorpus.load_corpus().
+
+    alpha : float or None
+        Prior for models folded in, foldin.default_alpha() if None.
+
+    batch_size : int or None
+        Documents per batch, foldin.auto_batch_size() if None.
+
+    n_jobs : int (default=1)
+        Number of processes; 0 for one per CPU.
+
+    Yields
+    ------
+    start : int
+        Index of the first document of the batch.
+
+    ll : array of shape (batch documents, models)
+        Log2 likelihood of each document under each model.
+    """
+    corpus = hcacorpus.load_corpus(stem, fmt)
+    models = [Model(spec) for spec in specs]
+    T = max(model.phi.shape[0] for model in models)
+    for model in models:
+        model.check(corpus)
+    alphas = [foldin.default_alpha(corpus, model.phi.shape[0])
+              if alpha is None else alpha for model in models]
+    if batch_size is None:
+        batch_size = foldin.auto_batch_size(corpus, T)
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    jobs = [(lo, min(lo + batch_size, len(corpus)))
+            for lo in range(0, len(corpus), batch_size)]
+    if n_jobs == 1 or len(jobs) <= 1:
+        for batch in corpus.batches(batch_size):
+            yield batch.start, score_batch(models, batch, alphas)
+        return
+    pool = multiprocessing.Pool(min(n_jobs, len(jobs)), _init_worker,
+                                (specs, stem, fmt, alphas))
+    try:
+        for result in pool.imap(_score_range, jobs):
+            yield result
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Held-out perplexity of saved models in one data pass.")
+    parser.add_argument("stem", help="data stem of the held-out documents")
+    parser.add_argument("models", nargs="+", metavar="PHI[:THETA]",
+                        help="MODEL.phi, with its .testprob or .theta for "
+                        "the held-out documents, else theta is folded in")
+    parser.add_argument("-f", "--format", default="ldac",
+                        choices=hcacorpus.FORMATS,
+                        help="data format as for hca -f (default ldac)")
+    parser.add_argument("-A", "--alpha", type=float,
+                        help="Dirichlet prior per topic when folding in "
+                        "(default 0.05*(N/D)/T, as hca)")
+    parser.add_argument("-b", "--batch", type=int,
+                        help="documents per batch (default by memory)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes, 0 for one per CPU")
+    parser.add_argument("--docs", metavar="FILE",
+                        help="write \"d n ll ll ...\" per document to FILE")
+    args = parser.parse_args()
+    corpus = hcacorpus.load_corpus(args.stem, args.format)
+    lengths = corpus.doc_lengths()
+    total = np.zeros(len(args.models))
+    docs = open(args.docs, "w") if args.docs else None
+    for start, ll in evaluate(args.models, args.stem, args.format, args.alpha,
+                              args.batch, args.jobs):
+        total += ll.sum(axis=0)
+        if docs:
+            for d, row in enumerate(ll, start):
+                docs.write("%d %d %s\n" % (d, lengths[d],
+                                           " ".join("%f" % v for v in row)))
+    if docs:
+        docs.close()
+    N = max(int(lengths.sum()), 1)
+    for spec, ll in zip(args.models, total):
+        sys.stdout.write("%s: logperp = %f (%f)\n"
+                         % (spec, -ll / N, 2 ** (-ll / N)))
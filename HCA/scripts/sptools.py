@@ -0,0 +1,670 @@
+#!/usr/bin/env python
+"""Streaming versions of spcat.pl, spcut.pl, spthin.pl and berand.pl.
+
+The Perl scripts hold a corpus, or its vocabulary counts, in hashes and
+parse the full text on every call.  Here a corpus is read through
+hcacorpus.py a batch of documents at a time and written out as it is
+read, so memory is bounded by the batch, plus a few arrays of length W
+or D, whatever the size of the collection:
+
+  cat    concatenate corpora, as spcat.pl; with one input, converts
+  head   the first N documents, as spcut.pl
+  thin   keep the N most frequent words and renumber them by frequency,
+         as spthin.pl, writing the kept words to OUTSTEM.tokens
+  split  TRAIN random training documents followed by the rest as test
+         documents, with OUTSTEM.epoch holding the epochs of each part
+         as "tca -T" reads them, as berand.pl; --stratify draws the
+         training documents of each epoch in proportion, leaving both
+         parts of every epoch nonempty
+
+Input and output are in any format of hca -f ("-f" and "-t"), and the
+input need not be ordered by document: with --sort docword and witdit
+entries are put in document order by an external merge sort, sorted runs
+of --run entries being saved to temporary files and merged a block at a
+time.  The order of the entries of a document is kept.  Word sequences
+of lst and witdit input are kept in lst and witdit output; for other
+outputs counts are summed per word.
+
+"-t csr" writes the binary CSR cache of hcacorpus.py as the directory
+OUTSTEM.csr, and an input stem naming such a directory, or any
+STEM.FMT.csr cache, is read from it without parsing.  --cache reads the
+input through its STEM.FMT.csr cache, building it if stale, and with a
+text output also writes the cache of the output, so repeated splits of
+the same data parse no text.  Headers of bag, lst and docword output are
+padded, as their counts are only known at the end.
+
+Usage:
+    sptools.py cat [-f ldac] [-t FMT] INSTEM ... OUTSTEM
+    sptools.py head INSTEM N OUTSTEM
+    sptools.py thin INSTEM N OUTSTEM
+    sptools.py split [--seed S] [--stratify] INSTEM OUTSTEM TRAIN
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import hcacorpus
+
+OUTPUTS = hcacorpus.FORMATS + ("csr",)
+
+# entries per sorted run of the external sort
+RUN_SIZE = 1 << 24
+
+# entries formatted as text at a time
+WRITE_SIZE = 1 << 18
+
+
+def sorted_triples(stem, fmt, run_size=RUN_SIZE, tmp_dir=None):
+    """The entries of docword or witdit files in document order.
+
+    Runs of up to run_size entries are sorted stably by document and
+    saved to a temporary directory, then merged a block per run at a
+    time, so at most about run_size entries are held.
+
+    Yields
+    ------
+    docs, words, counts : int64 arrays
+        As hcacorpus.read_triples(), ordered by document.
+    """
+    tmp = tempfile.mkdtemp(dir=tmp_dir, suffix=".runs")
+    try:
+        runs = []
+        chunks, size = [], 0
+        for chunk in hcacorpus.read_triples(stem, fmt):
+            chunks.append(np.column_stack(chunk))
+            size += len(chunks[-1])
+            if size >= run_size:
+                runs.append(_save_run(tmp, len(runs), chunks))
+                chunks, size = [], 0
+        if chunks or not runs:
+            runs.append(_save_run(tmp, len(runs), chunks))
+        runs = [np.load(path, mmap_mode="r") for path in runs]
+        block = max(1, run_size // len(runs))
+        pos = [0] * len(runs)
+        grow = 1
+        while True:
+            heads = [run[p:p + block * grow] for run, p in zip(runs, pos)]
+            if not any(len(head) for head in heads):
+                break
+            # documents before the least last document of the blocks of
+            # unfinished runs are complete in the blocks
+            bound = min([head[-1, 0] for run, p, head in zip(runs, pos, heads)
+                         if p + len(head) < len(run)] or [np.inf])
+            cuts = [len(head) if bound == np.inf else
+                    int(np.searchsorted(head[:, 0], bound)) for head in heads]
+            if not any(cuts):
+                # a document fills a whole block
+                grow *= 2
+                continue
+            grow = 1
+            merged = np.concatenate([np.asarray(head[:cut])
+                                     for head, cut in zip(heads, cuts)])
+            # a stable sort keeps the run order, so the file order, of the
+            # entries of a document
+            merged = merged[np.argsort(merged[:, 0], kind="stable")]
+            pos = [p + cut for p, cut in zip(pos, cuts)]
+            yield merged[:, 0], merged[:, 1], merged[:, 2]
+        del runs
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _save_run(tmp, i, chunks):
+    run = np.concatenate(chunks) if chunks else \
+        np.zeros((0, 3), dtype=np.int64)
+    path = os.path.join(tmp, "run%d.npy" % i)
+    np.save(path, run[np.argsort(run[:, 0], kind="stable")])
+    return path
+
+
+class Source(object):
+    """An input corpus, read as text, sorted, or from a CSR cache.
+
+    Parameters
+    ----------
+    stem : string
+        Data stem, or a CSR cache directory.
+
+    fmt : string (default="ldac")
+        One of hcacorpus.FORMATS; ignored for a cache directory.
+
+    cache : bool (default=False)
+        Read through the STEM.FMT.csr cache, building it if stale.
+
+    sort : bool (default=False)
+        Sort docword or witdit entries by document, with sorted_triples().
+
+    ordered : bool (default=False)
+        Keep the word order of lst and witdit text, as
+        hcacorpus.read_sequences(), rather than summing counts per word.
+
+    batch_size : int (default=10000)
+        Documents per batch.
+
+    Attributes
+    ----------
+    ``stem`` : string
+        Data stem, that of the source files of a cache directory.
+
+    ``tokens`` : string or None
+        The vocabulary file, if there is one.
+    """
+
+    def __init__(self, stem, fmt="ldac", cache=False, sort=False,
+                 ordered=False, batch_size=10000, run_size=RUN_SIZE):
+        self.corpus = None
+        self.ordered = ordered
+        self.batch_size = batch_size
+        self.run_size = run_size
+        self.sort = sort
+        if stem.endswith(".csr") and os.path.isdir(stem):
+            self.corpus = hcacorpus.Corpus(stem)
+            fmt = self.corpus.format
+            stem = stem[:-len(".csr")]
+            if stem.endswith("." + fmt):
+                stem = stem[:-len(fmt) - 1]
+            tokens = os.path.join(self.corpus.path, "vocab.txt")
+        else:
+            if cache:
+                self.corpus = hcacorpus.load_corpus(stem, fmt,
+                                                    batch_size=batch_size)
+            tokens = stem + ".tokens"
+        self.stem = stem
+        self.format = fmt
+        self.tokens = tokens if os.path.exists(tokens) else None
+        self._D = None
+
+    def batches(self):
+        """A fresh iterator over the CSRBatch of the corpus."""
+        if self.corpus is not None:
+            return self.corpus.batches(self.batch_size)
+        if self.sort and self.format in ("docword", "witdit"):
+            size = hcacorpus.header_size(self.stem, self.format)
+            return hcacorpus.batch_triples(
+                sorted_triples(self.stem, self.format, self.run_size,
+                               os.path.dirname(os.path.abspath(self.stem))),
+                self.format, self.batch_size, self.ordered,
+                size[0] if size else None)
+        if self.ordered and self.format in ("lst", "witdit"):
+            return hcacorpus.read_sequences(self.stem, self.format,
+                                            self.batch_size)
+        return hcacorpus.read_batches(self.stem, self.format, self.batch_size)
+
+    @property
+    def W(self):
+        """Vocabulary size from a header or cache, else the words of the
+        vocabulary file, else 0."""
+        if self.corpus is not None:
+            return self.corpus.W
+        size = hcacorpus.header_size(self.stem, self.format)
+        if size:
+            return size[1]
+        if self.tokens:
+            with open(self.tokens, "rb") as f:
+                return sum(1 for line in f)
+        return 0
+
+    @property
+    def D(self):
+        """Number of documents, counted with a pass if need be."""
+        if self._D is None:
+            if self.corpus is not None:
+                self._D = len(self.corpus)
+            elif self.format in ("bag", "lst", "docword"):
+                self._D = hcacorpus.header_size(self.stem, self.format)[0]
+            else:
+                self._D = 0
+                for batch in self.batches():
+                    self._D += len(batch.indptr) - 1
+        return self._D
+
+
+def _pad(n):
+    return ("%d" % n).ljust(20) + "\n"
+
+
+class Writer(object):
+    """Write a corpus a batch at a time, in a format of hca -f or "csr".
+
+    Parameters
+    ----------
+    stem : string
+        Output data stem; "csr" is written to the directory STEM.csr.
+
+    fmt : string (default="ldac")
+        One of OUTPUTS.
+
+    cache : bool (default=False)
+        Also write the STEM.FMT.csr cache of a text output.
+    """
+
+    def __init__(self, stem, fmt="ldac", cache=False):
+        if fmt not in OUTPUTS:
+            raise ValueError("Unknown format '%s', need one of %s"
+                             % (fmt, ", ".join(OUTPUTS)))
+        self.stem = stem
+        self.format = fmt
+        self.D, self.W, self.NNZ = 0, 0, 0
+        self.files = []
+        self.cache = None
+        if fmt == "csr":
+            self.cache = hcacorpus.CacheWriter(stem + ".csr")
+            return
+        if cache:
+            self.cache = hcacorpus.CacheWriter(hcacorpus.cache_dir(stem, fmt))
+        self.files = [open(path, "w") for path in
+                      hcacorpus.data_files(stem, fmt)]
+        # counts of the header are written at the end, over the padding
+        if fmt in ("bag", "lst"):
+            self.files[0].write(_pad(0) * 2)
+        elif fmt == "docword":
+            self.files[0].write(_pad(0) * 3)
+
+    def write(self, batch):
+        """Append the documents of a CSRBatch, numbered on from the last."""
+        indptr = np.asarray(batch.indptr)
+        if self.files and indptr[-1] > WRITE_SIZE:
+            # bound the strings of a big batch by writing it in slices
+            cuts = np.searchsorted(indptr, np.arange(0, indptr[-1],
+                                                     WRITE_SIZE), "right")
+            cuts = np.unique(np.append(cuts - 1, len(indptr) - 1))
+            for lo, hi in zip(cuts[:-1].tolist(), cuts[1:].tolist()):
+                a, b = indptr[lo], indptr[hi]
+                self._write(hcacorpus.CSRBatch(batch.start + lo,
+                                               indptr[lo:hi + 1] - a,
+                                               batch.indices[a:b],
+                                               batch.data[a:b]))
+            return
+        self._write(batch)
+
+    def _write(self, batch):
+        indptr = np.asarray(batch.indptr)
+        words = np.asarray(batch.indices, dtype=np.int64)
+        counts = np.asarray(batch.data, dtype=np.int64)
+        lengths = np.diff(indptr)
+        n_docs = len(lengths)
+        if self.cache is not None:
+            self.cache.write(hcacorpus.CSRBatch(self.D, indptr, words,
+                                                counts))
+        if len(words):
+            self.W = max(self.W, int(words.max()) + 1)
+        out = self.files[0] if self.files else None
+        if self.format in ("bag", "ldac"):
+            pair = "%d:%d" if self.format == "ldac" else "%d %d"
+            entries = [pair % wc for wc in zip(words.tolist(),
+                                                counts.tolist())]
+            bounds = indptr.tolist()
+            out.write("".join(
+                "%d %s\n" % (n, " ".join(entries[bounds[i]:bounds[i + 1]]))
+                if n else "0\n" for i, n in enumerate(lengths.tolist())))
+        elif self.format == "lst":
+            tokens = np.repeat(words, counts).tolist()
+            ends = np.cumsum(np.bincount(
+                np.repeat(np.arange(n_docs), lengths), weights=counts,
+                minlength=n_docs)).astype(np.int64).tolist()
+            lines, lo = [], 0
+            for hi in ends:
+                lines.append(" ".join(map(str, [hi - lo] + tokens[lo:hi])))
+                lo = hi
+            out.write("\n".join(lines) + "\n" if lines else "")
+        elif self.format == "docword":
+            docs = np.repeat(np.arange(self.D + 1, self.D + n_docs + 1),
+                             lengths)
+            out.write("".join("%d %d %d\n" % e for e in
+                              zip(docs.tolist(), (words + 1).tolist(),
+                                  counts.tolist())))
+        elif self.format == "witdit":
+            docs = np.repeat(np.arange(self.D + 1, self.D + n_docs + 1),
+                             lengths)
+            self.files[0].write("".join(
+                "%d\n" % w for w in np.repeat(words + 1, counts).tolist()))
+            self.files[1].write("".join(
+                "%d\n" % d for d in np.repeat(docs, counts).tolist()))
+        self.D += n_docs
+        self.NNZ += len(words)
+
+    def close(self, W=0, tokens=None):
+        """Finish the output.
+
+        Parameters
+        ----------
+        W : int (default=0)
+            Vocabulary size, if more than the word ids show.
+
+        tokens : string, list of strings or None
+            Vocabulary file copied to STEM.tokens, or its words.
+        """
+        W = self.W = max(W, self.W)
+        if self.format in ("bag", "lst", "docword"):
+            out = self.files[0]
+            out.seek(0)
+            out.write(_pad(self.D) + _pad(W))
+            if self.format == "docword":
+                out.write(_pad(self.NNZ))
+        for f in self.files:
+            f.close()
+        vocab = None
+        if tokens is not None:
+            # the cache of csr output holds the only copy
+            vocab = os.path.join(self.cache.tmp, "vocab.txt") \
+                if self.format == "csr" else self.stem + ".tokens"
+            if isinstance(tokens, str):
+                shutil.copyfile(tokens, vocab)
+            else:
+                with open(vocab, "w") as f:
+                    f.write("".join(word + "\n" for word in tokens))
+        if self.format == "csr":
+            self.cache.close("csr", W)
+        elif self.cache is not None:
+            self.cache.close(self.format, W,
+                             hcacorpus._sources(self.stem, self.format),
+                             vocab)
+
+    def abort(self):
+        """Drop a partial output."""
+        for f in self.files:
+            f.close()
+            os.remove(f.name)
+        if self.cache is not None:
+            self.cache.abort()
+
+
+def _same_file(a, b):
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            chunk = fa.read(1 << 20)
+            if chunk != fb.read(1 << 20):
+                return False
+            if not chunk:
+                return True
+
+
+def concatenate(sources, writer):
+    """Write the documents of each Source in turn, as spcat.pl.
+
+    Vocabulary files, where there are any, must be the same.
+    """
+    tokens = [source.tokens for source in sources if source.tokens]
+    for other in tokens[1:]:
+        if not _same_file(tokens[0], other):
+            raise ValueError("Vocabularies '%s' and '%s' differ"
+                             % (tokens[0], other))
+    for source in sources:
+        for batch in source.batches():
+            writer.write(batch)
+    writer.close(max(source.W for source in sources),
+                 tokens[0] if tokens else None)
+
+
+def head(source, N, writer):
+    """Write the first N documents of a Source, as spcut.pl."""
+    for batch in source.batches():
+        if writer.D >= N:
+            break
+        n_docs = min(len(batch.indptr) - 1, N - writer.D)
+        end = batch.indptr[n_docs]
+        writer.write(hcacorpus.CSRBatch(batch.start, batch.indptr[:n_docs + 1],
+                                        batch.indices[:end],
+                                        batch.data[:end]))
+    if writer.D < N:
+        raise ValueError("Corpus '%s' has only %d documents, need %d"
+                         % (source.stem, writer.D, N))
+    writer.close(source.W, source.tokens)
+
+
+def word_counts(source):
+    """Total count of each word of a Source, with one pass."""
+    counts = np.zeros(source.W, dtype=np.int64)
+    for batch in source.batches():
+        more = np.bincount(batch.indices, weights=batch.data)
+        if len(more) > len(counts):
+            counts = np.concatenate((counts, np.zeros(len(more) - len(counts),
+                                                      dtype=np.int64)))
+        counts[:len(more)] += more.astype(np.int64)
+    return counts
+
+
+def thin(source, N, writer):
+    """Keep the N most frequent words of a Source, as spthin.pl.
+
+    Kept words are numbered from 0 by decreasing count, ties by word id,
+    and documents left empty are kept.
+
+    Returns
+    -------
+    keep : int64 array of shape (N,)
+        The old id of each new word id.
+    """
+    counts = word_counts(source)
+    if N > len(counts):
+        raise ValueError("Corpus '%s' has only %d words, need %d"
+                         % (source.stem, len(counts), N))
+    keep = np.argsort(-counts, kind="stable")[:N]
+    mapping = np.full(len(counts), -1, dtype=np.int64)
+    mapping[keep] = np.arange(N)
+    for batch in source.batches():
+        words = mapping[np.asarray(batch.indices, dtype=np.int64)]
+        kept = words >= 0
+        n_docs = len(batch.indptr) - 1
+        rows = np.repeat(np.arange(n_docs), np.diff(batch.indptr))
+        lengths = np.bincount(rows[kept], minlength=n_docs)
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        writer.write(hcacorpus.CSRBatch(batch.start, indptr, words[kept],
+                                        np.asarray(batch.data)[kept]))
+    vocab = None
+    if source.tokens:
+        with open(source.tokens, "rb") as f:
+            words = [line.decode("utf-8").rstrip("\r\n") for line in f]
+        vocab = [words[k] if k < len(words) else "" for k in keep.tolist()]
+    writer.close(N, vocab)
+    return keep
+
+
+def read_epochs(path):
+    """Document counts of the epochs of a ".epoch" file, its first part."""
+    with open(path) as f:
+        numbers = [int(v) for v in f.read().split()]
+    if not numbers or len(numbers) < numbers[0] + 1:
+        raise ValueError("Cannot read epochs from '%s'" % path)
+    return np.array(numbers[1:numbers[0] + 1], dtype=np.int64)
+
+
+def _allocate(sizes, total):
+    """Split total over epochs in proportion to sizes, by largest
+    remainder, leaving at least one document of every epoch of two or more
+    on each side."""
+    share = sizes * float(total) / max(sizes.sum(), 1)
+    low = np.minimum(1, sizes - 1).clip(0)
+    high = np.maximum(sizes - 1, low)
+    quota = np.clip(np.floor(share).astype(np.int64), low, high)
+    while quota.sum() != total:
+        step = 1 if quota.sum() < total else -1
+        room = quota < high if step > 0 else quota > low
+        if not room.any():
+            raise ValueError("Cannot take %d training documents with both "
+                             "parts of each epoch nonempty" % total)
+        # the epoch furthest below, or above, its share
+        gap = np.where(room, (share - quota) * step, -np.inf)
+        quota[np.argmax(gap)] += step
+    return quota
+
+
+def choose_training(epochs, train, seed=0, stratify=False):
+    """Boolean mask of the training documents.
+
+    Parameters
+    ----------
+    epochs : int64 array
+        Documents in each epoch, in document order.
+
+    train : int
+        Training documents to draw.
+
+    stratify : bool (default=False)
+        Draw from each epoch in proportion to its size, else uniformly
+        over all documents, as berand.pl.
+    """
+    rng = np.random.RandomState(seed)
+    D = int(epochs.sum())
+    mask = np.zeros(D, dtype=bool)
+    if not stratify:
+        mask[rng.permutation(D)[:train]] = True
+        return mask
+    lo = 0
+    for size, quota in zip(epochs.tolist(), _allocate(epochs, train)):
+        mask[lo + rng.permutation(size)[:quota]] = True
+        lo += size
+    return mask
+
+
+def _select(batch, rows):
+    """The documents of a CSRBatch where rows is True."""
+    lengths = np.diff(batch.indptr)
+    entries = np.repeat(rows, lengths)
+    indptr = np.zeros(int(rows.sum()) + 1, dtype=np.int64)
+    np.cumsum(lengths[rows], out=indptr[1:])
+    return hcacorpus.CSRBatch(batch.start, indptr,
+                              np.asarray(batch.indices)[entries],
+                              np.asarray(batch.data)[entries])
+
+
+def split(source, writer, train, epoch_file=None, seed=0, stratify=False,
+          test_writer=None):
+    """Training then test documents of a Source, as berand.pl.
+
+    Apart from the split, documents keep their order.  Both parts go to
+    writer, followed by each other, unless a test_writer is given.
+
+    Returns
+    -------
+    train_epochs, test_epochs : int64 arrays
+        Documents of each part in each epoch, for the ".epoch" file.
+    """
+    if epoch_file is None:
+        epoch_file = source.stem + ".epoch"
+    epochs = read_epochs(epoch_file)
+    if epochs.sum() != source.D:
+        raise ValueError("Epoch file '%s' has %d documents, corpus has %d"
+                         % (epoch_file, epochs.sum(), source.D))
+    if train > source.D - 2 * len(epochs):
+        raise ValueError("Training set size %d too large for %d documents "
+                         "in %d epochs" % (train, source.D, len(epochs)))
+    mask = choose_training(epochs, train, seed, stratify)
+    epoch = np.repeat(np.arange(len(epochs)), epochs)
+    # two passes keep each part in document order without holding either
+    test_writer = test_writer or writer
+    for part, out in ((mask, writer), (~mask, test_writer)):
+        for batch in source.batches():
+            D = len(batch.indptr) - 1
+            out.write(_select(batch, part[batch.start:batch.start + D]))
+    writer.close(source.W, source.tokens)
+    if test_writer is not writer:
+        test_writer.close(source.W, source.tokens)
+    return (np.bincount(epoch[mask], minlength=len(epochs)),
+            np.bincount(epoch[~mask], minlength=len(epochs)))
+
+
+def write_epochs(path, *parts):
+    """Write a ".epoch" file of one or more parts, as berand.pl."""
+    with open(path, "w") as f:
+        for counts in parts:
+            f.write("%d\n" % len(counts))
+            f.write("".join(" %d\n" % n for n in counts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Concatenate, cut, thin and split corpora, streaming.")
+    sub = parser.add_subparsers(dest="command")
+    commands = {}
+    commands["cat"] = sub.add_parser("cat", help="concatenate corpora")
+    commands["cat"].add_argument("stems", nargs="+",
+                                 metavar="STEM", help="INSTEM ... OUTSTEM")
+    commands["head"] = sub.add_parser("head", help="first N documents")
+    commands["thin"] = sub.add_parser("thin", help="N most frequent words")
+    for name in ("head", "thin"):
+        commands[name].add_argument("instem")
+        commands[name].add_argument("N", type=int)
+        commands[name].add_argument("outstem")
+    commands["split"] = sub.add_parser(
+        "split", help="random train/test split with its .epoch file")
+    commands["split"].add_argument("instem")
+    commands["split"].add_argument("outstem")
+    commands["split"].add_argument("train", type=int,
+                                   help="number of training documents")
+    commands["split"].add_argument("--seed", type=int, default=0,
+                                   help="random seed")
+    commands["split"].add_argument("--stratify", action="store_true",
+                                   help="draw training documents per epoch")
+    commands["split"].add_argument("--epoch", metavar="FILE",
+                                   help="epoch file (default INSTEM.epoch)")
+    commands["split"].add_argument("--test", metavar="TESTSTEM",
+                                   help="write the test documents to "
+                                   "TESTSTEM instead, for hca -T TESTSTEM")
+    for command in commands.values():
+        command.add_argument("-f", "--format", default="ldac",
+                             choices=hcacorpus.FORMATS,
+                             help="input format as for hca -f "
+                             "(default ldac)")
+        command.add_argument("-t", "--to", choices=OUTPUTS,
+                             help="output format (default the input's)")
+        command.add_argument("--cache", action="store_true",
+                             help="read and write binary CSR caches")
+        command.add_argument("--sort", action="store_true",
+                             help="sort docword or witdit input by document")
+        command.add_argument("--run", type=int, default=RUN_SIZE,
+                             help="entries per sorted run of --sort")
+        command.add_argument("-b", "--batch", type=int, default=10000,
+                             help="documents per batch")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+
+    # word order is kept from and to lst and witdit text
+    ordered = args.to in (None, "lst", "witdit") and not args.cache
+
+    def open_source(stem):
+        return Source(stem, args.format, args.cache, args.sort, ordered,
+                      args.batch, args.run)
+
+    if args.command == "cat":
+        if len(args.stems) < 2:
+            parser.error("need INSTEM ... OUTSTEM")
+        sources = [open_source(stem) for stem in args.stems[:-1]]
+        outstem = args.stems[-1]
+    else:
+        sources = [open_source(args.instem)]
+        outstem = args.outstem
+    fmt = args.to or sources[0].format
+    writers = [Writer(outstem, fmt, args.cache)]
+    if args.command == "split" and args.test:
+        writers.append(Writer(args.test, fmt, args.cache))
+    writer = writers[0]
+    try:
+        if args.command == "cat":
+            concatenate(sources, writer)
+        elif args.command == "head":
+            head(sources[0], args.N, writer)
+        elif args.command == "thin":
+            thin(sources[0], args.N, writer)
+        else:
+            sys.stderr.write("Extracting %d training docs from %d\n"
+                             % (args.train, sources[0].D))
+            parts = split(sources[0], writer, args.train, args.epoch,
+                          args.seed, args.stratify, writers[-1])
+            write_epochs(outstem + ".epoch", *parts)
+    except:
+        for out in writers:
+            out.abort()
+        raise
+    sys.stderr.write("%s: D=%d W=%d NNZ=%d\n"
+                     % (outstem, writer.D, writer.W, writer.NNZ))
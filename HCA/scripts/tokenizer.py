@@ -45,9 +45,20 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import argparse
+import array
+import bisect
+import bz2
 import collections
+import gzip
+import io
+import multiprocessing
+import os
+import re
 import sys
+import tempfile
 import unicodedata
+import zlib
 
 # Dependency imports
 
@@ -59,27 +70,142 @@ from six.moves import xrange  # pylint: disable=redefined-builtin
 _native_to_unicode = (lambda s: s.decode("utf-8")) if six.PY2 else (lambda s: s)
 
 
+# Letter and number characters are described by a sorted table of code point
+# boundaries: code point i is alphanumeric iff bisect_right(table, i) is odd.
+# Building the table needs unicodedata.category() on every code point, so
+# it is cached on disk, keyed by the Unicode version, and only loaded on
+# first use.
+_ALNUM_CACHE_DIR = os.environ.get(
+    "TOKENIZER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "hca"))
+
+
+def _alnum_table_path():
+  return os.path.join(_ALNUM_CACHE_DIR, "alnum-%s-%x.bin" % (
+      unicodedata.unidata_version, sys.maxunicode))
+
+
+def _build_alnum_table():
+  """Compute the letter/number boundary table from unicodedata.
+
+  Returns:
+    an array.array of code points where alphanumeric runs start and end
+  """
+  table = array.array("i")
+  inside = False
+  for i in xrange(sys.maxunicode):
+    cat = unicodedata.category(six.unichr(i))
+    if cat.startswith("L") or cat.startswith("N"):
+      if not inside:
+        table.append(i)
+        inside = True
+    elif inside:
+      table.append(i)
+      inside = False
+  if inside:
+    table.append(sys.maxunicode)
+  return table
+
+
+def _load_alnum_table():
+  """Load the boundary table from the cache, building and saving on a miss.
+
+  Returns:
+    an array.array as for _build_alnum_table()
+  """
+  path = _alnum_table_path()
+  table = array.array("i")
+  try:
+    with open(path, "rb") as f:
+      table.fromfile(f, os.path.getsize(path) // table.itemsize)
+    return table
+  except (IOError, OSError, EOFError):
+    pass
+  table = _build_alnum_table()
+  # write atomically, since many shards may start at once;
+  # an unwritable cache directory just means building each time
+  try:
+    if not os.path.isdir(_ALNUM_CACHE_DIR):
+      os.makedirs(_ALNUM_CACHE_DIR)
+    fd, tmp = tempfile.mkstemp(dir=_ALNUM_CACHE_DIR)
+    with os.fdopen(fd, "wb") as f:
+      table.tofile(f)
+    os.rename(tmp, path)
+  except (IOError, OSError):
+    pass
+  return table
+
+
+class _AlphanumericCharSet(dict):
+  """Set-like membership test for all letter and number characters.
+
+  Indexing by a character gives True or False.  The boundary table is
+  loaded lazily, and the answer for each distinct character seen is kept
+  in the dict itself, so import costs nothing and lookups after the first
+  occurrence of a character run at dict speed.
+  """
+
+  _table = None
+
+  @property
+  def table(self):
+    if self._table is None:
+      self._table = _load_alnum_table()
+    return self._table
+
+  def __missing__(self, c):
+    ret = self[c] = bool(bisect.bisect_right(self.table, ord(c)) & 1)
+    return ret
+
+  def __contains__(self, c):
+    return self[c]
+
+
 # This set contains all letter and number characters.
-_ALPHANUMERIC_CHAR_SET = set(
-    six.unichr(i) for i in xrange(sys.maxunicode)
-    if (unicodedata.category(six.unichr(i)).startswith("L") or
-        unicodedata.category(six.unichr(i)).startswith("N")))
+_ALPHANUMERIC_CHAR_SET = _AlphanumericCharSet()
 
+# Compiled on first use: (find alternating runs, search astral characters).
+# The character classes only cover the Basic Multilingual Plane, which lets
+# the regex engine use a bitmap; text with astral characters takes the
+# per-character path instead.
+_TOKEN_PATTERNS = []
 
-def encode(text):
-  """Encode a unicode string as a list of tokens.
 
-  Args:
-    text: a unicode string
+def _token_patterns():
+  """Compile the regular expressions over the alphanumeric boundary table.
+
   Returns:
-    a list of tokens as Unicode strings
+    a pair (findall, search) of bound pattern methods
   """
-  if not text:
-    return []
+  if not _TOKEN_PATTERNS:
+    table = _ALPHANUMERIC_CHAR_SET.table
+    ranges = []
+    for i in xrange(0, len(table), 2):
+      first, last = table[i], min(table[i + 1] - 1, 0xFFFF)
+      if first > last:
+        break
+      if first == last:
+        ranges.append(six.unichr(first))
+      else:
+        ranges.append(u"%s-%s" % (six.unichr(first), six.unichr(last)))
+    ranges = u"".join(ranges)
+    runs = re.compile(u"[%s]+|[^%s]+" % (ranges, ranges), re.UNICODE)
+    if sys.maxunicode > 0xFFFF:
+      astral = re.compile(u"[%s-%s]" % (six.unichr(0x10000),
+                                         six.unichr(sys.maxunicode)),
+                          re.UNICODE).search
+    else:
+      astral = lambda text: None
+    _TOKEN_PATTERNS[:] = [runs.findall, astral]
+  return _TOKEN_PATTERNS
+
+
+def _encode_chars(text):
+  """Encode by classifying one character at a time, as for encode()."""
   ret = []
   token_start = 0
   # Classify each character in the input string
-  is_alnum = [c in _ALPHANUMERIC_CHAR_SET for c in text]
+  is_alnum = [_ALPHANUMERIC_CHAR_SET[c] for c in text]
   for pos in xrange(1, len(text)):
     if is_alnum[pos] != is_alnum[pos - 1]:
       token = text[token_start:pos]
@@ -91,6 +217,27 @@ def encode(text):
   return ret
 
 
+def encode(text):
+  """Encode a unicode string as a list of tokens.
+
+  Args:
+    text: a unicode string
+  Returns:
+    a list of tokens as Unicode strings
+  """
+  if not text:
+    return []
+  findall, astral = _token_patterns()
+  if astral(text):
+    return _encode_chars(text)
+  # runs alternate between alphanumeric and non-alphanumeric
+  tokens = findall(text)
+  if len(tokens) < 3:
+    return tokens
+  return (tokens[:1] + [t for t in tokens[1:-1] if t != u" "] +
+          tokens[-1:])
+
+
 def decode(tokens):
   """Decode a list of tokens to a unicode string.
 
@@ -99,26 +246,235 @@ def decode(tokens):
   Returns:
     a unicode string
   """
-  token_is_alnum = [t[0] in _ALPHANUMERIC_CHAR_SET for t in tokens]
-  ret = []
-  for i, token in enumerate(tokens):
-    if i > 0 and token_is_alnum[i - 1] and token_is_alnum[i]:
+  if not tokens:
+    return u""
+  alnum = _ALPHANUMERIC_CHAR_SET
+  token_is_alnum = [alnum[t[0]] for t in tokens]
+  ret = [tokens[0]]
+  for prev, cur, token in zip(token_is_alnum, token_is_alnum[1:], tokens[1:]):
+    if prev and cur:
       ret.append(u" ")
     ret.append(token)
-  return "".join(ret)
+  return u"".join(ret)
 
 
-if __name__ == "__main__":
-    # python 2/3 compatibility
-    import codecs
-    if sys.version_info < (3, 0):
-        sys.stderr = codecs.getwriter('UTF-8')(sys.stderr)
-        sys.stdout = codecs.getwriter('UTF-8')(sys.stdout)
-        #sys.stdin = codecs.getreader('UTF-8')(sys.stdin)
+def words(text):
+  """Return only the alphanumeric tokens of a unicode string.
+
+  Args:
+    text: a unicode string
+  Returns:
+    a list of the letter and number tokens of encode(text)
+  """
+  alnum = _ALPHANUMERIC_CHAR_SET
+  return [t for t in encode(text) if alnum[t[0]]]
+
+
+def encode_batch(texts):
+  """Encode a sequence of unicode strings, as for encode().
+
+  Args:
+    texts: an iterable of unicode strings, e.g. the lines of a file
+  Returns:
+    a list with a list of tokens for each string
+  """
+  findall, astral = _token_patterns()
+  ret = []
+  for text in texts:
+    if not text:
+      ret.append([])
+      continue
+    if astral(text):
+      ret.append(_encode_chars(text))
+      continue
+    tokens = findall(text)
+    if len(tokens) >= 3:
+      tokens = (tokens[:1] + [t for t in tokens[1:-1] if t != u" "] +
+                tokens[-1:])
+    ret.append(tokens)
+  return ret
+
+
+def decode_batch(token_lists):
+  """Decode a sequence of token lists, as for decode().
+
+  Args:
+    token_lists: an iterable of lists of Unicode strings
+  Returns:
+    a list of unicode strings
+  """
+  return [decode(tokens) for tokens in token_lists]
+
+
+class _Prefixed(io.RawIOBase):
+  """A binary stream with bytes already read from it put back in front."""
+
+  def __init__(self, prefix, f):
+    self._prefix = prefix
+    self._f = f
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    if self._prefix:
+      data, self._prefix = self._prefix[:len(b)], self._prefix[len(b):]
     else:
-        sys.stderr = codecs.getwriter('UTF-8')(sys.stderr.buffer)
-        sys.stdout = codecs.getwriter('UTF-8')(sys.stdout.buffer)
-        #sys.stdin = codecs.getreader('UTF-8')(sys.stdin.buffer)
-    for line in sys.stdin:
-        line.strip()
-        print(' '.join(encode(line)), '\n')
+      data = self._f.read(len(b))
+    b[:len(data)] = data
+    return len(data)
+
+  def close(self):
+    self._f.close()
+    super(_Prefixed, self).close()
+
+
+class _Decompressed(io.RawIOBase):
+  """Decompress a stream of concatenated gzip members or bzip2 streams.
+
+  Only for Python 2, whose GzipFile needs a seekable file and whose
+  BZ2File only opens file names.
+  """
+
+  def __init__(self, f, decompressor):
+    self._f = f
+    self._new = decompressor
+    self._z = decompressor()
+    self._out = b""
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    while not self._out:
+      data = self._f.read(1 << 16)
+      if not data:
+        return 0
+      while data:
+        try:
+          self._out += self._z.decompress(data)
+        except EOFError:
+          # a bzip2 stream ended, the next one starts here
+          self._z = self._new()
+          continue
+        # a gzip member ended within the data
+        data = self._z.unused_data
+        if data:
+          self._z = self._new()
+    data, self._out = self._out[:len(b)], self._out[len(b):]
+    b[:len(data)] = data
+    return len(data)
+
+  def close(self):
+    self._f.close()
+    super(_Decompressed, self).close()
+
+
+def open_input(path):
+  """Open a file, or stdin for "-", for binary reading.
+
+  Gzip and bzip2 input is recognised by its magic number and decompressed
+  on the fly.
+  """
+  if path == "-":
+    f = getattr(sys.stdin, "buffer", None)
+    if f is None:
+      f = io.open(sys.stdin.fileno(), "rb", closefd=False)
+  else:
+    f = io.open(path, "rb")
+  # a pipe may give fewer bytes than asked for at a time
+  magic = b""
+  while len(magic) < 3:
+    more = f.read(3 - len(magic))
+    if not more:
+      break
+    magic += more
+  f = io.BufferedReader(_Prefixed(magic, f))
+  if magic[:2] == b"\x1f\x8b":
+    if six.PY2:
+      return io.BufferedReader(_Decompressed(
+          f, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)))
+    return gzip.GzipFile(fileobj=f)
+  if magic == b"BZh":
+    if six.PY2:
+      return io.BufferedReader(_Decompressed(f, bz2.BZ2Decompressor))
+    return bz2.BZ2File(f)
+  return f
+
+
+def _encode_lines(lines):
+  """Tokenize a chunk of UTF-8 lines into one UTF-8 output buffer.
+
+  Args:
+    lines: a list of byte strings, each one input line
+  Returns:
+    a byte string with the space-separated tokens of each line, one per line
+  """
+  out = [u" ".join(tokens) for tokens in
+         encode_batch(line.decode("utf-8").strip() for line in lines)]
+  out.append(u"")
+  return u"\n".join(out).encode("utf-8")
+
+
+def _chunks(paths, chunk_size):
+  """Yield lists of whole lines of about chunk_size bytes from each input."""
+  for path in paths:
+    f = open_input(path)
+    while True:
+      lines = f.readlines(chunk_size)
+      if not lines:
+        break
+      yield lines
+    if path != "-":
+      f.close()
+
+
+def tokenize_stream(paths, out, jobs=1, chunk_size=1 << 20):
+  """Tokenize input files line by line, writing output in input order.
+
+  With jobs > 1, chunks are tokenized by a process pool.  At most 2 * jobs
+  chunks are in flight, so memory stays flat however large the input.
+
+  Args:
+    paths: list of file names, "-" for stdin
+    out: a binary file object to write to
+    jobs: number of worker processes
+    chunk_size: approximate number of input bytes per chunk
+  """
+  chunks = _chunks(paths, chunk_size)
+  if jobs <= 1:
+    for lines in chunks:
+      out.write(_encode_lines(lines))
+    return
+  # compile before forking so workers inherit the patterns
+  _token_patterns()
+  pool = multiprocessing.Pool(jobs)
+  try:
+    pending = collections.deque()
+    for lines in chunks:
+      pending.append(pool.apply_async(_encode_lines, (lines,)))
+      if len(pending) >= 2 * jobs:
+        out.write(pending.popleft().get())
+    while pending:
+      out.write(pending.popleft().get())
+  except:
+    pool.terminate()
+    raise
+  pool.close()
+  pool.join()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description="Tokenize text one line at a time with the invertible "
+      "tokenizer, writing the tokens of each line space separated.  "
+      "Gzip and bzip2 input is decompressed directly.")
+  parser.add_argument("files", nargs="*", default=["-"],
+                      help="input files (default stdin)")
+  parser.add_argument("-j", "--jobs", type=int, default=1,
+                      help="number of worker processes (default 1)")
+  parser.add_argument("--chunk-size", type=int, default=1 << 20,
+                      help="bytes of input per work chunk (default 1MB)")
+  args = parser.parse_args()
+  tokenize_stream(args.files, getattr(sys.stdout, "buffer", sys.stdout),
+                  jobs=args.jobs, chunk_size=args.chunk_size)
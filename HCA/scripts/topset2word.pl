@@ -2,7 +2,7 @@
 #
 #   A man entry for this script is given at the end using POD.
 #   The script class the following commands:
-#        wordcloud_cli.py,  dot,
+#        wordcloud_batch.py,  dot,
 
 use Getopt::Long;
 use Pod::Usage;
@@ -36,6 +36,8 @@ $DOT = "";
 $LANG = "svg";
 $BGCOLOR="white";
 $ECOLOR="black";
+#  processes for rendering images, 0 for one per CPU
+$JOBS = 0;
 
 $COMMAND = join(" ",@ARGV);
 GetOptions(
@@ -51,6 +53,7 @@ GetOptions(
     'sizefact=i' => \$SIZEFACT,
     'propfact=s' => \$PROPFACT,
     'edgeweight=s' => \$EDGEWEIGHT,
+    'jobs=i' => \$JOBS,
     'h|help'       => sub {pod2usage(1)}
     );
 
@@ -147,6 +150,8 @@ if ( ! $noimages ) {
     my $printtop = 0;
     print STDERR "Create images: ";
     mkdir($RES);
+    #  all images are listed in the manifest and rendered in one run
+    open(M,">$RES.manifest");
     #  compute scales for efw
     $maxefw = 0;
     $minefw = 100000;
@@ -168,17 +173,15 @@ if ( ! $noimages ) {
 	    next;
 	}
 	$printtop++;
-	open(F,">$RES.txt");
 	# print "$t";
 	my $href = $data[$t];
+	my $text = "";
 	foreach my $k ( keys(%$href) ) {
 	    my ($cnt,$df,$rank) = split(/,/, $data[$t]{$k});
 	    $rank = $rank / ($maxrank[$t] + 0.0001);
 	    $cnt = $cnt / ($maxcnt[$t] + 0.0001);
-	    print F " $k,$cnt,$rank";
+	    $text .= " $k,$cnt,$rank";
 	}
-	print F "\n";
-	close(F);
 	#   compute hue
 	my $efw = ($efw[$t]-$minefw) / ($maxefw-$minefw);
 	my $hue = int($efw*$MAXHUE);
@@ -187,15 +190,11 @@ if ( ! $noimages ) {
 	# print "$t $prop[$t] $pp\n";
 	my $S1 = int(($IMAGEWIDTH * $pp) / ($SIZEFACT+2));
 	my $S2 = int(($IMAGEHEIGHT * $pp) / ($SIZEFACT+2));
-	#  run
-	system("wordcloud_cli.py --text $RES.txt --imagefile $RES/$t.png --background=hue=$hue --width=$S1 --height=$S2")==0
-	    or die "Failure of executable 'wordcloud_cli.py'\n";
-	print STDERR " $t";
-	unlink("$RES.txt");
+	print M "$RES/$t.png hue=$hue $S1 $S2$text\n";
     }
     if ( %databg ) {
 	#  yes, there is a background topic
-	open(F,">$RES.txt");
+	my $text = "";
 	foreach my $k ( keys(%databg) ) {
 	    my ($cnt,$rank) = split(/,/, $databg{$k});
 	    if ( $maxbgcnt == 0 ) {
@@ -204,16 +203,14 @@ if ( ! $noimages ) {
 		$cnt = $cnt / ($maxbgcnt + 0.0001);
 	    }
 	    $rank = ($rank - $minbgprop) / $maxbgprop;
-	    print F " $k,$cnt,$rank";
+	    $text .= " $k,$cnt,$rank";
 	}
-	print F "\n";
-	close(F);
-	system("wordcloud_cli.py --text $RES.txt --imagefile $RES/BG.png --background=hue=$BGHUE --width=$IMAGEWIDTH --height=$IMAGEHEIGHT")==0
-	    or die "Failure of executable 'wordcloud_cli.py'\n";
-	unlink("$RES.txt");
-	print STDERR " BG";
+	print M "$RES/BG.png hue=$BGHUE $IMAGEWIDTH $IMAGEHEIGHT$text\n";
     }
-    print STDERR "\n";
+    close(M);
+    system("wordcloud_batch.py --jobs $JOBS $RES.manifest")==0
+	or die "Failure of executable 'wordcloud_batch.py'\n";
+    unlink("$RES.manifest");
     print STDERR "Printed $printtop topics\n";
 }
 
@@ -322,6 +319,7 @@ topset2word.pl [options] STEM RES
    --dot=s             pass on string to dot
    --edgeweight=f      edges have proportional weight to penwidth, by f
    --help              brief help message
+   --jobs=i            processes rendering images, default one per CPU
    --lang=s            sends to "-T" option in dot ("svg","pdf","png", ...)
    --man               full documentation
    --maxwidth=w        maximum penwidth for arcs
@@ -372,7 +370,8 @@ I<wordcloud.py> that must replace the same in
 Andreas Mueller's
 I<wordcloud> Python system
 to run 
-I<wordcloud_cli.py> .
+I<wordcloud_batch.py> ,
+which renders all the images in one run.
 
 =head1 AUTHOR
 
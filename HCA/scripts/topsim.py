@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""All-pairs topic similarities for the topic graph of topset2word.pl.
+
+Topics are compared as probability vectors, either the rows of a (T, W)
+STEM.phi, over words, or the columns of a (D, T) STEM.theta or .testprob,
+normalised over documents.  Similarities are oriented so bigger is
+closer, as topset2word.pl expects of STEM.topcor:
+
+  hellinger  1 - fv_helldist() of util/fvec.c, sum_i sqrt(p_i q_i)
+  cosine     p.q / |p||q|
+  js         1 - the Jensen-Shannon divergence, in bits, so in [0, 1]
+
+Topics are taken a block at a time from the memory mapped matrix and
+compared block against block, hellinger and cosine as one matrix product
+per pair of blocks, js with the vectors also cut in chunks to bound the
+(block, block, chunk) working array; js takes a logarithm per pair of
+topics and word, so is much the slowest.  Each pair of blocks is computed
+once, for both its topics.  Only the running k most similar topics of
+each topic are kept, so the dense (T, T) matrix is never stored.
+
+The output is the edge list of STEM.topcor, written by hca/topics.c: a
+line "t s value" with t > s for each pair in the top k of either topic.
+So for a topic graph from the Hellinger similarity of phi:
+    topsim.py -k 5 RES.phi > RES.topcor
+    topset2word.pl RES RESDIR
+
+Usage:
+    topsim.py [-m hellinger|cosine|js] [-k 10] [--min V] MODEL.phi|.theta
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+import hcamat
+
+MEASURES = ("hellinger", "cosine", "js")
+
+# bound on working arrays, in elements
+WORK_SIZE = 1 << 24
+
+
+class TopicVectors(object):
+    """The topic vectors of a .phi, .theta or .testprob file, by block.
+
+    Attributes
+    ----------
+    ``T`` : int
+        Number of topics.
+
+    ``size`` : int
+        Length of each vector, W or D.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith(".phi"):
+            self.mat = hcamat.load_phi(path)
+            self.by_row = True
+            self.T, self.size = self.mat.shape
+        else:
+            self.mat = hcamat.load_theta(path)
+            self.by_row = False
+            self.size, self.T = self.mat.shape
+
+    def block(self, lo, hi):
+        """Topics lo to hi as a (hi - lo, size) float64 array of rows that
+        sum to one."""
+        if self.by_row:
+            rows = np.array(self.mat[lo:hi], dtype=np.float64)
+        else:
+            rows = np.array(self.mat[:, lo:hi], dtype=np.float64).T
+        total = rows.sum(axis=1)
+        total[total == 0] = 1
+        rows /= total[:, None]
+        return rows
+
+
+def _prepare(rows, measure):
+    """The form of a block the similarity products need."""
+    if measure == "hellinger":
+        return np.sqrt(rows)
+    if measure == "cosine":
+        norm = np.sqrt((rows * rows).sum(axis=1))
+        norm[norm == 0] = 1
+        return rows / norm[:, None]
+    return rows
+
+
+def _entropy_terms(p):
+    """p log2 p, with 0 log 0 = 0."""
+    out = np.zeros_like(p)
+    np.log2(p, out=out, where=p > 0)
+    out *= p
+    return out
+
+
+def similarity(a, b, measure="hellinger"):
+    """Similarities of every row of a to every row of b.
+
+    Parameters
+    ----------
+    a, b : arrays of shape (m, size) and (n, size)
+        Probability vectors, as from TopicVectors.block().
+
+    measure : string
+        One of MEASURES.
+
+    Returns
+    -------
+    sim : array of shape (m, n), float64
+    """
+    if measure in ("hellinger", "cosine"):
+        return np.dot(_prepare(a, measure), _prepare(b, measure).T)
+    if measure != "js":
+        raise ValueError("Unknown measure '%s', need one of %s"
+                         % (measure, ", ".join(MEASURES)))
+    m, n = len(a), len(b)
+    # JS = H(mix) - (H(p) + H(q)) / 2, with H(mix) summed a chunk at a time
+    # in single precision, the cost being in the (m, n, chunk) logarithms
+    mixed = np.zeros((m, n))
+    chunk = max(1, WORK_SIZE // max(m * n, 1))
+    a32, b32 = a.astype(np.float32) / 2, b.astype(np.float32) / 2
+    for lo in range(0, a.shape[1], chunk):
+        mix = a32[:, None, lo:lo + chunk] + b32[None, :, lo:lo + chunk]
+        # tiny makes 0 log 0 = 0 without a mask
+        logs = np.log2(mix + np.float32(1e-30))
+        mix *= logs
+        mixed -= mix.sum(axis=2, dtype=np.float64)
+    own = (_entropy_terms(a).sum(axis=1)[:, None] +
+           _entropy_terms(b).sum(axis=1)[None, :]) / 2
+    return 1 - np.maximum(mixed + own, 0)
+
+
+def _merge(best, best_value, cand, cand_value, k):
+    """Keep the k largest of the current and candidate topics per row."""
+    index = np.concatenate((best, cand), axis=1)
+    value = np.concatenate((best_value, cand_value), axis=1)
+    if value.shape[1] > k:
+        part = np.argpartition(-value, k - 1, axis=1)[:, :k]
+        index = np.take_along_axis(index, part, axis=1)
+        value = np.take_along_axis(value, part, axis=1)
+    return index, value
+
+
+def top_similar(vectors, k=10, measure="hellinger", block=None):
+    """The k most similar topics of every topic.
+
+    Parameters
+    ----------
+    vectors : TopicVectors
+
+    k : int (default=10)
+        Topics to keep per topic.
+
+    measure : string (default="hellinger")
+        One of MEASURES.
+
+    block : int or None
+        Topics per block; by default sized to bound memory.
+
+    Returns
+    -------
+    index : array of shape (T, k), int64
+        The most similar other topics, in no order; -1 where T <= k.
+
+    value : array of shape (T, k), float64
+        Their similarities; -inf where index is -1.
+    """
+    T = vectors.T
+    k = max(1, k)
+    if block is None:
+        block = max(1, min(T, int(np.sqrt(WORK_SIZE)),
+                           WORK_SIZE // max(vectors.size, 1)))
+    index = np.full((T, k), -1, dtype=np.int64)
+    value = np.full((T, k), -np.inf)
+    for lo in range(0, T, block):
+        hi = min(lo + block, T)
+        rows = vectors.block(lo, hi)
+        for lo2 in range(0, hi, block):
+            hi2 = min(lo2 + block, T)
+            other = rows if lo2 == lo else vectors.block(lo2, hi2)
+            sim = similarity(rows, other, measure)
+            if lo2 == lo:
+                np.fill_diagonal(sim, -np.inf)
+            cand = np.broadcast_to(np.arange(lo2, hi2), sim.shape)
+            index[lo:hi], value[lo:hi] = _merge(index[lo:hi], value[lo:hi],
+                                                cand, sim, k)
+            if lo2 != lo:
+                cand = np.broadcast_to(np.arange(lo, hi), sim.T.shape)
+                index[lo2:hi2], value[lo2:hi2] = _merge(
+                    index[lo2:hi2], value[lo2:hi2], cand, sim.T, k)
+    return index, value
+
+
+def edges(index, value, minimum=None):
+    """The pairs of top_similar() as arrays t, s, value with t > s.
+
+    Each pair is given once, though it may be in the top k of both its
+    topics; pairs with value not above minimum are left out.
+    """
+    t = np.repeat(np.arange(len(index)), index.shape[1])
+    s = index.ravel()
+    v = value.ravel()
+    keep = s >= 0
+    if minimum is not None:
+        keep &= v > minimum
+    t, s, v = t[keep], s[keep], v[keep]
+    t, s = np.maximum(t, s), np.minimum(t, s)
+    order = np.lexsort((s, t))
+    t, s, v = t[order], s[order], v[order]
+    first = np.ones(len(t), dtype=bool)
+    first[1:] = (t[1:] != t[:-1]) | (s[1:] != s[:-1])
+    return t[first], s[first], v[first]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Topic similarity edge list in the .topcor format.")
+    parser.add_argument("model", help="MODEL.phi, or MODEL.theta/.testprob "
+                        "to compare topics over documents")
+    parser.add_argument("-m", "--measure", default="hellinger",
+                        choices=MEASURES,
+                        help="similarity (default hellinger)")
+    parser.add_argument("-k", type=int, default=10,
+                        help="most similar topics kept per topic")
+    parser.add_argument("--min", type=float,
+                        help="leave out similarities not above this")
+    parser.add_argument("-b", "--block", type=int,
+                        help="topics per block (default by memory)")
+    args = parser.parse_args()
+    index, value = top_similar(TopicVectors(args.model), args.k,
+                               args.measure, args.block)
+    out = sys.stdout
+    for t, s, v in zip(*edges(index, value, args.min)):
+        out.write("%d %d %0.6f\n" % (t, s, v))
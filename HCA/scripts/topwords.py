@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""Top words of every topic of a saved hca model, for word clouds.
+
+The top k words of all topics are found together from the (T, W) phi
+matrix (STEM.phi) or topic-word counts (STEM.nwt), a block of topics at a
+time with numpy.argpartition, rather than sorting each topic.  The result
+is cached in MODEL.topK.npz, keyed by the size and mtime of the model
+file, so regenerating clouds after a parameter change costs a file read.
+
+frequencies() gives the (word, freq, rank) triples that
+WordCloud.generate_from_frequencies() takes.  With a df vector the rank is
+the weight over df, as topset2word.pl does, otherwise the weight itself.
+
+Usage:
+    topwords.py [-k 10] [--df STEM.df] MODEL STEM.tokens > RES.txt
+prints one line per topic in the "W1,F1,R1 W2,F2,R2" form read by
+WordCloud.process_text_data().
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+
+import hcamat
+
+
+def top_k(mat, k, block=256):
+    """Find the k largest entries of each row of a matrix.
+
+    Parameters
+    ----------
+    mat : array of shape (T, W), possibly a numpy.memmap
+        Weights, e.g. phi.
+
+    k : int
+        Entries to keep per row.
+
+    block : int (default=256)
+        Rows processed at once, bounding the working memory.
+
+    Returns
+    -------
+    index : array of shape (T, k), int32
+        Column of each top entry, largest first.
+
+    weight : array of shape (T, k), float32
+        The entries themselves.
+    """
+    T, W = mat.shape
+    k = min(k, W)
+    index = np.empty((T, k), dtype=np.int32)
+    weight = np.empty((T, k), dtype=np.float32)
+    for t0 in range(0, T, block):
+        rows = np.asarray(mat[t0:t0 + block], dtype=np.float32)
+        part = np.argpartition(-rows, k - 1, axis=1)[:, :k]
+        vals = np.take_along_axis(rows, part, axis=1)
+        order = np.argsort(-vals, axis=1, kind="stable")
+        index[t0:t0 + block] = np.take_along_axis(part, order, axis=1)
+        weight[t0:t0 + block] = np.take_along_axis(vals, order, axis=1)
+    return index, weight
+
+
+def read_tokens(path):
+    """Read a .tokens file, one token per line.
+
+    Lines with several fields, as written by linkTables, have the word as
+    the last field.
+    """
+    with open(path, "rb") as f:
+        return [(line.decode("utf-8").split() or [""])[-1] for line in f]
+
+
+def _load_model(path):
+    if path.endswith(".nwt"):
+        return hcamat.load_nwt(path)
+    return hcamat.load_phi(path)
+
+
+class TopWords(object):
+    """Top-k word index over all topics of a model.
+
+    Parameters
+    ----------
+    model : string
+        A .phi or .nwt file.
+
+    k : int (default=10)
+        Words per topic.
+
+    tokens : list of strings or None
+        Vocabulary, e.g. from read_tokens(); word ids are used if None.
+
+    cache : bool (default=True)
+        Read and write the MODEL.topK.npz cache.
+
+    Attributes
+    ----------
+    ``index_``, ``weight_`` : arrays of shape (T, k)
+        As returned by top_k().
+    """
+
+    def __init__(self, model, k=10, tokens=None, cache=True):
+        self.model = model
+        self.k = k
+        self.tokens = tokens
+        stat = os.stat(model)
+        key = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        cache_file = "%s.top%d.npz" % (model, k)
+        if cache and os.path.exists(cache_file):
+            # an unreadable cache is a miss, and is written again
+            try:
+                with np.load(cache_file) as saved:
+                    if np.array_equal(saved["key"], key):
+                        self.index_ = saved["index"]
+                        self.weight_ = saved["weight"]
+                        return
+            except (IOError, OSError, EOFError, KeyError, ValueError,
+                    zipfile.BadZipFile):
+                pass
+        self.index_, self.weight_ = top_k(_load_model(model), k)
+        if cache:
+            # written atomically, another process may be reading the cache
+            tmp = None
+            try:
+                fd, tmp = tempfile.mkstemp(
+                    dir=os.path.dirname(cache_file) or ".", suffix=".npz")
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, key=key, index=self.index_,
+                             weight=self.weight_)
+                os.replace(tmp, cache_file)
+            except (IOError, OSError):
+                if tmp and os.path.exists(tmp):
+                    os.remove(tmp)
+
+    @property
+    def T(self):
+        return self.index_.shape[0]
+
+    def word(self, w):
+        return self.tokens[w] if self.tokens is not None else str(w)
+
+    def words(self, topic):
+        """List of (word, weight) for a topic, largest first."""
+        return [(self.word(w), float(p)) for w, p in
+                zip(self.index_[topic], self.weight_[topic])]
+
+    def frequencies(self, topic, df=None):
+        """Word cloud input for a topic.
+
+        Parameters
+        ----------
+        topic : int
+
+        df : array of shape (W,) or None
+            Document frequencies; if given, rank words by weight over df.
+
+        Returns
+        -------
+        frequencies : list of tuples (string, float, float)
+            Word, weight relative to the largest, and rank in [0, 1].
+        """
+        index = self.index_[topic]
+        weight = self.weight_[topic].astype(np.float64)
+        freq = weight / (weight.max() + 1e-30)
+        if df is None:
+            rank = freq
+        else:
+            rank = weight / (np.asarray(df, dtype=np.float64)[index] + 0.001)
+            rank = rank / (rank.max() + 1e-30)
+        return [(self.word(w), float(f), float(r))
+                for w, f, r in zip(index, freq, rank)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Print the top words of every topic as word cloud input.")
+    parser.add_argument("model", help="STEM.phi or STEM.nwt file")
+    parser.add_argument("tokens", help="STEM.tokens vocabulary file")
+    parser.add_argument("-k", type=int, default=10, help="words per topic")
+    parser.add_argument("--df", help="document frequency file, one per word")
+    parser.add_argument("--nocache", action="store_true",
+                        help="do not use the MODEL.topK.npz cache")
+    args = parser.parse_args()
+    df = np.loadtxt(args.df) if args.df else None
+    top = TopWords(args.model, args.k, read_tokens(args.tokens),
+                   cache=not args.nocache)
+    out = sys.stdout
+    for t in range(top.T):
+        out.write(" ".join("%s,%g,%g" % triple
+                           for triple in top.frequencies(t, df)) + "\n")
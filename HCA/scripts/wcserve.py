@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+"""A word cloud render daemon on a Unix socket, and its client.
+
+Rendering a cloud on demand with wordcloud_cli.py pays interpreter start
+up, the NumPy and PIL imports, the stopword file and the font load every
+time.  "wcserve.py serve" pays them once: an asyncio front end accepts
+render jobs on a Unix domain socket and hands them to a pool of worker
+processes, which keep fonts, glyph extents and masks warm between jobs.
+Finished renders are kept in a least recently used cache keyed by a hash
+of the job, and a job already being rendered is not rendered twice.
+
+A job is one line of JSON:
+
+    {"words": [["church", 1.0, 1.0], ["pope", 0.5, 0.8], ...],
+     "width": 400, "height": 200, "hue": 20, "background": "white",
+     "mask": "heart", "format": "png", "seed": 1}
+
+"words" are (word, freq, rank) triples, or "text" gives them in the
+"W1,F1,R1 W2,F2,R2" form of wordcloud_batch.py.  "hue" is the hue of
+the word colors, "background" the background color, both as WordCloud
+takes them.  "mask" names MASKDIR/NAME.png of the server's --masks
+directory, white pixels being masked out.  "format" is "png", "jpeg",
+"svg" or "html".
+Without a "seed" the seed is taken from the job hash, so a job always
+gives the same image.  All but "words" or "text" are optional.
+
+The reply is a line of JSON, {"ok": true, "format": ..., "size": N,
+"cached": ...}, followed by the N bytes of the image, or {"ok": false,
+"error": ...}.  {"op": "stats"} asks for the counters of the server.
+
+Needs the modified "wordcloud.py" installed in the wordcloud package,
+see README.txt.
+
+Usage:
+    wcserve.py serve [--socket PATH] [--jobs N] [--masks DIR] &
+    wcserve.py render [--socket PATH] [-o OUT.png] JOB.json|-
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import hashlib
+import io
+import json
+import os
+import sys
+from collections import OrderedDict
+
+# the wordcloud.py beside this script belongs inside the installed package
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path = [p for p in sys.path if os.path.abspath(p or ".") != _here]
+
+FORMATS = ("png", "jpeg", "svg", "html")
+
+DEFAULT_SOCKET = "/tmp/wcserve.%d.sock" % os.getuid()
+
+
+def normalise_job(job):
+    """The canonical form of a job, as hashed for the cache.
+
+    Raises
+    ------
+    ValueError
+        If the job is malformed.
+    """
+    if "words" in job:
+        words = [[str(w), float(f), float(r)] for w, f, r in job["words"]]
+    elif "text" in job:
+        words = [[w, float(f), float(r)] for w, f, r in
+                 (triple.split(",") for triple in job["text"].split())]
+    else:
+        raise ValueError("Job needs \"words\" or \"text\"")
+    fmt = job.get("format", "png").lower()
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format '%s', need one of %s"
+                         % (fmt, ", ".join(FORMATS)))
+    mask = job.get("mask")
+    if mask is not None and (not mask or "/" in mask or mask.startswith(".")):
+        raise ValueError("Bad mask name '%s'" % mask)
+    return {"words": words, "width": int(job.get("width", 400)),
+            "height": int(job.get("height", 200)),
+            "hue": int(job.get("hue", 20)),
+            "background": job.get("background", "black"), "mask": mask,
+            "format": fmt, "seed": job.get("seed")}
+
+
+def job_key(job):
+    """Hash of a normalised job."""
+    text = json.dumps(job, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# set in each worker by _init_worker()
+_worker = {}
+
+
+def _init_worker(options, mask_dir):
+    import numpy as np
+    from PIL import Image
+    from wordcloud import wordcloud
+    masks = {}
+    if mask_dir:
+        for name in sorted(os.listdir(mask_dir)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() == ".png":
+                masks[stem] = np.array(Image.open(os.path.join(mask_dir,
+                                                               name)))
+    wordcloud.MASK_CACHE_SIZE = max(wordcloud.MASK_CACHE_SIZE, len(masks))
+    for mask in masks.values():
+        wordcloud.mask_integral(mask)
+    font_path = options.get("font_path") or wordcloud.FONT_PATH
+    wordcloud.get_font(font_path, wordcloud.REFERENCE_SIZE)
+    _worker.update(options=options, masks=masks)
+
+
+def render(job):
+    """Render a normalised job in a worker, returning the image bytes."""
+    from wordcloud import WordCloud
+    mask = None
+    if job["mask"] is not None:
+        if job["mask"] not in _worker["masks"]:
+            raise ValueError("No mask '%s'" % job["mask"])
+        mask = _worker["masks"][job["mask"]]
+    seed = job["seed"]
+    if seed is None:
+        seed = int(job_key(job)[:8], 16)
+    wc = WordCloud(width=job["width"], height=job["height"], hue=job["hue"],
+                   background_color=job["background"], mask=mask,
+                   random_state=int(seed), **_worker["options"])
+    wc.generate_from_frequencies([tuple(triple) for triple in job["words"]])
+    if job["format"] == "svg":
+        return wc.to_svg().encode("utf-8")
+    if job["format"] == "html":
+        return wc.to_html().encode("utf-8")
+    out = io.BytesIO()
+    wc.to_image().save(out, job["format"])
+    return out.getvalue()
+
+
+async def _answers(path, timeout=2.0):
+    """Whether a render daemon replies on the socket PATH."""
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(path), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    # the workers of a killed daemon still hold its socket open, so
+    # connecting is not enough: the daemon has to answer
+    try:
+        writer.write(json.dumps({"op": "stats"}).encode("utf-8") + b"\n")
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        return json.loads(line.decode("utf-8")).get("ok", False)
+    except (OSError, ValueError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+class RenderServer(object):
+    """The asyncio front end: socket, render cache and worker pool.
+
+    Parameters
+    ----------
+    n_jobs : int (default=0)
+        Worker processes; 0 for one per CPU.
+
+    cache_size : int (default=256)
+        Renders kept.
+
+    mask_dir : string or None
+        Directory of NAME.png masks.
+
+    options : keyword arguments
+        Passed on to WordCloud, e.g. font_path.
+    """
+
+    def __init__(self, n_jobs=0, cache_size=256, mask_dir=None, **options):
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.initargs = (options, mask_dir)
+        self.pool = self._new_pool()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.stats = {"requests": 0, "hits": 0, "renders": 0, "errors": 0}
+
+    def _new_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            self.n_jobs, initializer=_init_worker, initargs=self.initargs)
+
+    async def _render(self, job):
+        """Render in the pool, replacing it once if a worker has died."""
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            return await loop.run_in_executor(pool, render, job)
+        except concurrent.futures.process.BrokenProcessPool:
+            # other renders caught in the same crash may have replaced it
+            if self.pool is pool:
+                pool.shutdown(wait=False)
+                self.pool = self._new_pool()
+            return await loop.run_in_executor(self.pool, render, job)
+
+    async def get(self, job):
+        """Image bytes of a normalised job, and whether it was cached."""
+        key = job_key(job)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.cache[key], True
+        if key in self.pending:
+            self.stats["hits"] += 1
+            return await asyncio.shield(self.pending[key]), True
+        future = asyncio.ensure_future(self._render(job))
+        self.pending[key] = future
+        try:
+            data = await future
+        finally:
+            del self.pending[key]
+        self.stats["renders"] += 1
+        self.cache[key] = data
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return data, False
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.stats["requests"] += 1
+                data = b""
+                try:
+                    job = json.loads(line.decode("utf-8"))
+                    if job.get("op") == "stats":
+                        reply = dict(self.stats, ok=True,
+                                     cached=len(self.cache))
+                    else:
+                        job = normalise_job(job)
+                        data, cached = await self.get(job)
+                        reply = {"ok": True, "format": job["format"],
+                                 "size": len(data), "cached": cached}
+                except Exception as err:
+                    self.stats["errors"] += 1
+                    reply = {"ok": False, "error": str(err)}
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n" + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            if await _answers(path):
+                raise IOError("A render daemon is already serving '%s'"
+                              % path)
+            # left behind by a daemon that died
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        os.chmod(path, 0o600)
+        async with server:
+            await server.serve_forever()
+
+
+class RenderClient(object):
+    """A blocking client of the render daemon, keeping its connection.
+
+    Parameters
+    ----------
+    path : string
+        The daemon's socket.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        import socket
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile("rb")
+
+    def _call(self, job):
+        self.sock.sendall(json.dumps(job).encode("utf-8") + b"\n")
+        line = self.file.readline()
+        if not line:
+            raise IOError("Render daemon closed the connection")
+        reply = json.loads(line.decode("utf-8"))
+        if not reply["ok"]:
+            raise ValueError(reply["error"])
+        return reply
+
+    def render(self, job):
+        """Render a job (a dict as described above).
+
+        Returns
+        -------
+        data : bytes
+            The image file contents.
+
+        reply : dict
+            The reply header, with "cached".
+        """
+        reply = self._call(job)
+        data = self.file.read(reply["size"])
+        if len(data) != reply["size"]:
+            raise IOError("Render daemon closed the connection")
+        return data, reply
+
+    def stats(self):
+        """The counters of the daemon."""
+        return self._call({"op": "stats"})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Word cloud render daemon and client.")
+    sub = parser.add_subparsers(dest="command")
+    serve = sub.add_parser("serve", help="run the daemon")
+    serve.add_argument("-j", "--jobs", type=int, default=0,
+                       help="worker processes (default one per CPU)")
+    serve.add_argument("--cache", type=int, default=256,
+                       help="renders kept in the cache")
+    serve.add_argument("--masks", help="directory of NAME.png masks")
+    serve.add_argument("--fontfile", help="font file to use")
+    serve.add_argument("--margin", type=int, default=2,
+                       help="spacing to leave around words")
+    serve.add_argument("--relative_scaling", type=float, default=0,
+                       help="scaling of words by frequency (0 - 1)")
+    client = sub.add_parser("render", help="send a job to the daemon")
+    client.add_argument("job", help="JSON job file, - for stdin")
+    client.add_argument("-o", "--output", help="image file (default stdout)")
+    for command in (serve, client):
+        command.add_argument("--socket", default=DEFAULT_SOCKET,
+                             help="socket path (default %s)" % DEFAULT_SOCKET)
+    args = parser.parse_args()
+    if args.command == "serve":
+        options = dict(margin=args.margin,
+                       relative_scaling=args.relative_scaling)
+        if args.fontfile:
+            options["font_path"] = args.fontfile
+        server = RenderServer(args.jobs, args.cache, args.masks, **options)
+        try:
+            asyncio.run(server.serve(args.socket))
+        except KeyboardInterrupt:
+            pass
+        except IOError as err:
+            sys.exit(str(err))
+    elif args.command == "render":
+        if args.job == "-":
+            job = json.load(sys.stdin)
+        else:
+            with open(args.job) as f:
+                job = json.load(f)
+        client = RenderClient(args.socket)
+        data, reply = client.render(job)
+        client.close()
+        if args.output:
+            with open(args.output, "wb") as f:
+                f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+    else:
+        parser.print_help()
@@ -9,6 +9,12 @@
 # License: MIT
 
 import warnings
+import copy
+import hashlib
+import multiprocessing
+import json
+import time
+from collections import OrderedDict
 from random import Random
 import os
 import re
@@ -22,21 +28,247 @@ from PIL import ImageColor
 from PIL import ImageDraw
 from PIL import ImageFont
 
-from .query_integral_image import query_integral_image
-
 item1 = itemgetter(1)
 
 FONT_PATH = os.environ.get("FONT_PATH", os.path.join(os.path.dirname(__file__),
                                                      "DroidSansMono.ttf"))
-STOPWORDS = set([x.strip() for x in open(os.path.join(os.path.dirname(__file__),
-                                                      'stopwords')).read().split('\n')])
+try:
+    with open(os.path.join(os.path.dirname(__file__), 'stopwords')) as f:
+        STOPWORDS = set([x.strip() for x in f.read().split('\n')])
+except IOError:
+    # not installed in the wordcloud package; hca input has no stopwords
+    STOPWORDS = set()
+
+# fonts loaded so far, shared by all WordCloud objects in the process
+FONT_CACHE_SIZE = 256
+_truetype_cache = OrderedDict()
+_font_cache = OrderedDict()
+
+
+# exact text extents, by font, size and word
+EXTENT_CACHE_SIZE = 65536
+_extent_cache = OrderedDict()
+
+# size at which extents are measured for estimating those at other sizes
+REFERENCE_SIZE = 100
+
+# base integral images of masks, by mask content
+MASK_CACHE_SIZE = 16
+_mask_cache = OrderedDict()
+
+
+def _cached(cache, key, load, size=FONT_CACHE_SIZE):
+    """Look up key in a least recently used cache, calling load() on a miss."""
+    value = cache.pop(key, None)
+    if value is None:
+        value = load()
+        if len(cache) >= size:
+            cache.popitem(last=False)
+    cache[key] = value
+    return value
+
+
+def get_font(font_path, font_size, orientation=None):
+    """Load a font at a size, transposed to an orientation, through a cache.
+
+    Loading a TrueType font parses the file, which dominates the cost of
+    trying a font size.  The FreeTypeFont and TransposedFont objects are
+    kept in bounded least recently used caches keyed by (font_path,
+    font_size) and (font_path, font_size, orientation), so each size is
+    loaded once per process however many clouds are made.
+
+    Parameters
+    ----------
+    font_path : string
+        Font path, as for ImageFont.truetype.
+
+    font_size : int
+        Size in points.
+
+    orientation : int or None (default=None)
+        As for ImageFont.TransposedFont, e.g. Image.ROTATE_90.
+
+    Returns
+    -------
+    font : ImageFont.TransposedFont
+    """
+    def load():
+        font = _cached(_truetype_cache, (font_path, font_size),
+                       lambda: ImageFont.truetype(font_path, font_size))
+        return ImageFont.TransposedFont(font, orientation=orientation)
+    return _cached(_font_cache, (font_path, font_size, orientation), load)
+
+
+def text_extent(font_path, word, font_size, orientation=None):
+    """Exact size of a word as drawn by PIL, through a cache.
+
+    The width and height of the horizontal text are measured once per
+    (font_path, font_size, word) and kept in a bounded least recently used
+    cache shared by all clouds; the other orientation just swaps them.
+
+    Parameters
+    ----------
+    font_path : string
+
+    word : string
+
+    font_size : int
+
+    orientation : int or None (default=None)
+        As for get_font().
+
+    Returns
+    -------
+    box_size : tuple (int, int)
+        Width and height, as draw.textsize() gives them.
+    """
+    box_size = _cached(_extent_cache, (font_path, font_size, word),
+                       lambda: get_font(font_path, font_size).getsize(word),
+                       EXTENT_CACHE_SIZE)
+    if orientation in (Image.ROTATE_90, Image.ROTATE_270):
+        return box_size[1], box_size[0]
+    return box_size
+
+
+def text_extent_bounds(font_path, word, font_size, orientation=None):
+    """Estimated bounds on text_extent() from the extent at REFERENCE_SIZE.
+
+    Extents scale with the font size up to the rounding of each glyph's
+    advance and of the line height, which is allowed for with a slack of
+    2 pixels per character (plus one) across and 2 pixels down, plus 2
+    percent either way.  The slack is a heuristic, not a guarantee: at
+    the smallest sizes hinting can make glyphs, fallback boxes above all,
+    larger than the upper bound.  Use the lower bound to rule sizes out,
+    and measure before relying on a size.
+
+    Returns
+    -------
+    lower, upper : tuples (int, int)
+        Estimated lower and upper bounds on the width and height.
+    """
+    width, height = text_extent(font_path, word, REFERENCE_SIZE)
+    ratio = font_size / float(REFERENCE_SIZE)
+    width, height = width * ratio, height * ratio
+    slack_x = 0.02 * width + 2 * (len(word) + 1)
+    slack_y = 0.02 * height + 2
+    lower = (max(0, int(width - slack_x)), max(0, int(height - slack_y)))
+    upper = (int(width + slack_x) + 1, int(height + slack_y) + 1)
+    if orientation in (Image.ROTATE_90, Image.ROTATE_270):
+        return lower[::-1], upper[::-1]
+    return lower, upper
+
+
+def _cached_text_extent(font_path, word, font_size, orientation=None):
+    """text_extent() if it is in the cache, else None; without measuring."""
+    box_size = _extent_cache.get((font_path, font_size, word))
+    if box_size is not None and orientation in (Image.ROTATE_90,
+                                                Image.ROTATE_270):
+        return box_size[1], box_size[0]
+    return box_size
+
+
+def mask_integral(mask):
+    """Base integral image of the occupancy map for a mask, through a cache.
+
+    White (255) pixels, or pixels white in all of the first three channels,
+    are masked out.  The result is kept in a bounded least recently used
+    cache keyed by the shape, type and a hash of the contents of the mask,
+    so clouds drawn on the same mask only pay for hashing it.
+
+    Parameters
+    ----------
+    mask : nd-array of shape (height, width) or (height, width, channels)
+
+    Returns
+    -------
+    integral : array of shape (height, width), uint32
+        Read-only; IntegralOccupancyMap copies it.
+    """
+    mask = np.ascontiguousarray(mask)
+    if mask.ndim not in (2, 3):
+        raise ValueError("Got mask of invalid shape: %s" % str(mask.shape))
+
+    def load():
+        if mask.ndim == 2:
+            boolean_mask = mask == 255
+        else:
+            # if all channels are white, mask out
+            boolean_mask = np.all(mask[:, :, :3] == 255, axis=-1)
+        integral = IntegralOccupancyMap(mask.shape[0], mask.shape[1],
+                                        boolean_mask).integral
+        integral.setflags(write=False)
+        return integral
+    key = (mask.shape, mask.dtype.str, hashlib.sha1(mask).hexdigest())
+    return _cached(_mask_cache, key, load, MASK_CACHE_SIZE)
+
+
+def _box_areas(integral_image, size_x, size_y):
+    """Sum of the image in the size_x by size_y box at every position.
+
+    Returns None if the box does not fit.  The sums are taken in uint32 and
+    wrap round, like those of query_integral_image, so only zero matters.
+    """
+    x, y = integral_image.shape
+    if size_x >= x or size_y >= y:
+        return None
+    return (integral_image[:x - size_x, :y - size_y]
+            + integral_image[size_x:, size_y:]
+            - integral_image[size_x:, :y - size_y]
+            - integral_image[:x - size_x, size_y:])
+
+
+def query_integral_image_numpy(integral_image, size_x, size_y, random_state):
+    """Pick a random free position for a box, with NumPy.
+
+    A drop-in for the compiled query_integral_image, used when it is not
+    built.  The free test is done for all positions at once with four
+    shifted slices of the integral image, rather than a loop per pixel.
+    The same random numbers are drawn and the same position returned as
+    by the compiled version: goal = random_state.randint(0, hits), and the
+    goal-th free position in row major order, or None if goal is 0.
+
+    Parameters
+    ----------
+    integral_image : array of shape (height, width), uint32
+        Summed-area table of the occupied canvas.
+
+    size_x, size_y : int
+        Height and width of the box.
+
+    random_state : random.Random object
+
+    Returns
+    -------
+    position : tuple (int, int) or None
+        Top left corner of the box.
+    """
+    areas = _box_areas(integral_image, size_x, size_y)
+    if areas is None:
+        return None
+    free = np.flatnonzero(areas == 0)
+    hits = len(free)
+    if not hits:
+        return None
+    goal = random_state.randint(0, hits)
+    if goal == 0:
+        return None
+    return divmod(int(free[goal - 1]), areas.shape[1])
+
+
+try:
+    from .query_integral_image import query_integral_image
+except ImportError:
+    query_integral_image = query_integral_image_numpy
 
 
 class IntegralOccupancyMap(object):
-    def __init__(self, height, width, mask):
+    def __init__(self, height, width, mask, integral=None):
         self.height = height
         self.width = width
-        if mask is not None:
+        if integral is not None:
+            # start from a copy of a precomputed integral image
+            self.integral = np.array(integral, dtype=np.uint32)
+        elif mask is not None:
             # the order of the cumsum's is important for speed ?!
             self.integral = np.cumsum(np.cumsum(255 * mask, axis=1),
                                       axis=0).astype(np.uint32)
@@ -62,6 +294,282 @@ class IntegralOccupancyMap(object):
 
         self.integral[pos_x:, pos_y:] = partial_integral
 
+    def update_box(self, delta, pos_x, pos_y):
+        """Add the pixels of a box to the integral image in place.
+
+        Only the box and the region below and right of it change, and
+        outside the box by the box's row, column or total sums, so no
+        cumulative sums are taken beyond the box itself.
+
+        Parameters
+        ----------
+        delta : array of shape (h, w)
+            Increase of the image in the box, e.g. a freshly drawn word.
+
+        pos_x, pos_y : int
+            Top left corner of the box.
+        """
+        h, w = delta.shape
+        if h == 0 or w == 0:
+            return
+        box = np.cumsum(np.cumsum(delta, axis=1, dtype=np.uint32), axis=0,
+                        dtype=np.uint32)
+        integral = self.integral
+        end_x, end_y = pos_x + h, pos_y + w
+        integral[pos_x:end_x, pos_y:end_y] += box
+        integral[pos_x:end_x, end_y:] += box[:, -1:]
+        integral[end_x:, pos_y:end_y] += box[-1:, :]
+        integral[end_x:, end_y:] += box[-1, -1]
+
+    def fits(self, size_x, size_y):
+        """Whether a box of the given size fits anywhere on the free space."""
+        areas = _box_areas(self.integral, size_x, size_y)
+        return areas is not None and not areas.all()
+
+
+class PyramidOccupancyMap(IntegralOccupancyMap):
+    """Occupancy map searched coarse to fine, for large canvases.
+
+    The canvas is split into factor by factor blocks.  The summed-area
+    table of the blocks is just the full resolution one read at the block
+    corners, so it costs nothing to keep.  For a box size, every block of
+    start positions is classed from the blocks around it:
+
+    - blocked, if some block lying wholly inside every box starting in
+      the block is occupied, so no start in it is free;
+    - free, if all blocks touched by any box starting in the block are
+      empty, so every start in it is free;
+    - otherwise on the boundary, and only its starts are tested at full
+      resolution.
+
+    Free positions are counted, and the one picked found, row by row from
+    these classes, so sample_position() returns the same positions, and
+    draws the same random numbers, as the full resolution query: packing
+    is as tight.  The work of a query grows with the boundary of the words
+    placed rather than with the canvas; if the boundary covers more than
+    a share ``dense`` of the canvas the whole canvas is scanned instead.
+
+    Parameters
+    ----------
+    height, width, mask, integral : as for IntegralOccupancyMap
+
+    factor : int (default=8)
+        Block size of the coarse level.
+    """
+
+    dense = 0.1
+
+    def __init__(self, height, width, mask, integral=None, factor=8):
+        super(PyramidOccupancyMap, self).__init__(height, width, mask,
+                                                  integral)
+        self.factor = factor
+
+    def _coarse_integral(self):
+        """Summed-area table of the blocks, with a leading row of zeros."""
+        x, y = self.integral.shape
+        f = self.factor
+        # block corners are every f-th pixel, then the last one
+        rows = np.append(np.arange(f - 1, x - 1, f), x - 1)
+        cols = np.append(np.arange(f - 1, y - 1, f), y - 1)
+        coarse = np.zeros((len(rows) + 1, len(cols) + 1), dtype=np.uint32)
+        coarse[1:, 1:] = self.integral[rows[:, np.newaxis], cols]
+        return coarse
+
+    def _blocks(self, size_x, size_y):
+        """Classify the blocks of start positions for a box.
+
+        Returns None if the box does not fit the canvas, else the numbers
+        of start rows and columns and the boolean arrays of free and of
+        boundary blocks.
+        """
+        x, y = self.integral.shape
+        if size_x >= x or size_y >= y:
+            return None
+        f = self.factor
+        nx, ny = x - size_x, y - size_y
+        # a box starting in block I covers rows I * f + 1 to I * f + f - 1
+        # + size_x, so wholly the blocks I + 1 to I + size_x // f - 1 and in
+        # part at most the blocks I to I + (f - 1 + size_x) // f
+        span_x, span_y = (f - 1 + size_x) // f + 1, (f - 1 + size_y) // f + 1
+        # windows running off the canvas stop at its edge
+        coarse = np.pad(self._coarse_integral(), ((0, span_x), (0, span_y)),
+                        mode="edge")
+        bx, by = (nx + f - 1) // f, (ny + f - 1) // f
+
+        def empty(lo_x, n_x, lo_y, n_y):
+            # whether the n_x by n_y blocks from each block lo_x + I,
+            # lo_y + J are empty
+            x0, x1 = slice(lo_x, lo_x + bx), slice(lo_x + n_x, lo_x + n_x + bx)
+            y0, y1 = slice(lo_y, lo_y + by), slice(lo_y + n_y, lo_y + n_y + by)
+            return (coarse[x1, y1] + coarse[x0, y0]
+                    - coarse[x0, y1] - coarse[x1, y0]) == 0
+
+        open_ = empty(1, max(size_x // f - 1, 0), 1, max(size_y // f - 1, 0))
+        free = empty(0, span_x, 0, span_y)
+        return nx, ny, free, open_ & ~free
+
+    def _test(self, boundary, size_x, size_y, nx, ny):
+        """Free start positions in boundary blocks, as row, column arrays."""
+        f = self.factor
+        block_x, block_y = np.nonzero(boundary)
+        steps = np.arange(f)
+        pos_x = (block_x[:, np.newaxis] * f + steps)[:, :, np.newaxis]
+        pos_y = (block_y[:, np.newaxis] * f + steps)[:, np.newaxis, :]
+        pos_x, pos_y = np.broadcast_arrays(pos_x, pos_y)
+        inside = (pos_x < nx) & (pos_y < ny)
+        pos_x, pos_y = pos_x[inside], pos_y[inside]
+        y = self.integral.shape[1]
+        integral = self.integral.ravel()
+        corner = pos_x * y + pos_y
+        areas = (integral[corner] + integral[corner + size_x * y + size_y]
+                 - integral[corner + size_x * y] - integral[corner + size_y])
+        free = areas == 0
+        return pos_x[free], pos_y[free]
+
+    def _too_dense(self, boundary, nx, ny):
+        return boundary.sum() * self.factor ** 2 > self.dense * nx * ny
+
+    def sample_position(self, size_x, size_y, random_state):
+        blocks = self._blocks(size_x, size_y)
+        if blocks is None:
+            return None
+        nx, ny, free, boundary = blocks
+        if self._too_dense(boundary, nx, ny):
+            return query_integral_image_numpy(self.integral, size_x, size_y,
+                                              random_state)
+        f = self.factor
+        free_x, free_y = self._test(boundary, size_x, size_y, nx, ny)
+        # free starts per row: whole free blocks plus those tested
+        widths = np.minimum(f, ny - f * np.arange(free.shape[1]))
+        per_row = np.repeat(free.dot(widths), f)[:nx]
+        per_row += np.bincount(free_x, minlength=nx)
+        hits = int(per_row.sum())
+        if not hits:
+            return None
+        # the draw of query_integral_image
+        goal = random_state.randint(0, hits)
+        if goal == 0:
+            return None
+        # the goal-th free position in row major order
+        before = np.cumsum(per_row)
+        row = int(np.searchsorted(before, goal))
+        rank = goal - (int(before[row - 1]) if row else 0)
+        cols = [np.arange(f * j, min(f * j + f, ny))
+                for j in np.flatnonzero(free[row // f])]
+        cols.append(free_y[free_x == row])
+        cols = np.sort(np.concatenate(cols))
+        return row, int(cols[rank - 1])
+
+    def fits(self, size_x, size_y):
+        blocks = self._blocks(size_x, size_y)
+        if blocks is None:
+            return False
+        nx, ny, free, boundary = blocks
+        if free.any():
+            return True
+        if self._too_dense(boundary, nx, ny):
+            return super(PyramidOccupancyMap, self).fits(size_x, size_y)
+        return len(self._test(boundary, size_x, size_y, nx, ny)[0]) > 0
+
+
+class LayoutStats(object):
+    """Stage timings and counters of one word cloud layout.
+
+    Filled in by WordCloud.generate_from_frequencies() when the WordCloud
+    has stats set.  Each stage is a call wrapped by timed(); when stats are
+    off nothing is wrapped, so the layout runs at full speed.
+
+    The stages are "measure" (text extents, mostly cache hits), "fits"
+    (bisect font sizing), "sample" (position queries), "font" (font loads
+    for drawing, mostly cache hits), "crop" (the word's box read before
+    and after drawing), "draw", "update" (the integral image) and "color".
+
+    Parameters
+    ----------
+    hook : callable or None (default=None)
+        Called as hook(stage, seconds) after every timed call, e.g. to feed
+        an external profiler or logger.
+
+    Attributes
+    ----------
+    ``times`` : dict of string to float
+        Wall time in seconds spent in each stage.
+
+    ``calls`` : dict of string to int
+        Number of calls of each stage.
+
+    ``retries`` : list of tuples (string, int)
+        Each placed word with its number of font size decrements.
+
+    ``dropped`` : list of strings
+        Words not placed, as min_font_size was reached.
+
+    ``total`` : float
+        Wall time in seconds of the whole layout.
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.times = {}
+        self.calls = {}
+        self.retries = []
+        self.dropped = []
+        self.total = 0.
+
+    def timed(self, stage, func):
+        """Wrap func so its calls are timed and counted under stage."""
+        times, calls, hook = self.times, self.calls, self.hook
+        times.setdefault(stage, 0.)
+        calls.setdefault(stage, 0)
+
+        def timed_func(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.time() - start
+                times[stage] += seconds
+                calls[stage] += 1
+                if hook is not None:
+                    hook(stage, seconds)
+        return timed_func
+
+    def __str__(self):
+        lines = ["%-10s %8s %10s" % ("stage", "calls", "ms")]
+        for stage in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append("%-10s %8d %10.2f" % (stage, self.calls[stage],
+                                               1000 * self.times[stage]))
+        lines.append("%-10s %8s %10.2f" % ("total", "", 1000 * self.total))
+        lines.append("placed %d words with %d retries, dropped %d"
+                     % (len(self.retries),
+                        sum(n for _, n in self.retries), len(self.dropped)))
+        return "\n".join(lines)
+
+
+LAYOUT_OBJECTIVES = ("words", "area", "coverage")
+
+
+def _seeded_layout(job):
+    """Lay out a WordCloud with a given seed, for WordCloud._generate_best.
+
+    Returns
+    -------
+    words, layout, stats : the ``words_``, ``layout_`` and ``stats_``
+    """
+    wc, frequencies, seed = job
+    wc = copy.copy(wc)
+    wc.n_layouts = 1
+    wc.random_state = Random(seed)
+    wc.generate_from_frequencies(frequencies)
+    return wc.words_, wc.layout_, wc.stats_
+
+
+def _escape(text):
+    """Escape text for XML content or a double quoted attribute."""
+    return (text.replace("&", "&amp;").replace("<", "&lt;")
+            .replace(">", "&gt;").replace('"', "&quot;"))
+
+
 def random_color_func(word=None, font_size=None, position=None, rank=None,
                       hue=0,
                       orientation=None, font_path=None, random_state=None):
@@ -181,6 +689,42 @@ class WordCloud(object):
         If you want to consider the word frequencies and not only their rank, relative_scaling
         around .5 often looks good.
 
+    placement : string (default="full")
+        How free positions are searched.  "full" scans the whole canvas for
+        every query.  "pyramid" first finds candidate blocks on a coarse
+        grid and only tests positions in those at full resolution, see
+        PyramidOccupancyMap; layouts are the same, large canvases faster.
+
+    pyramid_factor : int (default=8)
+        Block size of the coarse grid for placement="pyramid".
+
+    stats : bool or callable (default=False)
+        Collect a LayoutStats of where the layout time goes in ``stats_``.
+        A callable is passed on as the LayoutStats hook.
+
+    n_layouts : int (default=1)
+        Number of layouts to try, each with its own seed drawn from
+        random_state, keeping the best by objective.  The result only
+        depends on random_state, not on n_jobs.
+
+    objective : string (default="words")
+        How layouts are compared: "words" placed, total glyph "area", or
+        "coverage", the sum of the frequencies of the words placed.  Ties
+        go to the earlier seed.
+
+    n_jobs : int (default=1)
+        Processes running the n_layouts layouts; 0 for one per CPU.  Run
+        in one process when already inside a worker process.  With more
+        than one, color_func must be picklable and a stats hook is not
+        called.
+
+    font_sizing : string (default="linear")
+        How to find the size of a word that does not fit.  "linear" tries
+        sizes going down by font_step, sampling a position and orientation
+        for each.  "bisect" picks the orientation first, then binary searches
+        the sizes for the largest that fits anywhere, so only a few
+        measurements and scans of the canvas are needed per word.
+
     Attributes
     ----------
     ``words_``: list of tuples (string, float)
@@ -190,6 +734,12 @@ class WordCloud(object):
         Encodes the fitted word cloud. Encodes for each word the string, font
         size, position, orientation and color.
 
+    ``stats_`` : LayoutStats or None
+        Timings and counters of the last layout, if stats is set.
+
+    ``seed_`` : int
+        Seed of the layout kept, when n_layouts > 1.
+
     Notes
     -----
     Larger canvases with make the code significantly slower. If you need a large
@@ -204,7 +754,10 @@ class WordCloud(object):
                  ranks_only=None, prefer_horizontal=0.9, mask=None, scale=1,
                  color_func=random_color_func, max_words=200, min_font_size=4,
                  stopwords=None, random_state=None, background_color='black',
-                 max_font_size=None, font_step=1, mode="RGB", relative_scaling=0):
+                 max_font_size=None, font_step=1, mode="RGB",
+                 relative_scaling=0, font_sizing="linear", stats=False,
+                 placement="full",
+                 pyramid_factor=8, n_layouts=1, objective="words", n_jobs=1):
         if stopwords is None:
             stopwords = STOPWORDS
         if font_path is None:
@@ -242,6 +795,22 @@ class WordCloud(object):
             raise ValueError("relative_scaling needs to be between 0 and 1, got %f."
                              % relative_scaling)
         self.relative_scaling = relative_scaling
+        if font_sizing not in ("linear", "bisect"):
+            raise ValueError("font_sizing needs to be 'linear' or 'bisect', "
+                             "got %r." % font_sizing)
+        self.font_sizing = font_sizing
+        if placement not in ("full", "pyramid"):
+            raise ValueError("placement needs to be 'full' or 'pyramid', "
+                             "got %r." % placement)
+        self.placement = placement
+        self.pyramid_factor = pyramid_factor
+        self.stats = stats
+        if objective not in LAYOUT_OBJECTIVES:
+            raise ValueError("objective needs to be one of %s, got %r."
+                             % (", ".join(LAYOUT_OBJECTIVES), objective))
+        self.n_layouts = n_layouts
+        self.objective = objective
+        self.n_jobs = n_jobs
         if ranks_only is not None:
             warnings.warn("ranks_only is deprecated and will be removed as"
                           " it had no effect. Look into relative_scaling.", DeprecationWarning)
@@ -262,6 +831,46 @@ class WordCloud(object):
         """
         return self.generate_from_frequencies(frequencies)
 
+    def _fit_font_size(self, measure, box_fits, word, font_size, orientation,
+                       width, height):
+        """Largest size from font_size down, in font_steps, that fits.
+
+        measure(font_path, word, font_size, orientation) gives the box
+        size, box_fits(size_x, size_y) whether a box fits on the width by
+        height canvas.  Sizes ruled out by the lower bound of
+        text_extent_bounds() are not measured; any other size is measured
+        exactly, or found in the cache, before it is accepted.  Returns 0
+        if the word does not fit even at min_font_size.
+        """
+        margin = self.margin
+
+        def fits(k):
+            size = font_size - k * self.font_step
+            lower = text_extent_bounds(self.font_path, word, size,
+                                       orientation)[0]
+            if lower[1] + margin >= height or lower[0] + margin >= width:
+                return False
+            box_size = _cached_text_extent(self.font_path, word, size,
+                                           orientation)
+            if box_size is None:
+                box_size = measure(self.font_path, word, size, orientation)
+            return box_fits(box_size[1] + margin, box_size[0] + margin)
+
+        last = (font_size - self.min_font_size) // self.font_step
+        if last < 0 or not fits(last):
+            return 0
+        if fits(0):
+            return font_size
+        # invariant: step lo does not fit, step hi does
+        lo, hi = 0, last
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if fits(mid):
+                hi = mid
+            else:
+                lo = mid
+        return font_size - hi * self.font_step
+
     def generate_from_frequencies(self, frequencies):
         """Create a word_cloud from words and frequencies.
 
@@ -275,6 +884,16 @@ class WordCloud(object):
         self
 
         """
+        if self.n_layouts > 1:
+            return self._generate_best(frequencies)
+
+        if self.stats:
+            stats = LayoutStats(self.stats if callable(self.stats) else None)
+            start = time.time()
+        else:
+            stats = None
+        self.stats_ = stats
+
         # make sure frequencies are sorted and normalized
         frequencies = sorted(frequencies, key=item1, reverse=True)
         frequencies = frequencies[:self.max_words]
@@ -303,23 +922,36 @@ class WordCloud(object):
             if mask.dtype.kind == 'f':
                 warnings.warn("mask image should be unsigned byte between 0 and"
                               " 255. Got a float array")
-            if mask.ndim == 2:
-                boolean_mask = mask == 255
-            elif mask.ndim == 3:
-                # if all channels are white, mask out
-                boolean_mask = np.all(mask[:, :, :3] == 255, axis=-1)
-            else:
-                raise ValueError("Got mask of invalid shape: %s" % str(mask.shape))
+            integral = mask_integral(mask)
         else:
-            boolean_mask = None
             height, width = self.height, self.width
-        occupancy = IntegralOccupancyMap(height, width, boolean_mask)
+            integral = None
+        if self.placement == "pyramid":
+            occupancy = PyramidOccupancyMap(height, width, None, integral,
+                                            self.pyramid_factor)
+        else:
+            occupancy = IntegralOccupancyMap(height, width, None, integral)
 
         # create image
         img_grey = Image.new("L", (width, height))
         draw = ImageDraw.Draw(img_grey)
-        img_array = np.asarray(img_grey)
         font_sizes, positions, orientations, colors = [], [], [], []
+        bisect = self.font_sizing == "bisect"
+
+        load_font, measure = get_font, text_extent
+        box_fits, sample_position = occupancy.fits, occupancy.sample_position
+        crop, draw_text = img_grey.crop, draw.text
+        update_box = occupancy.update_box
+        color_func = self.color_func
+        if stats is not None:
+            load_font = stats.timed("font", load_font)
+            measure = stats.timed("measure", measure)
+            box_fits = stats.timed("fits", box_fits)
+            sample_position = stats.timed("sample", sample_position)
+            crop = stats.timed("crop", crop)
+            draw_text = stats.timed("draw", draw_text)
+            update_box = stats.timed("update", update_box)
+            color_func = stats.timed("color", color_func)
 
         font_size = self.max_font_size
         last_freq = 1.
@@ -330,54 +962,79 @@ class WordCloud(object):
             rs = self.relative_scaling
             if rs != 0:
                 font_size = int(round((rs * (freq / float(last_freq)) + (1 - rs)) * font_size))
+            retries = 0
+            keep_orientation = bisect
+            if bisect:
+                if random_state.random() < self.prefer_horizontal:
+                    orientation = None
+                else:
+                    orientation = Image.ROTATE_90
+                font_size = self._fit_font_size(measure, box_fits, word,
+                                                font_size, orientation,
+                                                width, height)
+                if font_size < self.min_font_size:
+                    break
             while True:
                 # try to find a position
-                font = ImageFont.truetype(self.font_path, font_size)
                 # transpose font optionally
-                if random_state.random() < self.prefer_horizontal:
+                if keep_orientation:
+                    keep_orientation = False
+                elif random_state.random() < self.prefer_horizontal:
                     orientation = None
                 else:
                     orientation = Image.ROTATE_90
-                transposed_font = ImageFont.TransposedFont(font,
-                                                           orientation=orientation)
-                # get size of resulting text
-                box_size = draw.textsize(word, font=transposed_font)
-                # find possible places using integral image:
-                result = occupancy.sample_position(box_size[1] + self.margin,
-                                                   box_size[0] + self.margin,
-                                                   random_state)
+                # a word too big for the canvas has no place, skip measuring
+                lower = text_extent_bounds(self.font_path, word, font_size,
+                                           orientation)[0]
+                if lower[1] + self.margin >= height or \
+                   lower[0] + self.margin >= width:
+                    result = None
+                else:
+                    # get size of resulting text
+                    box_size = measure(self.font_path, word, font_size,
+                                       orientation)
+                    # find possible places using integral image:
+                    result = sample_position(box_size[1] + self.margin,
+                                             box_size[0] + self.margin,
+                                             random_state)
                 if result is not None or font_size == 0:
                     break
                 # if we didn't find a place, make font smaller
                 font_size -= self.font_step
+                retries += 1
 
             if font_size < self.min_font_size:
                 # we were unable to draw any more
                 break
 
             x, y = np.array(result) + self.margin // 2
-            # actually draw the text
-            draw.text((y, x), word, fill="white", font=transposed_font)
+            transposed_font = load_font(self.font_path, font_size, orientation)
+            # actually draw the text, noting what changes in its box
+            box = (y, x, min(y + box_size[0], width),
+                   min(x + box_size[1], height))
+            before = np.asarray(crop(box), dtype=np.int32)
+            draw_text((y, x), word, fill="white", font=transposed_font)
             positions.append((x, y))
             orientations.append(orientation)
             font_sizes.append(font_size)
-            colors.append(self.color_func(word, font_size=font_size,
-                                          position=(x, y),
-                                          orientation=orientation,
-                                          random_state=random_state,
-                                          rank=rank, hue=self.hue,
-                                          font_path=self.font_path))
-            # recompute integral image
-            if self.mask is None:
-                img_array = np.asarray(img_grey)
-            else:
-                img_array = np.asarray(img_grey) + boolean_mask
-            # recompute bottom right
-            # the order of the cumsum's is important for speed ?!
-            occupancy.update(img_array, x, y)
+            colors.append(color_func(word, font_size=font_size,
+                                     position=(x, y),
+                                     orientation=orientation,
+                                     random_state=random_state,
+                                     rank=rank, hue=self.hue,
+                                     font_path=self.font_path))
+            # add the word to the integral image
+            after = np.asarray(crop(box), dtype=np.int32)
+            update_box((after - before).astype(np.uint32), x, y)
             last_freq = freq
+            if stats is not None:
+                stats.retries.append((word, retries))
 
         self.layout_ = list(zip(frequencies, font_sizes, positions, orientations, colors))
+        if stats is not None:
+            stats.dropped = [word for word, _, _
+                             in frequencies[len(positions):]]
+            stats.total = time.time() - start
         return self
 
     def process_text_data(self, text):
@@ -427,27 +1084,158 @@ class WordCloud(object):
         """
         return self.generate_from_text(text)
 
+    def layout_score(self, layout=None):
+        """Score of a layout by the objective, higher is better.
+
+        Parameters
+        ----------
+        layout : list as ``layout_`` or None
+            Defaults to ``layout_``.
+
+        Returns
+        -------
+        score : tuple
+            Compared as a tuple, the objective first.
+        """
+        if layout is None:
+            self._check_generated()
+            layout = self.layout_
+        area = 0
+        for (word, freq, rank), font_size, _, _, _ in layout:
+            width, height = text_extent(self.font_path, word, font_size)
+            area += width * height
+        words = len(layout)
+        coverage = sum(freq for (word, freq, rank), _, _, _, _ in layout)
+        if self.objective == "area":
+            return area, words
+        if self.objective == "coverage":
+            return coverage, words
+        return words, area
+
+    def _generate_best(self, frequencies):
+        """Run n_layouts seeded layouts, in parallel, and keep the best."""
+        # every layout, and every worker, needs its own pass over the words
+        frequencies = list(frequencies)
+        random_state = self.random_state
+        if random_state is None:
+            random_state = Random()
+        seeds = [random_state.randint(0, 2 ** 31 - 1)
+                 for _ in range(self.n_layouts)]
+        n_jobs = self.n_jobs
+        if n_jobs <= 0:
+            n_jobs = multiprocessing.cpu_count()
+        n_jobs = min(n_jobs, len(seeds))
+        # pool workers are daemons, which may not start processes
+        if n_jobs == 1 or multiprocessing.current_process().daemon:
+            results = [_seeded_layout((self, frequencies, seed))
+                       for seed in seeds]
+        else:
+            template = copy.copy(self)
+            if callable(template.stats):
+                template.stats = True
+            jobs = [(template, frequencies, seed) for seed in seeds]
+            pool = multiprocessing.Pool(n_jobs)
+            try:
+                results = pool.map(_seeded_layout, jobs)
+            except:
+                pool.terminate()
+                raise
+            pool.close()
+            pool.join()
+        scores = [self.layout_score(layout) for _, layout, _ in results]
+        best = max(range(len(seeds)), key=lambda i: (scores[i], -i))
+        self.words_, self.layout_, self.stats_ = results[best]
+        self.seed_ = seeds[best]
+        return self
+
     def _check_generated(self):
         """Check if ``layout_`` was computed, otherwise raise error."""
         if not hasattr(self, "layout_"):
             raise ValueError("WordCloud has not been calculated, call generate first.")
 
+    def _canvas_size(self):
+        """Width and height of the layout canvas."""
+        if self.mask is not None:
+            return self.mask.shape[1], self.mask.shape[0]
+        return self.width, self.height
+
+    def save_layout(self, filename):
+        """Save the fitted layout to a JSON file.
+
+        The file holds the canvas size, font and background, and for each
+        word its frequency, rank, font size, position, orientation and
+        color, so the cloud can be drawn again, at another scale, recolored
+        or written as SVG without fitting it again.
+
+        Parameters
+        ----------
+        filename : string
+            Location to write to.
+
+        Returns
+        -------
+        self
+        """
+        self._check_generated()
+        width, height = self._canvas_size()
+        layout = [[word, freq, rank, int(font_size), int(position[0]),
+                   int(position[1]), orientation, color]
+                  for ((word, freq, rank), font_size, position, orientation,
+                       color) in self.layout_]
+        with open(filename, "w") as f:
+            json.dump({"width": width, "height": height,
+                       "font_path": self.font_path,
+                       "background_color": self.background_color,
+                       "mode": self.mode, "layout": layout},
+                      f, separators=(",", ":"))
+        return self
+
+    def load_layout(self, filename):
+        """Load a layout saved by save_layout().
+
+        Sets ``layout_``, ``words_`` and the canvas size, font path,
+        background and mode from the file, and drops any mask.  The scale
+        is left alone, so a layout can be drawn at any size.
+
+        Parameters
+        ----------
+        filename : string
+            Location to read from.
+
+        Returns
+        -------
+        self
+        """
+        with open(filename, "r") as f:
+            saved = json.load(f)
+        self.width = saved["width"]
+        self.height = saved["height"]
+        self.mask = None
+        self.font_path = saved["font_path"]
+        self.background_color = saved["background_color"]
+        self.mode = saved["mode"]
+        self.words_ = [(word, freq, rank)
+                       for word, freq, rank, _, _, _, _, _ in saved["layout"]]
+        self.layout_ = [((word, freq, rank), font_size, (x, y), orientation,
+                         color)
+                        for (word, freq, rank, font_size, x, y, orientation,
+                             color) in saved["layout"]]
+        return self
+
     def to_image(self):
         self._check_generated()
-        if self.mask is not None:
-            width = self.mask.shape[1]
-            height = self.mask.shape[0]
-        else:
-            height, width = self.height, self.width
+        width, height = self._canvas_size()
 
         img = Image.new(self.mode, (int(width * self.scale), int(height * self.scale)),
                         self.background_color)
         draw = ImageDraw.Draw(img)
-        for (word, count, rank), font_size, position, orientation, color in self.layout_:
-            font = ImageFont.truetype(self.font_path, int(font_size * self.scale))
-            transposed_font = ImageFont.TransposedFont(font,
-                                                       orientation=orientation)
-            pos = (int(position[1] * self.scale), int(position[0] * self.scale))
+        for ((word, count, rank), font_size, position, orientation,
+             color) in self.layout_:
+            transposed_font = get_font(self.font_path,
+                                       int(font_size * self.scale),
+                                       orientation)
+            pos = (int(position[1] * self.scale),
+                   int(position[0] * self.scale))
             draw.text(pos, word, fill=color, font=transposed_font)
         return img
 
@@ -488,6 +1276,9 @@ class WordCloud(object):
     def to_file(self, filename):
         """Export to image file.
 
+        Files ending in ".svg" or ".html" are written by to_svg() and
+        to_html(), anything else as an image by PIL.
+
         Parameters
         ----------
         filename : string
@@ -498,6 +1289,12 @@ class WordCloud(object):
         self
         """
 
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in (".svg", ".html", ".htm"):
+            text = self.to_svg() if ext == ".svg" else self.to_html()
+            with open(filename, "wb") as f:
+                f.write(text.encode("utf-8"))
+            return self
         img = self.to_image()
         img.save(filename)
         return self
@@ -522,5 +1319,56 @@ class WordCloud(object):
         """
         return self.to_array()
 
+    def to_svg(self):
+        """Export to SVG, straight from the layout.
+
+        Words are placed as SVG text in the font family of font_path, with
+        the baseline where PIL would put it, so the SVG matches to_image()
+        as long as the viewer has the font.  Nothing is rasterized.
+
+        Returns
+        -------
+        svg : string
+        """
+        self._check_generated()
+        width, height = self._canvas_size()
+        width, height = int(width * self.scale), int(height * self.scale)
+        family = None
+        lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" '
+                 'height="%d" viewBox="0 0 %d %d">'
+                 % (width, height, width, height)]
+        if self.background_color is not None:
+            lines.append('<rect width="100%%" height="100%%" fill="%s"/>'
+                         % _escape(self.background_color))
+        for ((word, count, rank), font_size, position, orientation,
+             color) in self.layout_:
+            font_size = int(font_size * self.scale)
+            font = get_font(self.font_path, font_size)
+            if family is None:
+                family = font.font.getname()[0]
+            ascent = font.font.getmetrics()[0]
+            x, y = int(position[1] * self.scale), int(position[0] * self.scale)
+            if orientation is None:
+                place = 'x="%d" y="%d"' % (x, y + ascent)
+            else:
+                # PIL rotates the horizontal text a quarter turn anticlockwise
+                place = 'transform="translate(%d,%d) rotate(-90)"' \
+                    % (x + ascent, y + font.getsize(word)[0])
+            lines.append('<text %s font-size="%d" fill="%s">%s</text>'
+                         % (place, font_size, _escape(color), _escape(word)))
+        lines.insert(1, '<g font-family="%s">'
+                     % _escape(family or "sans-serif"))
+        lines.append('</g>')
+        lines.append('</svg>')
+        return "\n".join(lines) + "\n"
+
     def to_html(self):
-        raise NotImplementedError("FIXME!!!")
+        """Export to a standalone HTML page holding the SVG of to_svg().
+
+        Returns
+        -------
+        html : string
+        """
+        return ('<!DOCTYPE html>\n<html>\n'
+                '<head><meta charset="utf-8"></head>\n'
+                '<body>\n%s</body>\n</html>\n' % self.to_svg())
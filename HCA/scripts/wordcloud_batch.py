@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""Render many word clouds in one process, or a pool of them.
+
+Running wordcloud_cli.py once per topic pays interpreter start up, the
+NumPy and PIL imports, the stopword file and the font load for every
+image.  This reads a manifest describing all the clouds instead, one per
+line:
+
+    IMAGEFILE BACKGROUND WIDTH HEIGHT W1,F1,R1 W2,F2,R2 ...
+
+where BACKGROUND is as for "wordcloud_cli.py --background", e.g. "hue=20"
+or "hue=200,white", and the word triples are as for "--text".  Blank
+lines and lines starting with "#" are skipped.
+
+Needs the modified "wordcloud.py" installed in the wordcloud package,
+see README.txt.  Used by topset2word.pl.
+
+Usage:
+    wordcloud_batch.py [--jobs N] [--fontfile F] MANIFEST
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+# the wordcloud.py beside this script belongs inside the installed package
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path = [p for p in sys.path if os.path.abspath(p or ".") != _here]
+
+from wordcloud import WordCloud
+
+
+def read_manifest(path):
+    """Read a manifest file.
+
+    Returns
+    -------
+    jobs : list of tuples (imagefile, background, width, height, text)
+    """
+    jobs = []
+    with open(path, "rb") as f:
+        for n, line in enumerate(f, 1):
+            line = line.decode("utf-8").strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(None, 4)
+            if len(fields) < 4:
+                raise ValueError("Line %d of '%s' needs IMAGEFILE BACKGROUND "
+                                 "WIDTH HEIGHT" % (n, path))
+            text = fields[4] if len(fields) > 4 else ""
+            jobs.append((fields[0], fields[1], int(fields[2]),
+                         int(fields[3]), text))
+    return jobs
+
+
+def render(job, **options):
+    """Render one manifest entry to its image file.
+
+    Parameters
+    ----------
+    job : tuple (imagefile, background, width, height, text)
+
+    options : keyword arguments
+        Passed on to WordCloud, e.g. font_path.
+
+    Returns
+    -------
+    imagefile : string
+    """
+    imagefile, background, width, height, text = job
+    wc = WordCloud(width=width, height=height, background_color=background,
+                   **options)
+    wc.generate(text)
+    wc.to_file(imagefile)
+    return imagefile
+
+
+# keyword arguments for WordCloud, set in each worker
+_options = {}
+
+
+def _init_worker(options):
+    _options.update(options)
+
+
+def _render_job(job):
+    return render(job, **_options)
+
+
+def render_all(jobs, n_jobs=1, **options):
+    """Render every manifest entry, with n_jobs worker processes.
+
+    Parameters
+    ----------
+    jobs : list of tuples as from read_manifest()
+
+    n_jobs : int (default=1)
+        Number of processes; 0 for one per CPU.
+
+    options : keyword arguments
+        Passed on to WordCloud.
+
+    Returns
+    -------
+    imagefiles : list of strings, in order of completion
+    """
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or len(jobs) <= 1:
+        return [render(job, **options) for job in jobs]
+    pool = multiprocessing.Pool(min(n_jobs, len(jobs)), _init_worker,
+                                (options,))
+    try:
+        done = list(pool.imap_unordered(_render_job, jobs))
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render all the word clouds listed in a manifest.")
+    parser.add_argument("manifest", help="file with one cloud per line")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="number of processes (default one per CPU)")
+    parser.add_argument("--fontfile", help="font file to use")
+    parser.add_argument("--margin", type=int, default=2,
+                        help="spacing to leave around words")
+    parser.add_argument("--relative_scaling", type=float, default=0,
+                        help="scaling of words by frequency (0 - 1)")
+    args = parser.parse_args()
+    options = dict(margin=args.margin,
+                   relative_scaling=args.relative_scaling)
+    if args.fontfile:
+        options["font_path"] = args.fontfile
+    for imagefile in render_all(read_manifest(args.manifest), args.jobs,
+                                **options):
+        sys.stderr.write(" %s" % imagefile)
+    sys.stderr.write("\n")